@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Mise à l'échelle du débit de l'API École Smart de 1 à N workers
+
+Pour chaque nombre de workers, lance prefork.py sur un port libre, attend la
+première réponse, puis génère la charge depuis plusieurs processus clients
+(pour que le générateur ne soit pas le goulot) et mesure requêtes/s et latences.
+
+Exemples :
+    python bench_debit.py --max-workers 8
+    python bench_debit.py --workers 1 2 4 --chemin /api/matieres --jeton "$TOKEN"
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+DOSSIER_BACKEND = Path(__file__).parent
+
+def port_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def attendre_serveur(url: str, processus: subprocess.Popen, delai_max: float = 60.0):
+    debut = time.perf_counter()
+    with httpx.Client(timeout=1.0) as client:
+        while time.perf_counter() - debut < delai_max:
+            if processus.poll() is not None:
+                raise RuntimeError("Le serveur s'est arrêté au démarrage")
+            try:
+                if client.get(url).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+    raise RuntimeError(f"Pas de réponse de {url} après {delai_max:.0f} s")
+
+async def charger(url: str, entetes: dict, concurrence: int, duree: float) -> tuple:
+    """Boucle de charge d'un processus client ; retourne (réussites, erreurs, latences)"""
+    latences = []
+    erreurs = 0
+    fin = time.perf_counter() + duree
+    limites = httpx.Limits(max_connections=concurrence, max_keepalive_connections=concurrence)
+
+    async def utilisateur(client: httpx.AsyncClient):
+        nonlocal erreurs
+        while time.perf_counter() < fin:
+            debut = time.perf_counter()
+            try:
+                reponse = await client.get(url, headers=entetes)
+                if reponse.status_code >= 400:
+                    erreurs += 1
+                    continue
+            except httpx.HTTPError:
+                erreurs += 1
+                continue
+            latences.append(time.perf_counter() - debut)
+
+    async with httpx.AsyncClient(timeout=30.0, limits=limites) as client:
+        await asyncio.gather(*(utilisateur(client) for _ in range(concurrence)))
+    return len(latences), erreurs, latences
+
+def processus_client(parametres: tuple) -> tuple:
+    return asyncio.run(charger(*parametres))
+
+def mesurer(nombre_workers: int, args) -> dict:
+    port = port_libre()
+    serveur = subprocess.Popen(
+        [sys.executable, "prefork.py", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(nombre_workers), "--log-level", "warning"],
+        # prefork.py refuse plusieurs workers avec des limites de débit propres à chacun
+        cwd=DOSSIER_BACKEND, stdout=subprocess.DEVNULL, env={**os.environ, "RATE_LIMIT_BACKEND": "mongo"}
+    )
+    url = f"http://127.0.0.1:{port}{args.chemin}"
+    entetes = {"Authorization": f"Bearer {args.jeton}"} if args.jeton else {}
+    try:
+        attendre_serveur(url, serveur)
+        # Échauffement : caches des workers et connexions Mongo
+        with multiprocessing.Pool(args.clients) as pool:
+            pool.map(processus_client, [(url, entetes, args.concurrence, 2.0)] * args.clients)
+            resultats = pool.map(processus_client, [(url, entetes, args.concurrence, args.duree)] * args.clients)
+    finally:
+        serveur.terminate()
+        try:
+            serveur.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            serveur.kill()
+
+    reussites = sum(r[0] for r in resultats)
+    erreurs = sum(r[1] for r in resultats)
+    latences = sorted(l for r in resultats for l in r[2])
+
+    def centile(p):
+        return latences[min(len(latences) - 1, int(len(latences) * p))] * 1000 if latences else 0
+
+    return {
+        "workers": nombre_workers,
+        "debit": reussites / args.duree,
+        "erreurs": erreurs,
+        "p50": centile(0.50),
+        "p99": centile(0.99)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Débit de l'API selon le nombre de workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="Nombres de workers à mesurer")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="Mesure 1, 2, 4... jusqu'à cette valeur")
+    parser.add_argument("--chemin", default="/api/", help="Route mesurée")
+    parser.add_argument("--jeton", default=None, help="Jeton Bearer pour les routes authentifiées")
+    parser.add_argument("--duree", type=float, default=10.0, help="Secondes de mesure par palier")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Processus générateurs de charge")
+    parser.add_argument("--concurrence", type=int, default=64, help="Requêtes simultanées par processus client")
+    args = parser.parse_args()
+
+    paliers = args.workers
+    if not paliers:
+        paliers, n = [], 1
+        while n < args.max_workers:
+            paliers.append(n)
+            n *= 2
+        paliers.append(args.max_workers)
+
+    print(f"📈 {args.chemin} - {args.clients} client(s) x {args.concurrence} connexions, {args.duree:.0f} s par palier")
+    print(f"{'workers':>8} {'req/s':>10} {'accél.':>8} {'effic.':>8} {'p50 ms':>8} {'p99 ms':>8} {'erreurs':>8}")
+    reference = None
+    for nombre in paliers:
+        resultat = mesurer(nombre, args)
+        reference = reference or resultat["debit"] / resultat["workers"]
+        acceleration = resultat["debit"] / reference if reference else 0
+        print(
+            f"{resultat['workers']:>8} {resultat['debit']:>10.0f} {acceleration:>7.2f}x "
+            f"{acceleration / resultat['workers']:>7.0%} {resultat['p50']:>8.1f} {resultat['p99']:>8.1f} {resultat['erreurs']:>8}"
+        )
+
+if __name__ == "__main__":
+    main()
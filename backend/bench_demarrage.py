@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Budget de démarrage du backend École Smart
+
+Mesure deux choses, chacune contre un budget (code de sortie 1 si dépassé) :
+- le temps d'import de server.py, avec le détail `python -X importtime` des modules
+  les plus coûteux ;
+- le démarrage à froid d'un worker uvicorn, du lancement du processus à la première
+  réponse de /api/ (hook de démarrage compris).
+
+Politique d'import : les modules utilisés sur les routes (pyotp, secrets, base64...)
+sont importés en tête de server.py ; seuls les modules réellement optionnels
+(sendgrid) sont importés paresseusement, une seule fois.
+
+Exemples :
+    python bench_demarrage.py
+    python bench_demarrage.py --repetitions 5 --budget-import 1.5 --budget-demarrage 4
+    python bench_demarrage.py --sans-uvicorn --sortie profil_imports.txt
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+DOSSIER_BACKEND = Path(__file__).parent
+
+def mesurer_imports() -> tuple:
+    """Importe server dans un interpréteur neuf ; retourne (durée totale, lignes importtime)"""
+    resultat = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=DOSSIER_BACKEND, capture_output=True, text=True
+    )
+    if resultat.returncode != 0:
+        lignes_erreur = [l for l in resultat.stderr.splitlines() if not l.startswith("import time:")]
+        raise RuntimeError("\n".join(lignes_erreur[-5:]))
+
+    modules = []
+    for ligne in resultat.stderr.splitlines():
+        # Format : "import time: self [us] | cumulative | imported package"
+        if not ligne.startswith("import time:") or "self [us]" in ligne:
+            continue
+        propre, cumule, nom = ligne[len("import time:"):].split("|", 2)
+        modules.append((int(propre), int(cumule), nom.rstrip()))
+    # Le module de plus haut niveau (server) porte le cumul de tout l'import
+    total = max(cumule for _, cumule, _ in modules) / 1e6
+    return total, modules
+
+def port_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def mesurer_demarrage_uvicorn(delai_max: float) -> float:
+    """Secondes entre le lancement d'uvicorn et la première réponse 200 de /api/"""
+    port = port_libre()
+    debut = time.perf_counter()
+    processus = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=DOSSIER_BACKEND, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - debut < delai_max:
+                if processus.poll() is not None:
+                    raise RuntimeError(processus.stderr.read().decode("utf-8", errors="replace")[-2000:])
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/api/").status_code == 200:
+                        return time.perf_counter() - debut
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.02)
+        raise RuntimeError(f"Pas de réponse après {delai_max:.0f} s")
+    finally:
+        processus.terminate()
+        try:
+            processus.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            processus.kill()
+
+def rapport_imports(modules, nombre: int) -> str:
+    lignes = [f"{'cumulé (ms)':>12} {'propre (ms)':>12}  module"]
+    for propre, cumule, nom in sorted(modules, key=lambda m: m[1], reverse=True)[:nombre]:
+        lignes.append(f"{cumule / 1000:12.1f} {propre / 1000:12.1f}  {nom}")
+    return "\n".join(lignes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Profil d'import et démarrage à froid du backend")
+    parser.add_argument("--repetitions", type=int, default=3, help="Mesures par indicateur (la médiane est retenue)")
+    parser.add_argument("--budget-import", type=float, default=float(os.environ.get('BUDGET_IMPORT_SECONDES', '2.0')))
+    parser.add_argument("--budget-demarrage", type=float, default=float(os.environ.get('BUDGET_DEMARRAGE_SECONDES', '5.0')))
+    parser.add_argument("--top", type=int, default=25, help="Nombre de modules affichés dans le profil")
+    parser.add_argument("--sortie", default=None, help="Fichier où écrire le profil importtime complet")
+    parser.add_argument("--sans-uvicorn", action="store_true", help="Ne mesurer que l'import")
+    args = parser.parse_args()
+
+    durees_import = []
+    for _ in range(args.repetitions):
+        total, modules = mesurer_imports()
+        durees_import.append(total)
+    import_median = statistics.median(durees_import)
+
+    print(f"📦 Import de server.py : {import_median:.2f} s (médiane de {args.repetitions}, budget {args.budget_import:.2f} s)")
+    print(rapport_imports(modules, args.top))
+    if args.sortie:
+        Path(args.sortie).write_text(rapport_imports(modules, len(modules)) + "\n", encoding="utf-8")
+        print(f"📝 Profil complet écrit dans {args.sortie}")
+
+    depassements = []
+    if import_median > args.budget_import:
+        depassements.append("import")
+
+    if not args.sans_uvicorn:
+        durees_demarrage = [mesurer_demarrage_uvicorn(delai_max=max(30.0, args.budget_demarrage * 5)) for _ in range(args.repetitions)]
+        demarrage_median = statistics.median(durees_demarrage)
+        print(f"🚀 Démarrage à froid uvicorn : {demarrage_median:.2f} s "
+              f"(min {min(durees_demarrage):.2f} s, budget {args.budget_demarrage:.2f} s)")
+        if demarrage_median > args.budget_demarrage:
+            depassements.append("démarrage")
+
+    if depassements:
+        print(f"❌ Budget dépassé : {', '.join(depassements)}")
+        sys.exit(1)
+    print("✅ Budgets respectés")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Stockage et temps de requête des présences : collection classique contre time-series
+
+Génère (option --generer) une année de présences au format historique dans une base
+dédiée, les migre vers presences_ts, puis compare :
+- la taille de stockage (données et index) des deux collections ;
+- le temps de la requête des absences de la semaine par classe ;
+- le temps du bilan d'assiduité annuel d'un élève.
+
+Exemples :
+    python bench_presences.py --generer
+    python bench_presences.py --generer --eleves 1300 --jours 180 --repetitions 20
+    python bench_presences.py --base test_database   # mesure sur des données existantes
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from migrer_presences import migrer
+from server import creer_collection_presences, instant_cours
+
+load_dotenv()
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+CLASSES = ["6ème A", "6ème B", "5ème A", "5ème B", "4ème A", "4ème B", "3ème A", "3ème B", "2nde", "1ère", "Tle"]
+MATIERES = ["Mathématiques", "Français", "Anglais", "Histoire-Géographie", "SVT", "Physique-Chimie"]
+
+def jours_de_cours(debut: date, nombre: int):
+    jour = debut
+    while nombre:
+        if jour.weekday() < 5:
+            yield jour
+            nombre -= 1
+        jour += timedelta(days=1)
+
+async def generer(base, nombre_eleves: int, nombre_jours: int):
+    """Données au format historique : une présence par élève, matière et jour, dates en chaînes"""
+    await base.client.drop_database(base.name)
+    eleves = [
+        {"_id": str(uuid.uuid4()), "nom": f"ELEVE{i}", "prenoms": "Test", "classe": CLASSES[i % len(CLASSES)], "statut_inscription": True}
+        for i in range(nombre_eleves)
+    ]
+    await base.eleves.insert_many(eleves)
+    enseignants = {matiere: str(uuid.uuid4()) for matiere in MATIERES}
+
+    lot, total = [], 0
+    for jour in jours_de_cours(date(2024, 9, 2), nombre_jours):
+        for eleve in eleves:
+            for matiere in MATIERES:
+                absent = random.random() < 0.06
+                lot.append({
+                    "_id": str(uuid.uuid4()),
+                    "eleve_id": eleve["_id"],
+                    "date_cours": jour.isoformat(),
+                    "matiere": matiere,
+                    "present": not absent,
+                    "motif_absence": "Maladie" if absent and random.random() < 0.5 else None,
+                    "enseignant_id": enseignants[matiere],
+                    "date_creation": datetime.utcnow().isoformat()
+                })
+        if len(lot) >= 50000:
+            await base.presences.insert_many(lot, ordered=False)
+            total += len(lot)
+            lot = []
+            print(f"\r🧪 {total} présences générées", end="", flush=True)
+    if lot:
+        await base.presences.insert_many(lot, ordered=False)
+        total += len(lot)
+    # Index équivalent à l'ancien presence_unique
+    await base.presences.create_index([("eleve_id", 1), ("date_cours", 1), ("matiere", 1)], unique=True)
+    print(f"\r🧪 {total} présences générées ({nombre_eleves} élèves, {nombre_jours} jours)")
+
+async def creer_index_ts(base):
+    await creer_collection_presences(base)
+    await base.presences_ts.create_index([("metadonnees.eleve_id", 1), ("date_cours", 1)], name="eleve_date")
+    await base.presences_ts.create_index([("metadonnees.classe", 1), ("date_cours", 1)], name="classe_date")
+
+async def taille(base, collection: str) -> dict:
+    stats = await base.command("collStats", collection)
+    return {
+        "documents": stats.get("count", 0),
+        "donnees": stats.get("storageSize", 0),
+        "index": stats.get("totalIndexSize", 0),
+        "buckets": stats.get("timeseries", {}).get("bucketCount")
+    }
+
+async def chronometrer(requete, repetitions: int) -> float:
+    await requete()  # Échauffement du cache WiredTiger
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        await requete()
+        durees.append(time.perf_counter() - debut)
+    return statistics.median(durees) * 1000
+
+async def main():
+    parser = argparse.ArgumentParser(description="Présences : collection classique contre time-series")
+    parser.add_argument("--base", default="bench_presences", help="Base de mesure (effacée avec --generer)")
+    parser.add_argument("--generer", action="store_true")
+    parser.add_argument("--eleves", type=int, default=1300)
+    parser.add_argument("--jours", type=int, default=180)
+    parser.add_argument("--repetitions", type=int, default=10)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    base = client[args.base]
+    if args.generer:
+        await generer(base, args.eleves, args.jours)
+    await creer_index_ts(base)
+    await migrer(base, taille_lot=5000)
+
+    # Semaine et élève de référence : au milieu des données
+    jour_milieu = date.fromisoformat((await base.presences.find_one(sort=[("date_cours", -1)]))["date_cours"]) - timedelta(weeks=8)
+    debut_semaine = jour_milieu - timedelta(days=jour_milieu.weekday())
+    fin_semaine = debut_semaine + timedelta(days=7)
+    eleve_id = (await base.eleves.find_one({}, {"_id": 1}))["_id"]
+
+    async def absences_semaine_avant():
+        return await base.presences.aggregate([
+            {"$match": {"date_cours": {"$gte": debut_semaine.isoformat(), "$lt": fin_semaine.isoformat()}, "present": False}},
+            {"$lookup": {"from": "eleves", "localField": "eleve_id", "foreignField": "_id", "as": "eleve"}},
+            {"$group": {"_id": {"$first": "$eleve.classe"}, "absences": {"$sum": 1}}}
+        ]).to_list(length=None)
+
+    async def absences_semaine_apres():
+        return await base.presences_ts.aggregate([
+            {"$match": {"date_cours": {"$gte": instant_cours(debut_semaine), "$lt": instant_cours(fin_semaine)}, "present": False}},
+            {"$group": {"_id": "$metadonnees.classe", "absences": {"$sum": 1}}}
+        ]).to_list(length=None)
+
+    async def bilan_eleve_avant():
+        return await base.presences.aggregate([
+            {"$match": {"eleve_id": eleve_id, "date_cours": {"$gte": "2024-09-01", "$lt": "2025-09-01"}}},
+            {"$group": {"_id": "$eleve_id", "total": {"$sum": 1}, "absences": {"$sum": {"$cond": ["$present", 0, 1]}}}}
+        ]).to_list(length=None)
+
+    async def bilan_eleve_apres():
+        return await base.presences_ts.aggregate([
+            {"$match": {"metadonnees.eleve_id": eleve_id, "date_cours": {"$gte": instant_cours("2024-09-01"), "$lt": instant_cours("2025-09-01")}}},
+            {"$group": {"_id": "$metadonnees.eleve_id", "total": {"$sum": 1}, "absences": {"$sum": {"$cond": ["$present", 0, 1]}}}}
+        ]).to_list(length=None)
+
+    avant, apres = await taille(base, "presences"), await taille(base, "presences_ts")
+    print(f"\n{'':28} {'presences':>14} {'presences_ts':>14} {'gain':>8}")
+    for libelle, cle in [("Documents", "documents"), ("Stockage données (Mo)", "donnees"), ("Stockage index (Mo)", "index")]:
+        a, b = avant[cle], apres[cle]
+        if cle == "documents":
+            print(f"{libelle:28} {a:>14} {b:>14} {'':>8}")
+        else:
+            print(f"{libelle:28} {a / 2**20:>14.1f} {b / 2**20:>14.1f} {(1 - b / a) if a else 0:>8.0%}")
+    if apres["buckets"] is not None:
+        print(f"{'Buckets time-series':28} {'':>14} {apres['buckets']:>14}")
+
+    for libelle, requete_avant, requete_apres in [
+        (f"Absences semaine du {debut_semaine}", absences_semaine_avant, absences_semaine_apres),
+        ("Bilan annuel d'un élève", bilan_eleve_avant, bilan_eleve_apres),
+    ]:
+        duree_avant = await chronometrer(requete_avant, args.repetitions)
+        duree_apres = await chronometrer(requete_apres, args.repetitions)
+        print(f"⏱️  {libelle} : {duree_avant:.1f} ms -> {duree_apres:.1f} ms "
+              f"(x{duree_avant / duree_apres if duree_apres else 0:.1f})")
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+"""
+Rendu PDF des documents scolaires (reçus de paiement, bulletins)
+
+Module autonome, sans dépendance externe ni accès à la base : les fonctions de
+rendu reçoivent des données déjà préparées et sont exécutées dans un pool de
+processus par le serveur.
+"""
+
+import zlib
+from typing import List, Optional
+
+LARGEUR_PAGE = 595  # A4 en points
+HAUTEUR_PAGE = 842
+MARGE = 50
+
+# Chasses Helvetica (millièmes de point) pour les caractères ASCII 32 à 126
+CHASSES_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+]
+
+def largeur_texte(texte: str, taille: float, gras: bool = False) -> float:
+    """Largeur approximative d'un texte en Helvetica (lettres accentuées comptées comme 'e')"""
+    total = 0
+    for caractere in texte:
+        code = ord(caractere)
+        total += CHASSES_HELVETICA[code - 32] if 32 <= code <= 126 else 556
+    return total * taille / 1000 * (1.05 if gras else 1)
+
+def formater_montant(montant: Optional[float]) -> str:
+    """1500000 -> '1 500 000 GNF'"""
+    if montant is None:
+        return "-"
+    return f"{round(montant):,}".replace(",", " ") + " GNF"
+
+def _echapper(texte: str) -> bytes:
+    """Chaîne littérale PDF en WinAnsi (cp1252) ; les caractères hors jeu sont remplacés"""
+    brut = texte.encode("cp1252", errors="replace")
+    return brut.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+class DocumentPDF:
+    """Générateur PDF minimal : texte Helvetica, traits et aplats, pagination verticale"""
+
+    def __init__(self, titre: str = ""):
+        self.titre = titre
+        self.pages: List[bytearray] = []
+        self.nouvelle_page()
+
+    def nouvelle_page(self):
+        self.pages.append(bytearray())
+        self.y = HAUTEUR_PAGE - MARGE
+
+    def reserver(self, hauteur: float):
+        """Passe à la page suivante si la hauteur demandée ne tient plus"""
+        if self.y - hauteur < MARGE:
+            self.nouvelle_page()
+
+    def texte(self, x: float, y: float, texte: str, taille: float = 10, gras: bool = False, aligne_droite: bool = False):
+        if aligne_droite:
+            x -= largeur_texte(texte, taille, gras)
+        police = b"/F2" if gras else b"/F1"
+        self.pages[-1] += b"BT %s %.1f Tf %.2f %.2f Td (%s) Tj ET\n" % (police, taille, x, y, _echapper(texte))
+
+    def trait(self, x1: float, y1: float, x2: float, y2: float, epaisseur: float = 0.5):
+        self.pages[-1] += b"%.2f w %.2f %.2f m %.2f %.2f l S\n" % (epaisseur, x1, y1, x2, y2)
+
+    def aplat(self, x: float, y: float, largeur: float, hauteur: float, gris: float = 0.92):
+        self.pages[-1] += b"q %.2f g %.2f %.2f %.2f %.2f re f Q\n" % (gris, x, y, largeur, hauteur)
+
+    def ligne(self, texte: str, taille: float = 10, gras: bool = False, interligne: float = 1.5):
+        """Écrit une ligne à la position courante puis descend"""
+        self.reserver(taille * interligne)
+        self.y -= taille * interligne
+        self.texte(MARGE, self.y, texte, taille, gras)
+
+    def tableau(self, colonnes: List[tuple], lignes: List[List[str]], taille: float = 9):
+        """Tableau simple ; colonnes = [(titre, largeur, aligne_droite)]"""
+        hauteur_ligne = taille * 1.9
+
+        def entete():
+            self.reserver(hauteur_ligne)
+            self.y -= hauteur_ligne
+            self.aplat(MARGE, self.y - taille * 0.5, LARGEUR_PAGE - 2 * MARGE, hauteur_ligne)
+            self._cellules([c[0] for c in colonnes], colonnes, taille, gras=True)
+
+        entete()
+        for valeurs in lignes:
+            if self.y - hauteur_ligne < MARGE:
+                self.nouvelle_page()
+                entete()
+            self.y -= hauteur_ligne
+            self._cellules(valeurs, colonnes, taille)
+            self.trait(MARGE, self.y - taille * 0.5, LARGEUR_PAGE - MARGE, self.y - taille * 0.5, 0.2)
+
+    def _cellules(self, valeurs: List[str], colonnes: List[tuple], taille: float, gras: bool = False):
+        x = MARGE + 4
+        for valeur, (_, largeur, aligne_droite) in zip(valeurs, colonnes):
+            if aligne_droite:
+                self.texte(x + largeur - 8, self.y, valeur, taille, gras, aligne_droite=True)
+            else:
+                self.texte(x, self.y, valeur, taille, gras)
+            x += largeur
+
+    def produire(self) -> bytes:
+        """Sérialise le document (flux de contenu compressés, table xref)"""
+        objets: List[bytes] = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"",  # Arbre des pages, complété après les pages
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+            b"<< /Title (%s) /Producer (Ecole Smart) >>" % _echapper(self.titre),
+        ]
+        references_pages = []
+        for contenu in self.pages:
+            flux = zlib.compress(bytes(contenu))
+            objets.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(flux), flux))
+            objets.append(
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                % (LARGEUR_PAGE, HAUTEUR_PAGE, len(objets))
+            )
+            references_pages.append(b"%d 0 R" % len(objets))
+        objets[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(references_pages), len(references_pages))
+
+        sortie = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        positions = []
+        for numero, objet in enumerate(objets, start=1):
+            positions.append(len(sortie))
+            sortie += b"%d 0 obj\n%s\nendobj\n" % (numero, objet)
+        debut_xref = len(sortie)
+        sortie += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objets) + 1)
+        for position in positions:
+            sortie += b"%010d 00000 n \n" % position
+        sortie += b"trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objets) + 1, debut_xref)
+        return bytes(sortie)
+
+def rendre_recu(recu: dict) -> bytes:
+    """Reçu de paiement d'une facture (données préparées par le serveur)"""
+    document = DocumentPDF(f"Reçu {recu['numero_recu']}")
+    droite = LARGEUR_PAGE - MARGE
+
+    document.y -= 10
+    document.texte(MARGE, document.y, "École Smart", 18, gras=True)
+    document.texte(droite, document.y, "REÇU DE PAIEMENT", 14, gras=True, aligne_droite=True)
+    document.y -= 18
+    document.texte(droite, document.y, f"N° {recu['numero_recu']}", 9, aligne_droite=True)
+    document.y -= 12
+    document.texte(droite, document.y, f"Édité le {recu['date_generation'][:10]}", 9, aligne_droite=True)
+    document.y -= 10
+    document.trait(MARGE, document.y, droite, document.y, 1)
+
+    eleve = recu["eleve"]
+    document.y -= 10
+    document.ligne("Élève", 11, gras=True)
+    document.ligne(f"{eleve['nom']} {eleve['prenoms']}")
+    document.ligne(f"Classe : {eleve['classe']}    Matricule : {eleve['matricule']}")
+
+    facture = recu["facture"]
+    document.y -= 10
+    document.ligne("Facture", 11, gras=True)
+    document.ligne(f"N° {facture['numero']} - {facture['titre']}")
+    document.ligne(f"Montant total : {formater_montant(facture['montant_total'])}")
+
+    document.y -= 10
+    document.ligne("Paiements reçus", 11, gras=True)
+    document.tableau(
+        [("Date", 90, False), ("Mode", 110, False), ("Référence", 180, False), ("Montant", 115, True)],
+        [
+            [str(p["date"])[:10], p["methode"].replace("_", " ").title(), p["reference"], formater_montant(p["montant"])]
+            for p in recu["paiements"]
+        ]
+    )
+
+    document.reserver(60)
+    document.y -= 24
+    document.texte(MARGE, document.y, "Total payé", 11, gras=True)
+    document.texte(droite - 4, document.y, formater_montant(recu["total_paye"]), 11, gras=True, aligne_droite=True)
+    document.y -= 16
+    document.texte(MARGE, document.y, "Reste à payer", 10)
+    document.texte(droite - 4, document.y, formater_montant(recu["montant_restant"]), 10, aligne_droite=True)
+    document.y -= 16
+    statut = "Soldée" if recu["statut_facture"] == "payee_totalement" else "Partiellement payée"
+    document.texte(MARGE, document.y, f"Statut de la facture : {statut}", 10)
+
+    document.texte(MARGE, MARGE, "Document généré électroniquement - aucune signature requise.", 8)
+    return document.produire()
+
+def rendre_bulletin(bulletin: dict) -> bytes:
+    """Bulletin de notes trimestriel d'un élève (données préparées par le serveur)"""
+    eleve = bulletin["eleve"]
+    document = DocumentPDF(f"Bulletin {eleve['nom']} {eleve['prenoms']} {bulletin['trimestre']}")
+    droite = LARGEUR_PAGE - MARGE
+
+    document.y -= 10
+    document.texte(MARGE, document.y, "École Smart", 18, gras=True)
+    document.texte(droite, document.y, "BULLETIN DE NOTES", 14, gras=True, aligne_droite=True)
+    document.y -= 18
+    document.texte(droite, document.y, f"Trimestre {bulletin['trimestre']} - {bulletin['annee_scolaire']}", 10, aligne_droite=True)
+    document.y -= 10
+    document.trait(MARGE, document.y, droite, document.y, 1)
+
+    document.y -= 10
+    document.ligne(f"{eleve['nom']} {eleve['prenoms']}", 12, gras=True)
+    document.ligne(f"Classe : {eleve['classe']}    Matricule : {eleve.get('matricule') or '-'}")
+
+    document.y -= 10
+    document.tableau(
+        [("Matière", 255, False), ("Coef. total", 80, True), ("Notes", 70, True), ("Moyenne", 90, True)],
+        [
+            [m["matiere"], f"{m['coefficient_total']:g}", str(m["nb_notes"]), f"{m['moyenne']:.2f}"]
+            for m in bulletin["moyennes_par_matiere"]
+        ] or [["Aucune note ce trimestre", "", "", ""]]
+    )
+
+    document.reserver(110)
+    document.y -= 24
+    document.texte(MARGE, document.y, "Moyenne générale", 12, gras=True)
+    document.texte(droite - 4, document.y, f"{bulletin['moyenne_generale']:.2f} / 20", 12, gras=True, aligne_droite=True)
+
+    presences = bulletin["presences"]
+    document.y -= 22
+    document.texte(
+        MARGE, document.y,
+        f"Assiduité : {presences['absences']} absence(s) sur {presences['total_cours']} cours "
+        f"({presences['taux_presence']} % de présence)",
+        10
+    )
+    document.y -= 22
+    document.texte(MARGE, document.y, "Appréciation", 11, gras=True)
+    document.y -= 15
+    document.texte(MARGE, document.y, bulletin["appreciation"], 10)
+
+    document.texte(MARGE, MARGE, "Document généré électroniquement par École Smart.", 8)
+    return document.produire()
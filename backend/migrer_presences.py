@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Migration des présences vers la collection time-series presences_ts
+
+Parcourt l'ancienne collection presences par lots (ordre des _id), retrouve la
+classe de chaque élève, convertit les dates ISO en dates BSON et insère les
+mesures dans presences_ts. L'enseignant de chaque appel est conservé dans la
+collection appels. La progression est enregistrée dans migrations : une migration
+interrompue reprend au dernier lot, et les mesures déjà présentes ne sont jamais
+dupliquées. presences_ts exige MongoDB 7.0 ou plus récent (vérifié avant la
+migration, comme au démarrage du serveur).
+
+Exemples :
+    python migrer_presences.py
+    python migrer_presences.py --taille-lot 5000 --renommer-source
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from server import creer_collection_presences, instant_cours, mesure_presence
+
+load_dotenv()
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'test_database')
+ID_MIGRATION = "presences_ts"
+
+def triplet(eleve_id, jour, matiere) -> tuple:
+    return eleve_id, instant_cours(jour).date(), matiere
+
+async def migrer_lot(base, lot: list) -> int:
+    """Insère les mesures d'un lot qui ne sont pas déjà dans presences_ts ; retourne leur nombre"""
+    eleve_ids = list({p["eleve_id"] for p in lot})
+    classes = {
+        e["_id"]: e.get("classe")
+        async for e in base.eleves.find({"_id": {"$in": eleve_ids}}, {"classe": 1})
+    }
+
+    # Mesures déjà écrites (lot repris après interruption, ou appel refait depuis l'application)
+    existantes = {
+        triplet(m["metadonnees"]["eleve_id"], m["date_cours"], m["matiere"])
+        async for m in base.presences_ts.find(
+            {"$or": [
+                {"metadonnees.eleve_id": p["eleve_id"], "date_cours": instant_cours(p["date_cours"]), "matiere": p["matiere"]}
+                for p in lot
+            ]},
+            {"metadonnees": 1, "date_cours": 1, "matiere": 1}
+        )
+    }
+
+    mesures, appels = [], {}
+    for presence in lot:
+        cle = triplet(presence["eleve_id"], presence["date_cours"], presence["matiere"])
+        if cle in existantes:
+            continue
+        existantes.add(cle)
+        classe = classes.get(presence["eleve_id"])
+        mesures.append(mesure_presence(
+            presence["eleve_id"], classe, presence["date_cours"], presence["matiere"],
+            presence.get("present", True), presence.get("motif_absence"), presence.get("justification")
+        ))
+        if classe and presence.get("enseignant_id"):
+            appels[f"{classe}:{cle[1].isoformat()}:{presence['matiere']}"] = (classe, cle[1], presence)
+
+    if mesures:
+        await base.presences_ts.insert_many(mesures, ordered=False)
+    if appels:
+        # $setOnInsert : un appel refait depuis l'application garde son enseignant
+        await base.appels.bulk_write([
+            UpdateOne(
+                {"_id": cle},
+                {"$setOnInsert": {
+                    "classe": classe,
+                    "date_cours": instant_cours(jour),
+                    "matiere": presence["matiere"],
+                    "enseignant_id": presence["enseignant_id"],
+                    "date_modification": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+            for cle, (classe, jour, presence) in appels.items()
+        ], ordered=False)
+    return len(mesures)
+
+async def migrer(base, taille_lot: int = 2000, afficher: bool = True) -> dict:
+    await creer_collection_presences(base)
+    etat = await base.migrations.find_one({"_id": ID_MIGRATION}) or {}
+    if etat.get("statut") == "terminee":
+        if afficher:
+            print("ℹ️  Migration déjà terminée")
+        return etat
+
+    dernier_id = etat.get("dernier_id")
+    lues, inserees = etat.get("lues", 0), etat.get("inserees", 0)
+    total = await base.presences.estimated_document_count()
+    debut = time.perf_counter()
+    while True:
+        filtre = {"_id": {"$gt": dernier_id}} if dernier_id is not None else {}
+        lot = await base.presences.find(filtre).sort("_id", 1).limit(taille_lot).to_list(length=None)
+        if not lot:
+            break
+        inserees += await migrer_lot(base, lot)
+        lues += len(lot)
+        dernier_id = lot[-1]["_id"]
+        await base.migrations.update_one(
+            {"_id": ID_MIGRATION},
+            {"$set": {"dernier_id": dernier_id, "lues": lues, "inserees": inserees, "statut": "en_cours",
+                      "date_modification": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        if afficher:
+            debit = lues / max(time.perf_counter() - debut, 1e-6)
+            print(f"\r⏳ {lues}/{total} présences lues, {inserees} mesures insérées ({debit:.0f}/s)", end="", flush=True)
+
+    etat = {"dernier_id": dernier_id, "lues": lues, "inserees": inserees, "statut": "terminee",
+            "date_modification": datetime.now(timezone.utc)}
+    await base.migrations.update_one({"_id": ID_MIGRATION}, {"$set": etat}, upsert=True)
+    if afficher:
+        print(f"\n✅ Migration terminée : {lues} présences lues, {inserees} mesures insérées")
+    return etat
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migration des présences vers la collection time-series")
+    parser.add_argument("--taille-lot", type=int, default=2000)
+    parser.add_argument("--renommer-source", action="store_true",
+                        help="Renomme presences en presences_avant_ts une fois la migration terminée")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    base = client[DB_NAME]
+    etat = await migrer(base, args.taille_lot)
+
+    if args.renommer_source and etat.get("statut") == "terminee":
+        if await base.list_collection_names(filter={"name": "presences"}):
+            await base.presences.rename("presences_avant_ts")
+            print("📦 Ancienne collection conservée sous presences_avant_ts")
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Serveur multi-processus pour École Smart (Linux)
+
+Le maître importe l'application une seule fois (préchargement : les imports et
+les objets du module sont partagés en copie sur écriture), ouvre le port d'écoute,
+puis forke N workers uvicorn qui acceptent sur ce même socket. Chaque worker crée
+son propre client Motor, ses caches et ses tâches de fond dans le cycle de vie de
+l'application ; le bus d'invalidation garde ces caches cohérents entre workers.
+
+Un worker qui s'arrête anormalement est relancé ; SIGTERM / SIGINT arrêtent
+proprement tous les workers. Avec plus d'un worker, la limitation de débit doit
+être partagée (RATE_LIMIT_BACKEND=mongo).
+
+Exemples :
+    RATE_LIMIT_BACKEND=mongo python prefork.py --workers 4
+    WEB_CONCURRENCY=8 RATE_LIMIT_BACKEND=mongo python prefork.py --port 8001
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+def ouvrir_socket(hote: str, port: int, file_attente: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in hote else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((hote, port))
+    sock.listen(file_attente)
+    sock.set_inheritable(True)
+    return sock
+
+def executer_worker(application, sock: socket.socket, args):
+    """Corps d'un processus fils : une boucle asyncio et un serveur uvicorn sur le socket hérité"""
+    # Un worker relancé hérite des gestionnaires du maître ; uvicorn installe les siens
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(
+        application,
+        lifespan="on",
+        log_level=args.log_level,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=args.proxy_headers,
+        access_log=args.access_log
+    )
+    serveur = uvicorn.Server(config)
+    asyncio.run(serveur.serve(sockets=[sock]))
+
+class Maitre:
+    def __init__(self, application, sock: socket.socket, args):
+        self.application = application
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> date de lancement
+        self.arret = False
+
+    def lancer_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                executer_worker(self.application, self.sock, self.args)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def demander_arret(self, signum, _frame):
+        self.arret = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def surveiller(self):
+        signal.signal(signal.SIGTERM, self.demander_arret)
+        signal.signal(signal.SIGINT, self.demander_arret)
+        while self.workers:
+            try:
+                pid, statut = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            lance_le = self.workers.pop(pid, None)
+            if self.arret or lance_le is None:
+                continue
+            print(f"⚠️  Worker {pid} arrêté (statut {statut}), relance", file=sys.stderr)
+            # Évite une boucle de relance rapide si le worker échoue dès le démarrage
+            if time.monotonic() - lance_le < 1:
+                time.sleep(1)
+            self.lancer_worker()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur pré-forké de l'API École Smart")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5, help="Secondes de keep-alive HTTP")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--proxy-headers", action="store_true")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    # Préchargement : import unique dans le maître, sans connexion ni boucle asyncio
+    from server import app, STOCKAGE_LIMITES_DEBIT
+
+    # Limites en mémoire : chaque worker a ses compteurs, la limite effective serait multipliée par N
+    if args.workers > 1 and STOCKAGE_LIMITES_DEBIT != "mongo":
+        print(f"❌ {args.workers} workers avec RATE_LIMIT_BACKEND={STOCKAGE_LIMITES_DEBIT} : les limites de "
+              "connexion, 2FA et réinitialisation seraient multipliées par le nombre de workers. "
+              "Utiliser RATE_LIMIT_BACKEND=mongo (ou --workers 1).", file=sys.stderr)
+        sys.exit(1)
+
+    sock = ouvrir_socket(args.host, args.port, args.backlog)
+    # Les objets déjà créés ne sont plus parcourus par le ramasse-miettes : pages partagées intactes
+    gc.freeze()
+
+    print(f"🚀 École Smart sur {args.host}:{args.port} avec {args.workers} worker(s) (maître {os.getpid()})")
+    maitre = Maitre(app, sock, args)
+    for _ in range(args.workers):
+        maitre.lancer_worker()
+    maitre.surveiller()
+    sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Reconstruction des moyennes matérialisées (moyennes_eleves) depuis les notes
+
+Recalcule les cumuls de chaque élève, année, trimestre et matière à partir de la
+collection notes, corrige ceux qui ont dérivé et supprime ceux qui n'ont plus de
+note. À lancer une fois après le déploiement des moyennes matérialisées ; ensuite,
+le serveur refait ce passage périodiquement (AVERAGES_RECONCILIATION_SECONDS).
+
+Exemples :
+    python reconstruire_moyennes.py
+    python reconstruire_moyennes.py --annee 2024-2025
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from server import reconstruire_moyennes
+
+load_dotenv()
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'test_database')
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconstruction des moyennes matérialisées")
+    parser.add_argument("--annee", default=None, help="Limite la reconstruction à une année scolaire")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    base = client[DB_NAME]
+    debut = time.perf_counter()
+    corriges = await reconstruire_moyennes(base, {"annee_scolaire": args.annee} if args.annee else None)
+    print(f"✅ {corriges} cumul(s) corrigé(s) en {time.perf_counter() - debut:.1f} s")
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Replica set Mongo local à 3 membres pour tester le routage des lectures analytiques
+
+Démarre trois mongod (ports 27017 à 27019 par défaut) dans un dossier de travail,
+initialise le replica set, puis vérifie avec les bases de l'application
+(server.bases_lecture) que chaque route analytique est servie par le membre
+attendu pour sa préférence de lecture, que les chemins transactionnels restent
+sur le primaire, et rapporte la fraîcheur des lectures (donnees_au).
+
+Exemples :
+    python replica_set_local.py demarrer
+    MONGO_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs_ecole" python replica_set_local.py verifier
+    python replica_set_local.py arreter
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+NOM_REPLICA_SET = "rs_ecole"
+DOSSIER_TRAVAIL = Path(os.environ.get('REPLICA_SET_DIR', Path(__file__).parent / "cache" / "replica_set"))
+
+def urls(ports):
+    return f"mongodb://{','.join(f'localhost:{p}' for p in ports)}/?replicaSet={NOM_REPLICA_SET}"
+
+def demarrer(ports):
+    for port in ports:
+        dossier = DOSSIER_TRAVAIL / str(port)
+        dossier.mkdir(parents=True, exist_ok=True)
+        subprocess.run([
+            "mongod", "--replSet", NOM_REPLICA_SET, "--port", str(port), "--bind_ip", "localhost",
+            "--dbpath", str(dossier), "--logpath", str(dossier / "mongod.log"),
+            "--pidfilepath", str(dossier / "mongod.pid"), "--fork"
+        ], check=True, stdout=subprocess.DEVNULL)
+
+    configuration = {
+        "_id": NOM_REPLICA_SET,
+        "members": [{"_id": i, "host": f"localhost:{port}"} for i, port in enumerate(ports)]
+    }
+
+    async def initier():
+        client = AsyncIOMotorClient(f"mongodb://localhost:{ports[0]}/?directConnection=true")
+        try:
+            await client.admin.command("replSetInitiate", configuration)
+        except Exception as e:
+            if "already initialized" not in str(e):
+                raise
+        # Attente de l'élection d'un primaire
+        for _ in range(60):
+            etat = await client.admin.command("hello")
+            if etat.get("isWritablePrimary"):
+                break
+            await asyncio.sleep(1)
+        client.close()
+
+    asyncio.run(initier())
+    print(f"✅ Replica set {NOM_REPLICA_SET} prêt")
+    print(f"   MONGO_URL=\"{urls(ports)}\"")
+
+def arreter(ports):
+    for port in ports:
+        fichier_pid = DOSSIER_TRAVAIL / str(port) / "mongod.pid"
+        if fichier_pid.exists():
+            subprocess.run(["kill", fichier_pid.read_text().strip()])
+            fichier_pid.unlink()
+    print("🛑 Membres arrêtés")
+
+def role_membre(adresse, primaire: str) -> str:
+    return "primaire" if adresse and f"{adresse[0]}:{adresse[1]}" == primaire else "secondaire"
+
+async def verifier(url: str) -> bool:
+    """Lectures faites avec les bases de l'application : primaire pour db, préférence de chaque route analytique"""
+    # Configuration du serveur (préférences par route, staleness) lue à l'import, comme dans un worker
+    os.environ["MONGO_URL"] = url
+    os.environ.setdefault("DB_NAME", "test_database")
+    import server
+    server.ouvrir_base()
+    client, base = server.client, server.db
+
+    await base.verification_lectures.insert_one({"date": datetime.now(timezone.utc)})
+    etat = await client.admin.command("hello")
+    primaire = etat.get("primary")
+    secondaires = [h for h in etat.get("hosts", []) if h != primaire]
+    print(f"✍️  Primaire : {primaire}  secondaires : {', '.join(secondaires) or '-'}")
+    # Laisse la réplication rattraper l'écriture de vérification
+    await asyncio.sleep(1)
+
+    succes = True
+    curseur = base.verification_lectures.find().limit(1)
+    await curseur.to_list(length=1)
+    role = role_membre(curseur.address, primaire)
+    print(f"{'✅' if role == 'primaire' else '❌'} db (chemins transactionnels) servie par {curseur.address} ({role})")
+    succes &= role == "primaire"
+
+    for route in server.ROUTES_ANALYTIQUES:
+        mode = server.PREFERENCES_ROUTES[route].name
+        attendu = {"primary": "primaire", "primaryPreferred": "primaire", "secondary": "secondaire",
+                   "secondaryPreferred": "secondaire" if secondaires else "primaire"}.get(mode)
+        async with await client.start_session(causal_consistency=False) as session:
+            lecture = server.LectureAnalytique(server.bases_lecture[route], session)
+            curseur = lecture.db.verification_lectures.find(session=session).sort("date", -1).limit(1)
+            await curseur.to_list(length=1)
+            donnees_au = datetime.fromisoformat(lecture.donnees_au())
+        role = role_membre(curseur.address, primaire)
+        conforme = attendu is None or role == attendu  # nearest : n'importe quel membre
+        retard = (datetime.now(timezone.utc) - donnees_au).total_seconds()
+        print(f"{'✅' if conforme else '❌'} {route} ({mode}) servie par {curseur.address} ({role}), "
+              f"données au {donnees_au} (retard ≈ {retard:.1f} s)")
+        succes &= conforme
+
+    await base.verification_lectures.drop()
+    client.close()
+    return succes
+
+def main():
+    parser = argparse.ArgumentParser(description="Replica set local à 3 membres")
+    parser.add_argument("action", choices=["demarrer", "verifier", "arreter"])
+    parser.add_argument("--ports", type=int, nargs=3, default=[27017, 27018, 27019])
+    args = parser.parse_args()
+
+    if args.action == "demarrer":
+        demarrer(args.ports)
+    elif args.action == "arreter":
+        arreter(args.ports)
+    else:
+        url = os.environ.get('MONGO_URL', urls(args.ports))
+        if "replicaSet" not in url:
+            print("❌ MONGO_URL doit désigner un replica set (paramètre replicaSet)")
+            sys.exit(1)
+        if not asyncio.run(verifier(url)):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Request, Response, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, date
 from typing import List, Optional, Dict, Any
@@ -10,22 +15,77 @@ from pydantic import BaseModel, Field, EmailStr, validator, model_validator
 from bson import ObjectId
 import os
 import logging
+import hashlib
+import hmac
 import jwt
 import uuid
 import re
+import socket
 import httpx
 from pathlib import Path
 from decimal import Decimal
 import asyncio
+import random
+import time
+import csv
+import io
+import itertools
+import json
+import zipfile
+import secrets
+import string
+import base64
+import urllib.parse
+import pyotp
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from documents_pdf import rendre_bulletin, rendre_recu
 from datetime import timezone
+from collections import deque
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Configuration MongoDB
+# Configuration MongoDB : client créé dans chaque worker au démarrage (après un éventuel fork), pas à l'import
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+# Préférence de lecture par route analytique : rapports et statistiques sur un secondaire,
+# avec une staleness bornée. Les chemins transactionnels utilisent db (primaire).
+MODES_LECTURE = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+# Mongo refuse un maxStalenessSeconds inférieur à 90
+STALENESS_MAX_ANALYTIQUE = max(90, int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', '120')))
+MODE_LECTURE_ANALYTIQUE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+ROUTES_ANALYTIQUES = ["rapport_financier", "tableau_de_bord", "factures_en_retard", "statistiques_admin"]
+
+def preference_lecture(mode: str):
+    if mode not in MODES_LECTURE:
+        raise ValueError(f"Préférence de lecture inconnue: {mode}")
+    if mode == "primary":
+        return Primary()
+    return MODES_LECTURE[mode](max_staleness=STALENESS_MAX_ANALYTIQUE)
+
+# Surchargeable route par route : READ_PREFERENCE_RAPPORT_FINANCIER=primary...
+PREFERENCES_ROUTES = {
+    route: preference_lecture(os.environ.get(f'READ_PREFERENCE_{route.upper()}', MODE_LECTURE_ANALYTIQUE))
+    for route in ROUTES_ANALYTIQUES
+}
+bases_lecture: Dict[str, Any] = {}
+
+def ouvrir_base():
+    global client, db
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[DB_NAME]
+    for route, preference in PREFERENCES_ROUTES.items():
+        bases_lecture[route] = client.get_database(DB_NAME, read_preference=preference)
 
 # Configuration sécurité
 SECRET_KEY = os.environ.get('SECRET_KEY', 'ecole-secret-key-guinea-2024')
@@ -35,11 +95,22 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 heures
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# Cycle de vie d'un worker : connexion Mongo, caches et tâches de fond
+@asynccontextmanager
+async def cycle_de_vie(application: FastAPI):
+    ouvrir_base()
+    await demarrer_taches_arriere_plan()
+    try:
+        yield
+    finally:
+        await arreter_worker()
+
 # Application FastAPI
 app = FastAPI(
     title="École Smart - Plateforme de Gestion Scolaire",
     description="Système de gestion scolaire pour les écoles en Guinée avec paiements mobiles",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=cycle_de_vie
 )
 
 api_router = APIRouter(prefix="/api")
@@ -144,6 +215,43 @@ class FactureCreate(BaseModel):
     date_echeance: date
     type_frais: List[str] = Field(default=["scolarite"])
 
+class LigneTarif(BaseModel):
+    libelle: str = Field(min_length=2, max_length=100)
+    type_frais: str = Field(default="scolarite")
+    montant: float = Field(gt=0)  # Montant annuel en GNF
+
+class TrancheEcheancier(BaseModel):
+    trimestre: str = Field(pattern="^(T1|T2|T3)$")
+    pourcentage: float = Field(gt=0, le=100)  # Part du montant annuel
+    date_echeance: date
+
+class GrilleTarifaireCreate(BaseModel):
+    classe: str
+    annee_scolaire: str = Field(default="2024-2025")
+    lignes: List[LigneTarif] = Field(min_length=1)
+    echeancier: List[TrancheEcheancier] = Field(min_length=1)
+    
+    @validator('echeancier')
+    def validate_echeancier(cls, v):
+        if len({t.trimestre for t in v}) != len(v):
+            raise ValueError('Une seule tranche par trimestre')
+        if abs(sum(t.pourcentage for t in v) - 100) > 0.01:
+            raise ValueError('Les tranches de l\'échéancier doivent totaliser 100%')
+        return v
+
+class FacturationTrimestrielleRequest(BaseModel):
+    trimestre: str = Field(pattern="^(T1|T2|T3)$")
+    annee_scolaire: str = Field(default="2024-2025")
+    classes: Optional[List[str]] = None  # None = toute l'école
+    apercu: bool = Field(default=False)  # Simulation sans écriture
+
+class CallbackOperateur(BaseModel):
+    reference_interne: str  # Notre référence (PAY_...)
+    reference_operateur: str = Field(min_length=1)  # Identifiant de transaction chez l'opérateur
+    statut: str = Field(pattern="^(reussi|echoue)$")
+    montant: Optional[float] = None
+    date_transaction: Optional[datetime] = None
+
 class PaiementCreate(BaseModel):
     facture_id: str
     montant: float = Field(gt=100)  # Minimum 100 GNF
@@ -164,6 +272,16 @@ class PresenceCreate(BaseModel):
     present: bool = True
     motif_absence: Optional[str] = None
 
+class AbsenceAppel(BaseModel):
+    eleve_id: str
+    motif_absence: Optional[str] = None
+
+class AppelClasseCreate(BaseModel):
+    classe: str
+    date_cours: date = Field(default_factory=date.today)
+    matiere: str
+    absences: List[AbsenceAppel] = Field(default=[])  # Les autres élèves de la classe sont présents
+
 class NoteCreate(BaseModel):
     eleve_id: str
     matiere: str
@@ -175,6 +293,28 @@ class NoteCreate(BaseModel):
     annee_scolaire: str = Field(default="2024-2025")
     commentaire: Optional[str] = None
 
+class NoteEleveSaisie(BaseModel):
+    eleve_id: str
+    note: float = Field(ge=0, le=20)
+    commentaire: Optional[str] = None
+
+class EvaluationCreate(BaseModel):
+    matiere: str
+    type_evaluation: str = Field(pattern="^(devoir|composition|controle|examen|oral)$")
+    coefficient: float = Field(default=1.0, ge=0.5, le=5.0)
+    date_evaluation: date
+    trimestre: str = Field(pattern="^(T1|T2|T3)$")
+    annee_scolaire: str = Field(default="2024-2025")
+    classe: Optional[str] = None  # Si précisée, tous les élèves doivent en faire partie
+    notes: List[NoteEleveSaisie] = Field(min_length=1)
+    
+    @validator('notes')
+    def validate_eleves_uniques(cls, v):
+        ids = [n.eleve_id for n in v]
+        if len(ids) != len(set(ids)):
+            raise ValueError('Un élève ne peut avoir qu\'une note par évaluation')
+        return v
+
 class MatiereCreate(BaseModel):
     nom: str = Field(min_length=2, max_length=100)
     code: str = Field(min_length=2, max_length=20)
@@ -189,6 +329,14 @@ class BulletinRequest(BaseModel):
     annee_scolaire: str = Field(default="2024-2025")
     format_export: str = Field(default="pdf", pattern="^(pdf|csv)$")
 
+class ArchivageCreate(BaseModel):
+    annee_scolaire: str = Field(pattern=r"^\d{4}-\d{4}$")
+
+class BulletinsClasseRequest(BaseModel):
+    classe: str
+    trimestre: str = Field(pattern="^(T1|T2|T3)$")
+    annee_scolaire: str = Field(default="2024-2025")
+
 class EvenementCreate(BaseModel):
     titre: str = Field(min_length=3, max_length=200)
     description: Optional[str] = None
@@ -235,6 +383,31 @@ class CreneauHoraireCreate(BaseModel):
     type_creneau: str = Field(default="cours", pattern="^(cours|pause|recreation)$")
     ordre: int = Field(ge=1, le=20)  # Position dans la journée
 
+class CreneauIndisponible(BaseModel):
+    jour_semaine: int = Field(ge=1, le=7)
+    ordre: int = Field(ge=1, le=20)  # Ordre du créneau horaire concerné
+
+class SalleDisponibilite(BaseModel):
+    nom: str = Field(min_length=1, max_length=50)
+    classes: List[str] = Field(default=[])  # Vide = salle ouverte à toutes les classes
+    indisponibilites: List[CreneauIndisponible] = Field(default=[])
+
+class GenerationEmploiDuTempsRequest(BaseModel):
+    classes: List[str] = Field(min_length=1)
+    jours: List[int] = Field(default=[1, 2, 3, 4, 5])  # 1=Lundi ... 5=Vendredi
+    volumes_horaires: Dict[str, int] = Field(default={})  # Heures/semaine par matière (nom ou code)
+    volumes_horaires_par_classe: Dict[str, Dict[str, int]] = Field(default={})  # Surcharge par classe
+    salles: List[SalleDisponibilite] = Field(default=[])  # Vide = pas de contrainte de salle
+    duree_max_secondes: float = Field(default=5.0, gt=0, le=60)
+    remplacer_existant: bool = Field(default=True)
+    apercu: bool = Field(default=False)  # Si vrai, rien n'est écrit en base
+
+    @validator('jours')
+    def validate_jours(cls, v):
+        if not v or any(j < 1 or j > 7 for j in v):
+            raise ValueError('Les jours doivent être compris entre 1 (Lundi) et 7 (Dimanche)')
+        return sorted(set(v))
+
 class RessourceCreate(BaseModel):
     titre: str = Field(min_length=3, max_length=200)
     description: Optional[str] = None
@@ -296,6 +469,29 @@ class MessageCreate(BaseModel):
     classe_destinataire: Optional[str] = None  # Pour messages de groupe par classe
     matiere_concernee: Optional[str] = None
 
+class DiffusionCreate(BaseModel):
+    sujet: str = Field(min_length=3, max_length=200)
+    contenu: str = Field(min_length=1, max_length=5000)
+    priorite: str = Field(default="normale", pattern="^(basse|normale|haute|urgente)$")
+    audience: str = Field(pattern="^(tous|role|classe)$")
+    role: Optional[str] = Field(default=None, pattern="^(eleve|enseignant|parent|administrateur)$")
+    classe: Optional[str] = None
+    
+    @model_validator(mode='after')
+    def verifier_audience(self):
+        if self.audience == "role" and not self.role:
+            raise ValueError("Le rôle ciblé est requis pour une diffusion par rôle")
+        if self.audience == "classe" and not self.classe:
+            raise ValueError("La classe ciblée est requise pour une diffusion par classe")
+        return self
+    
+    def audience_cle(self) -> str:
+        if self.audience == "role":
+            return f"role:{self.role}"
+        if self.audience == "classe":
+            return f"classe:{self.classe}"
+        return "tous"
+
 class NotificationCreate(BaseModel):
     destinataire_id: str
     titre: str = Field(min_length=3, max_length=100)
@@ -408,6 +604,7 @@ class KPIData(BaseModel):
     paiements_mois: float
     paiements_montant: int
     alertes_actives: int
+    donnees_au: Optional[str] = None
 
 class AlerteAdmin(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -510,6 +707,102 @@ class DashboardAdminResponse(BaseModel):
     evenements_calendrier: List[EvenementCalendrier]
     statistiques_classes: List[StatistiqueClasse]
     tendances: Dict[str, Any]
+    donnees_au: Optional[str] = None
+
+# Lectures analytiques (préférence de lecture de la route, fraîcheur des données)
+class LectureAnalytique:
+    def __init__(self, base, session):
+        self.db = base
+        self.session = session
+    
+    def donnees_au(self) -> str:
+        """Horodatage des données lues : operationTime renvoyé par le membre interrogé"""
+        if self.session.operation_time is None:
+            # Mongo autonome : lectures sur l'unique serveur, donc à jour
+            return datetime.now(timezone.utc).isoformat()
+        return self.session.operation_time.as_datetime().isoformat()
+
+def lecture_analytique(route: str):
+    """Dépendance : base de la route et session qui relève la fraîcheur des lectures"""
+    async def dependance():
+        async with await client.start_session(causal_consistency=False) as session:
+            yield LectureAnalytique(bases_lecture[route], session)
+    return dependance
+
+# Chargement groupé par requête (lectures par _id)
+class Chargeur:
+    """Regroupe les lectures par `_id` d'une collection.
+    
+    Les appels faits pendant un même tour de boucle deviennent une seule requête
+    `$in`, et chaque document est mémorisé pour la durée de la requête HTTP.
+    Les documents renvoyés sont partagés entre les appelants.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.memoire: Dict[str, asyncio.Future] = {}
+        self.en_attente: Dict[str, asyncio.Future] = {}
+        self.taches: set = set()  # Lots en vol, référencés jusqu'à leur fin
+    
+    def charger(self, identifiant: str) -> "asyncio.Future[Optional[dict]]":
+        if identifiant in self.memoire:
+            return self.memoire[identifiant]
+        boucle = asyncio.get_running_loop()
+        futur = boucle.create_future()
+        self.memoire[identifiant] = futur
+        self.en_attente[identifiant] = futur
+        if len(self.en_attente) == 1:
+            boucle.call_soon(self._lancer)
+        return futur
+    
+    async def charger_plusieurs(self, identifiants: List[str]) -> List[Optional[dict]]:
+        return await asyncio.gather(*(self.charger(i) for i in identifiants))
+    
+    def amorcer(self, document: dict):
+        """Ajoute un document déjà lu (ex. l'utilisateur authentifié)"""
+        futur = asyncio.get_running_loop().create_future()
+        futur.set_result(document)
+        self.memoire[document["_id"]] = futur
+    
+    def oublier(self, identifiant: str):
+        """À appeler après une écriture sur ce document"""
+        self.memoire.pop(identifiant, None)
+    
+    def _lancer(self):
+        # Futurs du lot capturés au lancement : un oublier() en vol ne les rend pas orphelins
+        lot, self.en_attente = self.en_attente, {}
+        tache = asyncio.ensure_future(self._executer(lot))
+        self.taches.add(tache)
+        tache.add_done_callback(self.taches.discard)
+    
+    async def _executer(self, lot: Dict[str, asyncio.Future]):
+        try:
+            documents = {
+                d["_id"]: d for d in await self.collection.find({"_id": {"$in": list(lot)}}).to_list(length=None)
+            }
+        except Exception as e:
+            for identifiant, futur in lot.items():
+                # Un échec n'est pas mémorisé : la prochaine lecture réessaie
+                if self.memoire.get(identifiant) is futur:
+                    del self.memoire[identifiant]
+                if not futur.done():
+                    futur.set_exception(e)
+            return
+        for identifiant, futur in lot.items():
+            if not futur.done():
+                futur.set_result(documents.get(identifiant))
+
+class Chargeurs:
+    """Chargeurs d'une requête HTTP, un par collection fréquemment lue par _id"""
+    def __init__(self):
+        self.users = Chargeur(db.users)
+        self.eleves = Chargeur(db.eleves)
+        self.factures = Chargeur(db.factures)
+        self.devoirs = Chargeur(db.devoirs)
+        self.messages = Chargeur(db.messages)
+
+def get_chargeurs() -> Chargeurs:
+    # FastAPI met en cache les dépendances : une seule instance par requête
+    return Chargeurs()
 
 # Utilitaires d'authentification
 def verify_password(plain_password, hashed_password):
@@ -524,35 +817,228 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti : identifiant révocable ; iat en fractions de seconde pour la révocation par date
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Révocation des jetons : collection avec TTL et copie en mémoire dans chaque worker
+INTERVALLE_SYNCHRO_REVOCATIONS = float(os.environ.get('REVOCATION_REFRESH_SECONDS', '5'))
+
+class ListeRevocation:
+    """Identifiants (jti) des jetons révoqués et non expirés, synchronisés par incréments.
+    
+    La vérification d'un jeton valide ne coûte qu'un test d'appartenance en mémoire.
+    """
+    def __init__(self):
+        self.expirations: Dict[str, float] = {}  # jti -> horodatage d'expiration
+        self.synchronise_jusqu_a: Optional[datetime] = None
+    
+    def est_revoque(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self.expirations
+    
+    def ajouter(self, jti: str, expire_le: datetime):
+        self.expirations[jti] = expire_le.replace(tzinfo=timezone.utc).timestamp()
+    
+    async def synchroniser(self):
+        """Charge les révocations faites depuis le dernier passage (par tous les workers)"""
+        maintenant = datetime.now(timezone.utc)
+        filtre = {"expire_le": {"$gt": maintenant}}
+        if self.synchronise_jusqu_a is not None:
+            # Recouvrement de quelques secondes pour les écritures en vol et les décalages d'horloge
+            filtre["date_revocation"] = {"$gte": self.synchronise_jusqu_a - timedelta(seconds=5)}
+        async for revocation in db.jetons_revoques.find(filtre, {"expire_le": 1}):
+            self.ajouter(revocation["_id"], revocation["expire_le"])
+        self.synchronise_jusqu_a = maintenant
+        self.purger()
+    
+    def purger(self):
+        """Les jetons expirés sont refusés par la signature : inutile de les garder"""
+        seuil = time.time()
+        for jti in [j for j, expiration in self.expirations.items() if expiration < seuil]:
+            del self.expirations[jti]
+
+liste_revocation = ListeRevocation()
+
+async def revoquer_jeton(payload: dict, utilisateur_id: str):
+    if not payload.get("jti"):
+        return
+    expire_le = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+    await db.jetons_revoques.update_one(
+        {"_id": payload["jti"]},
+        {"$setOnInsert": {
+            "utilisateur_id": utilisateur_id,
+            "expire_le": expire_le,
+            "date_revocation": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    liste_revocation.ajouter(payload["jti"], expire_le)
+
+async def synchroniser_revocations_periodiquement():
+    """Tâche de fond : récupère les révocations faites par les autres workers"""
+    while True:
+        await asyncio.sleep(INTERVALLE_SYNCHRO_REVOCATIONS)
+        try:
+            # Le bus d'invalidation transmet déjà les révocations des autres workers
+            if bus_invalidation.actif:
+                liste_revocation.purger()
+                continue
+            await liste_revocation.synchroniser()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur synchronisation des révocations: {str(e)}")
+
+# Limitation du débit des routes sensibles (connexion, réinitialisation, 2FA)
+def lire_limite(variable: str, defaut: str) -> tuple:
+    """'10/300' -> (10 tentatives, fenêtre de 300 secondes)"""
+    nombre, fenetre = os.environ.get(variable, defaut).split("/")
+    return int(nombre), float(fenetre)
+
+LIMITES_DEBIT = {
+    ("connexion", "ip"): lire_limite('RATE_LIMIT_LOGIN_IP', '30/60'),
+    ("connexion", "compte"): lire_limite('RATE_LIMIT_LOGIN_ACCOUNT', '10/300'),
+    ("reinitialisation", "ip"): lire_limite('RATE_LIMIT_RESET_IP', '10/3600'),
+    ("reinitialisation", "compte"): lire_limite('RATE_LIMIT_RESET_ACCOUNT', '3/3600'),
+    ("2fa", "compte"): lire_limite('RATE_LIMIT_2FA_ACCOUNT', '5/300'),
+}
+# 'memoire' : compteurs propres à chaque worker ; 'mongo' : partagés entre workers
+STOCKAGE_LIMITES_DEBIT = os.environ.get('RATE_LIMIT_BACKEND', 'memoire')
+# Derrière un reverse proxy, l'adresse du client est la dernière ajoutée à X-Forwarded-For
+FAIRE_CONFIANCE_PROXY = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+
+def adresse_client(request: Request) -> str:
+    if FAIRE_CONFIANCE_PROXY and request.headers.get("x-forwarded-for"):
+        return request.headers["x-forwarded-for"].split(",")[-1].strip()
+    return request.client.host if request.client else "inconnue"
+
+class LimiteurDebit:
+    """Fenêtre glissante par (règle, portée, clé), en mémoire ou dans la collection limites_debit"""
+    TAILLE_MAX_MEMOIRE = 50000
+    
+    def __init__(self, stockage: str):
+        self.stockage = stockage
+        self.tentatives: Dict[tuple, deque] = {}  # horodatages des tentatives dans la fenêtre
+        self.derniere_purge = time.monotonic()
+    
+    def _consommer_memoire(self, cle: tuple, limite: int, fenetre: float) -> float:
+        """Enregistre une tentative ; retourne 0 si acceptée, sinon l'attente en secondes"""
+        maintenant = time.monotonic()
+        horodatages = self.tentatives.setdefault(cle, deque(maxlen=limite))
+        while horodatages and horodatages[0] <= maintenant - fenetre:
+            horodatages.popleft()
+        if len(horodatages) >= limite:
+            return horodatages[0] + fenetre - maintenant
+        horodatages.append(maintenant)
+        self._purger(maintenant)
+        return 0
+    
+    def _purger(self, maintenant: float):
+        """Oublie les clés inactives pour borner la mémoire (IP de passage)"""
+        if len(self.tentatives) < self.TAILLE_MAX_MEMOIRE and maintenant - self.derniere_purge < 300:
+            return
+        self.derniere_purge = maintenant
+        fenetre_max = max(fenetre for _, fenetre in LIMITES_DEBIT.values())
+        for cle in [c for c, h in self.tentatives.items() if not h or h[-1] <= maintenant - fenetre_max]:
+            del self.tentatives[cle]
+    
+    async def _consommer_mongo(self, cle: tuple, limite: int, fenetre: float) -> float:
+        """Approximation à deux fenêtres fixes : la précédente pondérée par son recouvrement"""
+        maintenant = time.time()
+        indice = int(maintenant // fenetre)
+        prefixe = ":".join(cle)
+        courant, precedent = await asyncio.gather(
+            db.limites_debit.find_one_and_update(
+                {"_id": f"{prefixe}:{indice}"},
+                {"$inc": {"n": 1}, "$setOnInsert": {
+                    "expire_le": datetime.fromtimestamp((indice + 2) * fenetre, tz=timezone.utc)
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            ),
+            db.limites_debit.find_one({"_id": f"{prefixe}:{indice - 1}"})
+        )
+        ecoule = maintenant / fenetre - indice
+        estimation = (precedent["n"] if precedent else 0) * (1 - ecoule) + courant["n"]
+        if estimation <= limite:
+            return 0
+        return (1 - ecoule) * fenetre
+    
+    async def verifier(self, regle: str, **cles: Optional[str]):
+        """Lève une 429 si l'une des clés (ip, compte...) a dépassé sa limite pour la règle"""
+        for portee, valeur in cles.items():
+            if not valeur or (regle, portee) not in LIMITES_DEBIT:
+                continue
+            limite, fenetre = LIMITES_DEBIT[(regle, portee)]
+            cle = (regle, portee, valeur.lower())
+            attente = 0
+            if self.stockage == "mongo":
+                try:
+                    attente = await self._consommer_mongo(cle, limite, fenetre)
+                except Exception as e:
+                    logger.error(f"Limitation de débit partagée indisponible: {str(e)}")
+                    attente = self._consommer_memoire(cle, limite, fenetre)
+            else:
+                attente = self._consommer_memoire(cle, limite, fenetre)
+            if attente > 0:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Trop de tentatives, veuillez réessayer plus tard",
+                    headers={"Retry-After": str(max(1, int(attente + 0.999)))}
+                )
+
+limiteur_debit = LimiteurDebit(STOCKAGE_LIMITES_DEBIT)
+
+async def utilisateur_depuis_jeton(token: Optional[str]) -> dict:
+    """Valide un jeton d'accès et retourne l'utilisateur (en-tête Bearer, SSE ou WebSocket)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Impossible de valider les identifiants",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except jwt.PyJWTError:
+    payload = decoder_jeton_acces(token)
+    if payload is None:
         raise credentials_exception
     
-    user = await db.users.find_one({"email": email})
+    user = await db.users.find_one({"email": payload["sub"]})
     if user is None:
         raise credentials_exception
+    # Mot de passe changé ou déconnexion de tous les appareils : jetons émis avant refusés
+    invalides_avant = user.get("jetons_invalides_avant")
+    if invalides_avant is not None and payload.get("iat", 0) < invalides_avant:
+        raise credentials_exception
     user['_id'] = str(user['_id'])
     return user
 
+def decoder_jeton_acces(token: Optional[str]) -> Optional[dict]:
+    """Payload d'un jeton d'accès valide et non révoqué, sinon None (sans accès à la base)"""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    # Les jetons de réinitialisation de mot de passe ne donnent pas accès à l'API
+    if payload.get("sub") is None or payload.get("type") is not None:
+        return None
+    if liste_revocation.est_revoque(payload.get("jti")):
+        return None
+    return payload
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
+    user = await utilisateur_depuis_jeton(credentials.credentials)
+    chargeurs.users.amorcer(user)
+    return user
+
 # Utilitaires pour générer des données de démonstration et calculer les KPI
-import random
 
-async def generer_donnees_demo():
-    """Génère des données de démonstration réalistes pour le dashboard administrateur."""
+async def generer_donnees_demo() -> bool:
+    """Génère des données de démonstration réalistes pour le dashboard administrateur.
+    Retourne False si elles existaient déjà."""
     
     # Générer des élèves fictifs
     eleves = []
@@ -563,7 +1049,7 @@ async def generer_donnees_demo():
     # Vérifier si les données existent déjà
     existing_stats = await db.statistiques_eleves.count_documents({})
     if existing_stats > 0:
-        return  # Données déjà générées
+        return False  # Données déjà générées
     
     for i in range(1247):  # 1247 élèves comme dans le KPI
         nom = random.choice(noms_guinéens)
@@ -653,58 +1139,120 @@ async def generer_donnees_demo():
     ]
     
     await db.actions_requises.insert_many([a.dict() for a in actions])
+    return True
 
-async def calculer_kpi_admin():
+async def calculer_kpi_admin(lecture: LectureAnalytique):
     """Calcule les KPI en temps réel pour le dashboard administrateur."""
+    base, session = lecture.db, lecture.session
     
     # Effectif total
-    effectif_total = await db.statistiques_eleves.count_documents({})
+    effectif_total = await base.statistiques_eleves.count_documents({}, session=session)
     
     # Taux de présence global
     pipeline_presence = [
         {"$group": {"_id": None, "taux_moyen": {"$avg": "$taux_presence"}}}
     ]
-    presence_result = await db.statistiques_eleves.aggregate(pipeline_presence).to_list(1)
+    presence_result = await base.statistiques_eleves.aggregate(pipeline_presence, session=session).to_list(1)
     taux_presence = round(presence_result[0]["taux_moyen"], 1) if presence_result else 92.3
     
     # Statistiques de paiements
     total_eleves = effectif_total
-    eleves_a_jour = await db.statistiques_eleves.count_documents({"statut_paiement": "a_jour"})
+    eleves_a_jour = await base.statistiques_eleves.count_documents({"statut_paiement": "a_jour"}, session=session)
     paiements_mois = round((eleves_a_jour / total_eleves * 100), 1) if total_eleves > 0 else 87.4
     
     # Montant collecté ce mois (estimation)
     paiements_montant = int(eleves_a_jour * 1.2)  # En millions GNF
     
     # Alertes actives
-    alertes_actives = await db.alertes_admin.count_documents({"statut": "active"})
+    alertes_actives = await base.alertes_admin.count_documents({"statut": "active"}, session=session)
     
     return KPIData(
         effectif_total=effectif_total,
         taux_presence=taux_presence,
         paiements_mois=paiements_mois,
         paiements_montant=paiements_montant,
-        alertes_actives=alertes_actives
+        alertes_actives=alertes_actives,
+        donnees_au=lecture.donnees_au()
+    )
+
+# Verrous distribués entre workers (collection verrous)
+def identifiant_worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+async def acquerir_verrou(nom: str, duree_secondes: float, detenteur: Optional[str] = None) -> bool:
+    """Prend (ou prolonge) le verrou `nom` pour ce worker (ou `detenteur`) ; False s'il est détenu ailleurs"""
+    detenteur = detenteur or identifiant_worker()
+    maintenant = datetime.now(timezone.utc)
+    try:
+        await db.verrous.find_one_and_update(
+            {"_id": nom, "$or": [{"expire_le": {"$lt": maintenant}}, {"detenteur": detenteur}]},
+            {"$set": {"detenteur": detenteur, "expire_le": maintenant + timedelta(seconds=duree_secondes)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+# Séquences atomiques (collection compteurs)
+async def reserver_sequence(nom: str, quantite: int = 1) -> int:
+    """Réserve `quantite` valeurs consécutives de la séquence `nom` en un aller-retour, retourne la première"""
+    compteur = await db.compteurs.find_one_and_update(
+        {"_id": nom},
+        {"$inc": {"valeur": quantite}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+    return compteur["valeur"] - quantite + 1
+
+CODES_CLASSE = {
+    "CP1": "01", "CP2": "02", "CE1": "03", "CE2": "04",
+    "CM1": "05", "CM2": "06", "6ème": "07", "5ème": "08", 
+    "4ème": "09", "3ème": "10", "2nde": "11", "1ère": "12", "Tle": "13"
+}
 
-def generate_matricule(classe: str, annee: str) -> str:
+async def generer_matricules(classe: str, annee: str, quantite: int) -> List[str]:
+    """Génère `quantite` matricules uniques pour une classe et une année"""
+    annee_code = annee.split('-')[0]
+    classe_code = CODES_CLASSE.get(classe, "99")
+    prefixe = f"{annee_code}{classe_code}"
+    nom_sequence = f"matricules-{prefixe}"
+    
+    # Première utilisation : reprendre après les matricules déjà attribués
+    if not await db.compteurs.find_one({"_id": nom_sequence}):
+        dernier = await db.eleves.find(
+            {"matricule": {"$regex": f"^{prefixe}[0-9]+$"}},
+            {"matricule": 1}
+        ).sort("matricule", -1).limit(1).to_list(length=1)
+        valeur_initiale = int(dernier[0]["matricule"][len(prefixe):]) if dernier else 0
+        await db.compteurs.update_one({"_id": nom_sequence}, {"$max": {"valeur": valeur_initiale}}, upsert=True)
+    
+    premier = await reserver_sequence(nom_sequence, quantite)
+    return [f"{prefixe}{sequence:03d}" for sequence in range(premier, premier + quantite)]
+
+async def generate_matricule(classe: str, annee: str) -> str:
     """Génère un matricule unique"""
-    codes_classe = {
-        "CP1": "01", "CP2": "02", "CE1": "03", "CE2": "04",
-        "CM1": "05", "CM2": "06", "6ème": "07", "5ème": "08", 
-        "4ème": "09", "3ème": "10", "2nde": "11", "1ère": "12", "Tle": "13"
-    }
+    return (await generer_matricules(classe, annee, 1))[0]
+
+async def generer_numeros_facture(quantite: int) -> List[str]:
+    """Génère un bloc contigu de numéros de facture pour la journée"""
+    timestamp = datetime.now().strftime("%Y%m%d")
+    nom_sequence = f"factures-{timestamp}"
     
-    annee_code = annee.split('-')[0]
-    classe_code = codes_classe.get(classe, "99")
-    sequence = str(uuid.uuid4().int)[:3].zfill(3)
+    # Première facture du jour : reprendre après les numéros déjà attribués (anciens numéros aléatoires)
+    if not await db.compteurs.find_one({"_id": nom_sequence}):
+        dernier = await db.factures.find(
+            {"numero_facture": {"$regex": f"^FACT-{timestamp}-[0-9]+$"}},
+            {"numero_facture": 1}
+        ).sort("numero_facture", -1).limit(1).to_list(length=1)
+        valeur_initiale = int(dernier[0]["numero_facture"].rsplit("-", 1)[1]) if dernier else 0
+        await db.compteurs.update_one({"_id": nom_sequence}, {"$max": {"valeur": valeur_initiale}}, upsert=True)
     
-    return f"{annee_code}{classe_code}{sequence}"
+    premier = await reserver_sequence(nom_sequence, quantite)
+    return [f"FACT-{timestamp}-{sequence:06d}" for sequence in range(premier, premier + quantite)]
 
-def generate_numero_facture() -> str:
+async def generate_numero_facture() -> str:
     """Génère un numéro de facture unique"""
-    timestamp = datetime.now().strftime("%Y%m%d")
-    random_part = str(uuid.uuid4().int)[:6].zfill(6)
-    return f"FACT-{timestamp}-{random_part}"
+    return (await generer_numeros_facture(1))[0]
 
 def detect_operator(phone: str) -> str:
     """Détecte l'opérateur mobile guinéen"""
@@ -721,13 +1269,227 @@ def detect_operator(phone: str) -> str:
     else:
         return "INCONNU"
 
+# Versions des collections de référence (ETag et requêtes conditionnelles)
+COLLECTIONS_VERSIONNEES = ["matieres", "creneaux_horaires", "trimestres", "emplois_du_temps", "evenements_calendrier"]
+INTERVALLE_RAFRAICHISSEMENT_VERSIONS = float(os.environ.get('VERSIONS_REFRESH_SECONDS', '5'))
+
+# Compteur de modifications par collection, tenu en mémoire dans chaque worker
+versions_collections: Dict[str, int] = {}
+
+async def incrementer_version(collection: str):
+    """Incrémente le compteur de modifications d'une collection de référence"""
+    doc = await db.versions_collections.find_one_and_update(
+        {"_id": collection},
+        {"$inc": {"version": 1}, "$set": {"date_modification": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    versions_collections[collection] = doc["version"]
+
+async def charger_versions():
+    """Recharge les compteurs depuis la base (écritures faites par les autres workers)"""
+    cursor = db.versions_collections.find({"_id": {"$in": COLLECTIONS_VERSIONNEES}})
+    async for doc in cursor:
+        ancienne_version = versions_collections.get(doc["_id"])
+        versions_collections[doc["_id"]] = doc["version"]
+        # Filet de sécurité si le bus d'invalidation n'est pas disponible
+        if ancienne_version is not None and ancienne_version != doc["version"] and doc["_id"] in CacheReferentiel.COLLECTIONS:
+            await cache_referentiel.charger(doc["_id"])
+
+async def rafraichir_versions_periodiquement():
+    """Tâche de fond : garde les compteurs en mémoire à jour"""
+    while True:
+        await asyncio.sleep(INTERVALLE_RAFRAICHISSEMENT_VERSIONS)
+        if bus_invalidation.actif:
+            continue
+        try:
+            await charger_versions()
+            await charger_archivages()
+        except Exception as e:
+            logger.error(f"Erreur rafraîchissement des versions: {str(e)}")
+
+def calculer_etag(collections: List[str], *parametres) -> str:
+    """ETag faible dérivé des versions des collections et des paramètres de la requête"""
+    versions = "-".join(str(versions_collections.get(c, 0)) for c in collections)
+    empreinte = hashlib.blake2b(repr(parametres).encode("utf-8"), digest_size=6).hexdigest()
+    return f'W/"{versions}-{empreinte}"'
+
+def reponse_non_modifiee(request: Request, etag: str) -> Optional[Response]:
+    """Retourne une réponse 304 si le client possède déjà cette version"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    etags_client = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    if "*" in etags_client or etag.removeprefix("W/") in etags_client:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+def reponse_avec_etag(contenu: dict, etag: str) -> JSONResponse:
+    return JSONResponse(
+        content=jsonable_encoder(contenu),
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
+
+# Cache en mémoire des données de référence
+class CacheReferentiel:
+    """Copie en mémoire des petites collections de référence, indexée par nom et code.
+    
+    Seul le code d'une matière est unique : un nom peut désigner plusieurs matières
+    (données antérieures au contrôle du nom à la création).
+    
+    Chargé au démarrage, mis à jour par les écritures de l'application
+    (write-through) et par le bus d'invalidation pour les écritures faites
+    par les autres workers.
+    """
+    COLLECTIONS = ["matieres", "trimestres", "creneaux_horaires"]
+    
+    def __init__(self):
+        self.matieres_par_nom: Dict[str, List[dict]] = {}
+        self.matieres_par_code: Dict[str, dict] = {}
+        self.trimestres_par_code: Dict[tuple, dict] = {}  # (annee_scolaire, code) -> trimestre
+        self.creneaux: List[dict] = []
+    
+    async def charger(self, collection: Optional[str] = None):
+        """Recharge une collection (ou toutes) depuis la base"""
+        if collection in (None, "matieres"):
+            matieres = await db.matieres.find().to_list(length=None)
+            self.matieres_par_code = {m["code"]: m for m in matieres}
+            self.matieres_par_nom = {}
+            for m in matieres:
+                self.matieres_par_nom.setdefault(m["nom"], []).append(m)
+        if collection in (None, "trimestres"):
+            trimestres = await db.trimestres.find().to_list(length=None)
+            self.trimestres_par_code = {(t["annee_scolaire"], t["code"]): t for t in trimestres}
+        if collection in (None, "creneaux_horaires"):
+            self.creneaux = await db.creneaux_horaires.find().sort("ordre", 1).to_list(length=None)
+    
+    def enregistrer(self, collection: str, doc: dict):
+        """Write-through : reflète immédiatement une écriture locale"""
+        if collection == "matieres":
+            homonymes = self.matieres_par_nom.setdefault(doc["nom"], [])
+            homonymes[:] = [m for m in homonymes if m["_id"] != doc["_id"]] + [doc]
+            self.matieres_par_code[doc["code"]] = doc
+        elif collection == "trimestres":
+            self.trimestres_par_code[(doc["annee_scolaire"], doc["code"])] = doc
+        elif collection == "creneaux_horaires":
+            self.creneaux = sorted(self.creneaux + [doc], key=lambda c: c["ordre"])
+    
+    def matiere(self, nom_ou_code: str) -> Optional[dict]:
+        """Matière par code, sinon la première portant ce nom"""
+        if nom_ou_code in self.matieres_par_code:
+            return self.matieres_par_code[nom_ou_code]
+        homonymes = self.matieres_par_nom.get(nom_ou_code)
+        return homonymes[0] if homonymes else None
+    
+    def liste_matieres(self) -> List[dict]:
+        return [dict(m) for m in self.matieres_par_code.values()]
+    
+    def trimestres(self, annee_scolaire: str) -> List[dict]:
+        return sorted(
+            (dict(t) for (annee, _), t in self.trimestres_par_code.items() if annee == annee_scolaire),
+            key=lambda t: t["code"]
+        )
+    
+    def liste_creneaux(self) -> List[dict]:
+        return [dict(c) for c in self.creneaux]
+
+cache_referentiel = CacheReferentiel()
+
+class BusInvalidation:
+    """Cohérence des caches en mémoire entre workers, portée par un flux de modifications Mongo.
+    
+    Chaque cache s'abonne aux collections dont il dépend ; une écriture faite par
+    n'importe quel worker (ou un script) est ainsi répercutée partout. Sans replica
+    set, les rafraîchissements périodiques des versions et des révocations prennent le relais.
+    """
+    def __init__(self):
+        self.abonnements: Dict[str, list] = {}  # collection -> traitements de la modification
+        self.actif = False
+    
+    def abonner(self, collection: str, traitement):
+        self.abonnements.setdefault(collection, []).append(traitement)
+    
+    async def ecouter(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(self.abonnements)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+        ouvertures = 0
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup") as flux:
+                    if ouvertures:
+                        # Modifications perdues pendant la coupure : rechargement complet
+                        await resynchroniser_caches()
+                    ouvertures += 1
+                    self.actif = True
+                    async for modification in flux:
+                        await self.distribuer(modification)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.actif = False
+                if e.code == 40573:
+                    logger.warning("Bus d'invalidation indisponible (Mongo sans replica set) : rafraîchissement périodique")
+                    return
+                logger.warning(f"Bus d'invalidation interrompu: {str(e)}")
+                await asyncio.sleep(5)
+            except Exception as e:
+                self.actif = False
+                logger.warning(f"Bus d'invalidation interrompu: {str(e)}")
+                await asyncio.sleep(5)
+    
+    async def distribuer(self, modification: dict):
+        for traitement in self.abonnements.get(modification["ns"]["coll"], []):
+            try:
+                await traitement(modification)
+            except Exception as e:
+                logger.error(f"Erreur invalidation {modification['ns']['coll']}: {str(e)}")
+
+bus_invalidation = BusInvalidation()
+
+async def resynchroniser_caches():
+    await charger_versions()
+    await cache_referentiel.charger()
+    await liste_revocation.synchroniser()
+    await charger_archivages()
+
+async def invalider_version(modification: dict):
+    doc = modification.get("fullDocument")
+    if doc:
+        versions_collections[doc["_id"]] = max(versions_collections.get(doc["_id"], 0), doc["version"])
+
+async def invalider_referentiel(modification: dict):
+    await cache_referentiel.charger(modification["ns"]["coll"])
+
+async def invalider_revocation(modification: dict):
+    doc = modification.get("fullDocument")
+    if modification["operationType"] == "insert" and doc:
+        liste_revocation.ajouter(doc["_id"], doc["expire_le"])
+
+bus_invalidation.abonner("versions_collections", invalider_version)
+for collection_referentiel in CacheReferentiel.COLLECTIONS:
+    bus_invalidation.abonner(collection_referentiel, invalider_referentiel)
+bus_invalidation.abonner("jetons_revoques", invalider_revocation)
+
 # Nouvelles fonctions utilitaires pour les fonctionnalités avancées
 
+# SendGrid ne sert qu'aux emails : importé une seule fois, au premier envoi, pas au démarrage
+_classes_sendgrid = None
+
+def classes_sendgrid() -> tuple:
+    """(SendGridAPIClient, Mail), importés à la première demande"""
+    global _classes_sendgrid
+    if _classes_sendgrid is None:
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail
+        _classes_sendgrid = (SendGridAPIClient, Mail)
+    return _classes_sendgrid
+
 async def send_email(to_email: str, subject: str, content: str):
     """Envoie un email via SendGrid"""
     try:
-        from sendgrid import SendGridAPIClient
-        from sendgrid.helpers.mail import Mail
+        SendGridAPIClient, Mail = classes_sendgrid()
         
         sender_email = os.environ.get('SENDER_EMAIL', 'noreply@ecole-smart.gn')
         api_key = os.environ.get('SENDGRID_API_KEY')
@@ -774,20 +1536,16 @@ def verify_reset_token(token: str) -> Optional[str]:
 
 def generate_2fa_secret() -> str:
     """Génère un secret pour 2FA"""
-    import secrets
-    import base64
     return base64.b32encode(secrets.token_bytes(20)).decode('utf-8')
 
 def generate_2fa_qr_url(email: str, secret: str) -> str:
     """Génère l'URL pour le QR code 2FA"""
-    import urllib.parse
     app_name = "École Smart"
     return f"otpauth://totp/{urllib.parse.quote(app_name)}:{urllib.parse.quote(email)}?secret={secret}&issuer={urllib.parse.quote(app_name)}"
 
 def verify_2fa_code(secret: str, code: str) -> bool:
     """Vérifie un code 2FA"""
     try:
-        import pyotp
         totp = pyotp.TOTP(secret)
         return totp.verify(code, valid_window=1)  # Accepte le code actuel et le précédent
     except Exception as e:
@@ -796,8 +1554,6 @@ def verify_2fa_code(secret: str, code: str) -> bool:
 
 async def generate_temporary_password() -> str:
     """Génère un mot de passe temporaire"""
-    import secrets
-    import string
     alphabet = string.ascii_letters + string.digits + "!@#$%"
     return ''.join(secrets.choice(alphabet) for i in range(12))
 
@@ -919,8 +1675,13 @@ async def pre_register_student(pre_registration: PreRegistrationRequest):
         )
 
 @api_router.post("/auth/login", response_model=Token)
-async def login_user(user_credentials: UserLogin):
+async def login_user(user_credentials: UserLogin, request: Request):
     """Connexion d'un utilisateur avec support 2FA"""
+    # Avant toute requête et tout calcul bcrypt
+    await limiteur_debit.verifier("connexion", ip=adresse_client(request), compte=user_credentials.email)
+    if user_credentials.code_2fa:
+        await limiteur_debit.verifier("2fa", compte=user_credentials.email)
+    
     user = await db.users.find_one({"email": user_credentials.email})
     if not user or not verify_password(user_credentials.mot_de_passe, user["mot_de_passe"]):
         raise HTTPException(
@@ -1065,9 +1826,14 @@ async def process_google_session(session_request: GoogleSessionRequest):
         )
 
 @api_router.post("/auth/logout")
-async def logout_user(current_user: dict = Depends(get_current_user)):
-    """Déconnexion - supprime le session_token si Google Auth"""
+async def logout_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user)
+):
+    """Déconnexion - révoque le jeton courant et supprime le session_token si Google Auth"""
     try:
+        await revoquer_jeton(decoder_jeton_acces(credentials.credentials), current_user["_id"])
+        
         if current_user.get("auth_method") == "google" and current_user.get("session_token"):
             # Suppression du session_token pour les utilisateurs Google
             await db.users.update_one(
@@ -1087,11 +1853,30 @@ async def logout_user(current_user: dict = Depends(get_current_user)):
             detail="Erreur lors de la déconnexion"
         )
 
+@api_router.post("/auth/logout-all")
+async def logout_all_devices(current_user: dict = Depends(get_current_user)):
+    """Déconnexion de tous les appareils : tous les jetons émis jusqu'ici sont refusés"""
+    await invalider_jetons_utilisateur({"_id": current_user["_id"]})
+    return {"message": "Déconnexion de tous les appareils effectuée"}
+
+async def invalider_jetons_utilisateur(filtre: dict, champs: Optional[dict] = None, unset: Optional[dict] = None):
+    """Met à jour l'utilisateur et invalide tous ses jetons existants en une écriture"""
+    mise_a_jour = {"$set": {
+        **(champs or {}),
+        "jetons_invalides_avant": time.time(),
+        "date_modification": datetime.now(timezone.utc)
+    }}
+    if unset:
+        mise_a_jour["$unset"] = unset
+    await db.users.update_one(filtre, mise_a_jour)
+
 # Nouvelles routes d'authentification avancées
 
 @api_router.post("/auth/password-reset-request")
-async def request_password_reset(reset_request: PasswordResetRequest):
+async def request_password_reset(reset_request: PasswordResetRequest, request: Request):
     """Demander une réinitialisation de mot de passe"""
+    await limiteur_debit.verifier("reinitialisation", ip=adresse_client(request), compte=reset_request.email)
+    
     user = await db.users.find_one({"email": reset_request.email})
     
     if not user:
@@ -1171,15 +1956,7 @@ async def confirm_password_reset(reset_confirm: PasswordResetConfirm):
     # Mettre à jour le mot de passe
     hashed_password = get_password_hash(reset_confirm.nouveau_mot_de_passe)
     
-    await db.users.update_one(
-        {"email": email},
-        {
-            "$set": {
-                "mot_de_passe": hashed_password,
-                "date_modification": datetime.now(timezone.utc)
-            }
-        }
-    )
+    await invalider_jetons_utilisateur({"email": email}, {"mot_de_passe": hashed_password})
     
     # Marquer le token comme utilisé
     await db.password_reset_tokens.update_one(
@@ -1280,6 +2057,166 @@ async def get_my_children(current_user: dict = Depends(get_current_user)):
     
     return {"enfants": liaisons}
 
+# Vue d'ensemble parent : toutes les données des enfants en un seul aller-retour
+NB_DERNIERES_NOTES_APERCU = 5
+NB_DEVOIRS_APERCU = 10
+
+def bornes_annee_scolaire(annee_scolaire: str) -> tuple:
+    """'2024-2025' -> ('2024-09-01', '2025-09-01'), bornes des dates ISO de l'année"""
+    debut, fin = annee_scolaire.split("-")
+    return f"{debut}-09-01", f"{fin}-09-01"
+
+def annee_scolaire_de(jour: date) -> str:
+    """Année scolaire d'une date (rentrée au 1er septembre)"""
+    debut = jour.year if jour.month >= 9 else jour.year - 1
+    return f"{debut}-{debut + 1}"
+
+@api_router.get("/parents/apercu")
+async def get_apercu_parent(
+    request: Request,
+    annee_scolaire: str = "2024-2025",
+    current_user: dict = Depends(get_current_user)
+):
+    """Vue d'ensemble de tous les enfants : moyennes, dernières notes, assiduité, factures dues, devoirs à venir"""
+    if current_user["role"] != "parent":
+        raise HTTPException(status_code=403, detail="Accès réservé aux parents")
+    
+    liaisons = await db.parent_child_links.find(
+        {"parent_id": current_user["_id"], "actif": True},
+        {"eleve_id": 1, "relation": 1}
+    ).to_list(length=None)
+    eleve_ids = [l["eleve_id"] for l in liaisons]
+    eleves = await db.eleves.find(
+        {"_id": {"$in": eleve_ids}},
+        {"nom": 1, "prenoms": 1, "classe": 1, "matricule": 1}
+    ).to_list(length=None)
+    classes = sorted({e["classe"] for e in eleves})
+    aujourd_hui = date.today().isoformat()
+    
+    async def devoirs_a_venir():
+        devoirs = await db.devoirs.find(
+            {"classe": {"$in": classes}, "actif": True, "date_echeance": {"$gte": aujourd_hui}},
+            {"titre": 1, "matiere": 1, "classe": 1, "date_echeance": 1}
+        ).sort("date_echeance", 1).limit(NB_DEVOIRS_APERCU * max(len(classes), 1)).to_list(length=None)
+        rendus = await db.rendus_devoirs.find(
+            {"devoir_id": {"$in": [d["_id"] for d in devoirs]}, "eleve_id": {"$in": eleve_ids}},
+            {"devoir_id": 1, "eleve_id": 1}
+        ).to_list(length=None)
+        return devoirs, {(r["devoir_id"], r["eleve_id"]) for r in rendus}
+    
+    # Une requête $in par type de données, toutes lancées en parallèle
+    moyennes, dernieres_notes, presences, factures, (devoirs, rendus) = await asyncio.gather(
+        db.moyennes_eleves.find(
+            {"eleve_id": {"$in": eleve_ids}, "annee_scolaire": annee_scolaire},
+            {"_id": 0, "eleve_id": 1, "trimestre": 1, "matiere": 1, "somme_ponderee": 1, "somme_coefficients": 1, "nb_notes": 1}
+        ).to_list(length=None),
+        collection_pour("notes", annee_scolaire).aggregate([
+            {"$match": {"eleve_id": {"$in": eleve_ids}, "annee_scolaire": annee_scolaire}},
+            {"$sort": {"date_evaluation": -1, "date_creation": -1}},
+            {"$group": {
+                "_id": "$eleve_id",
+                "notes": {"$push": {
+                    "matiere": "$matiere",
+                    "note": "$note",
+                    "coefficient": "$coefficient",
+                    "type_evaluation": "$type_evaluation",
+                    "date_evaluation": "$date_evaluation"
+                }}
+            }},
+            {"$project": {"notes": {"$slice": ["$notes", NB_DERNIERES_NOTES_APERCU]}}}
+        ]).to_list(length=None),
+        collection_pour("presences_ts", annee_scolaire).aggregate([
+            {"$match": {"metadonnees.eleve_id": {"$in": eleve_ids}, "date_cours": periode_presences(annee_scolaire)}},
+            {"$group": {
+                "_id": "$metadonnees.eleve_id",
+                "total_cours": {"$sum": 1},
+                "absences": {"$sum": {"$cond": [{"$eq": ["$present", False]}, 1, 0]}},
+                # Une absence est justifiée par son motif, seul champ saisi à l'appel
+                "absences_non_justifiees": {"$sum": {"$cond": [
+                    {"$and": [{"$eq": ["$present", False]}, {"$not": ["$motif_absence"]}]}, 1, 0
+                ]}},
+                "derniere_absence": {"$max": {"$cond": [{"$eq": ["$present", False]}, "$date_cours", None]}}
+            }},
+            {"$set": {"derniere_absence": {"$dateToString": {"format": "%Y-%m-%d", "date": "$derniere_absence"}}}}
+        ]).to_list(length=None),
+        db.factures.find(
+            {"eleve_id": {"$in": eleve_ids}, "statut": {"$in": ["emise", "payee_partiellement"]}},
+            {"eleve_id": 1, "numero_facture": 1, "titre": 1, "montant_total": 1, "montant_restant": 1, "date_echeance": 1, "statut": 1}
+        ).sort("date_echeance", 1).to_list(length=None),
+        devoirs_a_venir()
+    )
+    
+    # Élève sans cumul matérialisé (notes antérieures au premier remplissage de moyennes_eleves) :
+    # cumuls calculés à la volée depuis ses notes
+    eleves_avec_cumuls = {m["eleve_id"] for m in moyennes}
+    sans_cumuls = [eleve_id for eleve_id in eleve_ids if eleve_id not in eleves_avec_cumuls]
+    if sans_cumuls:
+        moyennes += [
+            {**cumul.pop("_id"), **cumul}
+            for cumul in await collection_pour("notes", annee_scolaire).aggregate([
+                {"$match": {"eleve_id": {"$in": sans_cumuls}, "annee_scolaire": annee_scolaire}},
+                {"$group": {
+                    "_id": {"eleve_id": "$eleve_id", "trimestre": "$trimestre", "matiere": "$matiere"},
+                    "somme_ponderee": {"$sum": {"$multiply": ["$note", "$coefficient"]}},
+                    "somme_coefficients": {"$sum": "$coefficient"},
+                    "nb_notes": {"$sum": 1}
+                }}
+            ]).to_list(length=None)
+        ]
+    
+    # Même calcul que /notes/moyennes : moyenne de matière = somme des note x coefficient / nombre
+    # de notes, moyenne générale pondérée par le total des coefficients de chaque matière
+    moyennes_par_eleve: Dict[str, Dict[str, dict]] = {}
+    for m in moyennes:
+        if not m.get("nb_notes") or not m.get("somme_coefficients"):
+            continue
+        trimestre = moyennes_par_eleve.setdefault(m["eleve_id"], {}).setdefault(
+            m["trimestre"], {"matieres": [], "total_points": 0.0, "total_coefficients": 0.0}
+        )
+        moyenne = round(m["somme_ponderee"] / m["nb_notes"], 2)
+        trimestre["matieres"].append({"matiere": m["matiere"], "moyenne": moyenne, "nb_notes": m["nb_notes"]})
+        trimestre["total_points"] += moyenne * m["somme_coefficients"]
+        trimestre["total_coefficients"] += m["somme_coefficients"]
+    notes_par_eleve = {n["_id"]: n["notes"] for n in dernieres_notes}
+    presences_par_eleve = {p.pop("_id"): p for p in presences}
+    factures_par_eleve: Dict[str, List[dict]] = {}
+    for facture in factures:
+        factures_par_eleve.setdefault(facture.pop("eleve_id"), []).append(facture)
+    
+    relations = {l["eleve_id"]: l.get("relation", "parent") for l in liaisons}
+    enfants = []
+    for eleve in sorted(eleves, key=lambda e: (e["nom"], e["prenoms"])):
+        factures_dues = factures_par_eleve.get(eleve["_id"], [])
+        enfants.append({
+            "eleve": eleve,
+            "relation": relations.get(eleve["_id"]),
+            "moyennes": {
+                trimestre: {
+                    "moyenne_generale": round(t["total_points"] / t["total_coefficients"], 2),
+                    "matieres": sorted(t["matieres"], key=lambda m: m["matiere"])
+                }
+                for trimestre, t in sorted(moyennes_par_eleve.get(eleve["_id"], {}).items())
+            },
+            "dernieres_notes": notes_par_eleve.get(eleve["_id"], []),
+            "presences": presences_par_eleve.get(
+                eleve["_id"], {"total_cours": 0, "absences": 0, "absences_non_justifiees": 0, "derniere_absence": None}
+            ),
+            "factures_impayees": factures_dues,
+            "montant_du": sum(f["montant_restant"] for f in factures_dues),
+            "devoirs_a_venir": [
+                {**devoir, "rendu": (devoir["_id"], eleve["_id"]) in rendus}
+                for devoir in devoirs if devoir["classe"] == eleve["classe"]
+            ][:NB_DEVOIRS_APERCU]
+        })
+    
+    contenu = {"annee_scolaire": annee_scolaire, "enfants": enfants}
+    # ETag fort sur le contenu : le téléphone revalide sans retélécharger si rien n'a changé
+    etag = f'"{empreinte_document(contenu)[:32]}"'
+    non_modifie = reponse_non_modifiee(request, etag)
+    if non_modifie:
+        return non_modifie
+    return reponse_avec_etag(contenu, etag)
+
 @api_router.post("/auth/enable-2fa")
 async def enable_2fa(enable_request: Enable2FARequest, current_user: dict = Depends(get_current_user)):
     """Activer la 2FA pour un utilisateur"""
@@ -1324,6 +2261,7 @@ async def confirm_2fa(confirm_request: Confirm2FARequest, current_user: dict = D
         )
     
     # Vérifier le code fourni
+    await limiteur_debit.verifier("2fa", compte=current_user["_id"])
     if not verify_2fa_code(confirm_request.code_secret, confirm_request.code_verification):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1358,6 +2296,7 @@ async def disable_2fa(verify_request: Verify2FARequest, current_user: dict = Dep
         )
     
     # Vérifier le code 2FA
+    await limiteur_debit.verifier("2fa", compte=current_user["_id"])
     if not verify_2fa_code(user["secret_2fa"], verify_request.code_2fa):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1480,18 +2419,18 @@ async def change_temporary_password(
     # Mettre à jour le mot de passe
     hashed_password = get_password_hash(password_data.nouveau_mot_de_passe)
     
-    await db.users.update_one(
+    await invalider_jetons_utilisateur(
         {"_id": current_user["_id"]},
-        {
-            "$set": {
-                "mot_de_passe": hashed_password,
-                "date_modification": datetime.now(timezone.utc)
-            },
-            "$unset": {"mot_de_passe_temporaire": ""}
-        }
+        {"mot_de_passe": hashed_password},
+        unset={"mot_de_passe_temporaire": ""}
     )
     
-    return {"message": "Mot de passe changé avec succès"}
+    # Les anciens jetons sont invalidés : un nouveau est fourni pour rester connecté
+    return {
+        "message": "Mot de passe changé avec succès",
+        "access_token": create_access_token(data={"sub": current_user["email"]}),
+        "token_type": "bearer"
+    }
 
 # Routes de gestion des élèves
 @api_router.post("/eleves")
@@ -1501,7 +2440,7 @@ async def create_eleve(eleve_data: EleveCreate, current_user: dict = Depends(get
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     # Génération du matricule
-    matricule = generate_matricule(eleve_data.classe, eleve_data.annee_scolaire)
+    matricule = await generate_matricule(eleve_data.classe, eleve_data.annee_scolaire)
     
     # Création de l'élève
     eleve_doc = {
@@ -1525,6 +2464,67 @@ async def create_eleve(eleve_data: EleveCreate, current_user: dict = Depends(get
     
     return {"message": f"Élève créé avec succès. Matricule: {matricule}", "eleve": eleve_doc}
 
+@api_router.post("/eleves/import")
+async def import_eleves(eleves_data: List[EleveCreate], current_user: dict = Depends(get_current_user)):
+    """Importer des élèves en masse"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    if not eleves_data:
+        raise HTTPException(status_code=400, detail="Aucun élève à importer")
+    
+    # Un bloc de matricules par (classe, année) : un aller-retour par groupe
+    groupes: Dict[tuple, List[EleveCreate]] = {}
+    for eleve_data in eleves_data:
+        groupes.setdefault((eleve_data.classe, eleve_data.annee_scolaire), []).append(eleve_data)
+    
+    maintenant = datetime.utcnow().isoformat()
+    eleves_docs = []
+    for (classe, annee), groupe in groupes.items():
+        matricules = await generer_matricules(classe, annee, len(groupe))
+        for eleve_data, matricule in zip(groupe, matricules):
+            eleves_docs.append({
+                "_id": str(uuid.uuid4()),
+                "matricule": matricule,
+                "nom": eleve_data.nom,
+                "prenoms": eleve_data.prenoms,
+                "date_naissance": eleve_data.date_naissance.isoformat(),
+                "sexe": eleve_data.sexe,
+                "classe": eleve_data.classe,
+                "telephone_parent": eleve_data.telephone_parent,
+                "adresse": eleve_data.adresse,
+                "annee_scolaire": eleve_data.annee_scolaire,
+                "statut_inscription": True,
+                "date_inscription": maintenant,
+                "date_creation": maintenant,
+                "date_modification": maintenant
+            })
+    
+    # Lignes refusées par la base (matricule en conflit...) : les autres élèves sont créés
+    rejetes = []
+    try:
+        await db.eleves.insert_many(eleves_docs, ordered=False)
+    except BulkWriteError as e:
+        for erreur in e.details["writeErrors"]:
+            eleve = eleves_docs[erreur["index"]]
+            rejetes.append({
+                "matricule": eleve["matricule"],
+                "nom": f"{eleve['nom']} {eleve['prenoms']}",
+                "classe": eleve["classe"],
+                "erreur": "Matricule déjà attribué" if erreur["code"] == 11000 else erreur.get("errmsg")
+            })
+    matricules_rejetes = {r["matricule"] for r in rejetes}
+    eleves_crees = [e for e in eleves_docs if e["matricule"] not in matricules_rejetes]
+    
+    return {
+        "message": f"Import terminé: {len(eleves_crees)} élèves créés" + (f", {len(rejetes)} refusés" if rejetes else ""),
+        "eleves": [
+            {"_id": e["_id"], "matricule": e["matricule"], "nom": f"{e['nom']} {e['prenoms']}", "classe": e["classe"]}
+            for e in eleves_crees
+        ],
+        "rejetes": rejetes
+    }
+
 @api_router.get("/eleves")
 async def list_eleves(
     page: int = Query(1, ge=1),
@@ -1596,7 +2596,7 @@ async def create_facture(facture_data: FactureCreate, current_user: dict = Depen
         raise HTTPException(status_code=404, detail="Élève introuvable")
     
     # Génération du numéro de facture
-    numero_facture = generate_numero_facture()
+    numero_facture = await generate_numero_facture()
     
     # Création de la facture
     facture_doc = {
@@ -1628,6 +2628,7 @@ async def list_factures(
     eleve_id: Optional[str] = None,
     statut: Optional[str] = None,
     impayees_seulement: bool = False,
+    annee_scolaire: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Liste des factures avec filtres"""
@@ -1643,15 +2644,20 @@ async def list_factures(
     if impayees_seulement:
         filter_query["statut"] = {"$in": ["emise", "payee_partiellement"]}
     
+    if annee_scolaire:
+        filter_query.update(filtre_factures_annee(annee_scolaire))
+    # Année archivée : factures soldées dans l'archive, créances toujours actives
+    selection = etapes_avec_archives("factures", filter_query, [annee_scolaire] if annee_scolaire else [])
+    
     # Comptage total
-    total = await db.factures.count_documents(filter_query)
+    comptage = await db.factures.aggregate(selection + [{"$count": "total"}]).to_list(length=None)
+    total = comptage[0]["total"] if comptage else 0
     
     # Pagination
     skip = (page - 1) * limit
     
     # Récupération des factures avec info élève
-    pipeline = [
-        {"$match": filter_query},
+    pipeline = selection + [
         {"$lookup": {
             "from": "eleves",
             "localField": "eleve_id", 
@@ -1684,25 +2690,16 @@ async def list_factures(
 @api_router.get("/factures/{facture_id}")
 async def get_facture(facture_id: str, current_user: dict = Depends(get_current_user)):
     """Détails d'une facture"""
-    # Récupération avec info élève
-    pipeline = [
-        {"$match": {"_id": facture_id}},
-        {"$lookup": {
-            "from": "eleves",
-            "localField": "eleve_id",
-            "foreignField": "_id", 
-            "as": "eleve"
-        }},
-        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}}
-    ]
-    
-    cursor = db.factures.aggregate(pipeline)
-    factures = await cursor.to_list(length=None)
-    
-    if not factures:
+    # Une facture soldée d'une année archivée est lue dans son archive
+    facture = await trouver_avec_archives("factures", {"_id": facture_id})
+    if not facture:
         raise HTTPException(status_code=404, detail="Facture introuvable")
     
-    facture = factures[0]
+    # Info élève
+    eleve = await db.eleves.find_one({"_id": facture["eleve_id"]})
+    if eleve:
+        facture['eleve'] = eleve
+    
     facture['_id'] = str(facture['_id'])
     if 'eleve' in facture and facture['eleve']:
         facture['eleve']['_id'] = str(facture['eleve']['_id'])
@@ -1711,10 +2708,14 @@ async def get_facture(facture_id: str, current_user: dict = Depends(get_current_
 
 # Routes de gestion des paiements 
 @api_router.post("/paiements/initier")
-async def initiate_payment(paiement_data: PaiementCreate, current_user: dict = Depends(get_current_user)):
+async def initiate_payment(
+    paiement_data: PaiementCreate,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
     """Initier un paiement mobile (Orange Money ou MTN Money)"""
     # Vérification de la facture
-    facture = await db.factures.find_one({"_id": paiement_data.facture_id})
+    facture = await chargeurs.factures.charger(paiement_data.facture_id)
     if not facture:
         raise HTTPException(status_code=404, detail="Facture introuvable")
     
@@ -1733,7 +2734,7 @@ async def initiate_payment(paiement_data: PaiementCreate, current_user: dict = D
         raise HTTPException(status_code=400, detail="Numéro de téléphone non reconnu")
     
     # Récupération des infos élève
-    eleve = await db.eleves.find_one({"_id": facture["eleve_id"]})
+    eleve = await chargeurs.eleves.charger(facture["eleve_id"])
     
     # Génération de la référence de paiement
     reference_paiement = f"PAY_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6].upper()}"
@@ -1790,6 +2791,7 @@ async def list_paiements(
     eleve_id: Optional[str] = None,
     facture_id: Optional[str] = None,
     statut: Optional[str] = None,
+    annee_scolaire: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Liste des paiements avec filtres"""
@@ -1805,37 +2807,53 @@ async def list_paiements(
     if statut:
         filter_query["statut"] = statut
     
+    annees = [annee_scolaire] if annee_scolaire else []
+    if annee_scolaire:
+        # Les paiements n'ont pas d'année : celle de leur facture, active ou archivée
+        factures_annee = await db.factures.aggregate(
+            etapes_avec_archives("factures", filtre_factures_annee(annee_scolaire), annees) + [{"$project": {"_id": 1}}]
+        ).to_list(length=None)
+        ids_factures = [f["_id"] for f in factures_annee]
+        if facture_id:
+            ids_factures = [f for f in ids_factures if f == facture_id]
+        filter_query["facture_id"] = {"$in": ids_factures}
+    # Les paiements d'une facture archivée sont archivés avec elle, ceux des créances restent actifs
+    selection = etapes_avec_archives("paiements", filter_query, annees)
+    
     # Comptage total
-    total = await db.paiements.count_documents(filter_query)
+    comptage = await db.paiements.aggregate(selection + [{"$count": "total"}]).to_list(length=None)
+    total = comptage[0]["total"] if comptage else 0
     
     # Pagination
     skip = (page - 1) * limit
     
     # Récupération des paiements avec infos associées
-    pipeline = [
-        {"$match": filter_query},
+    pipeline = selection + [
+        {"$sort": {"date_initiation": -1}},
+        {"$skip": skip},
+        {"$limit": limit},
         {"$lookup": {
             "from": "eleves",
             "localField": "eleve_id",
             "foreignField": "_id",
             "as": "eleve"
         }},
-        {"$lookup": {
-            "from": "factures", 
-            "localField": "facture_id",
-            "foreignField": "_id",
-            "as": "facture"
-        }},
-        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}},
-        {"$unwind": {"path": "$facture", "preserveNullAndEmptyArrays": True}},
-        {"$sort": {"date_initiation": -1}},
-        {"$skip": skip},
-        {"$limit": limit}
+        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}}
     ]
     
     cursor = db.paiements.aggregate(pipeline)
     paiements = await cursor.to_list(length=None)
     
+    # Factures de la page, dans la collection active ou l'archive de l'année
+    factures = {
+        f["_id"]: f for f in await db.factures.aggregate(
+            etapes_avec_archives("factures", {"_id": {"$in": [p["facture_id"] for p in paiements]}}, annees)
+        ).to_list(length=None)
+    }
+    for paiement in paiements:
+        if paiement["facture_id"] in factures:
+            paiement["facture"] = factures[paiement["facture_id"]]
+    
     # Conversion des ObjectIds
     for paiement in paiements:
         paiement['_id'] = str(paiement['_id'])
@@ -1852,54 +2870,291 @@ async def list_paiements(
         "total_pages": (total + limit - 1) // limit
     }
 
-@api_router.put("/paiements/{paiement_id}/simuler-succes")
-async def simulate_payment_success(paiement_id: str, current_user: dict = Depends(get_current_user)):
-    """Simule un paiement réussi (pour la démo)"""
-    if current_user["role"] not in ["administrateur"]:
-        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
-    
-    # Récupération du paiement
-    paiement = await db.paiements.find_one({"_id": paiement_id})
-    if not paiement:
-        raise HTTPException(status_code=404, detail="Paiement introuvable")
+# Expiration des paiements non confirmés
+INTERVALLE_BALAYAGE_PAIEMENTS = float(os.environ.get('PAYMENT_SWEEP_SECONDS', '60'))
+
+async def expirer_paiements() -> dict:
+    """Passe en `expire` tous les paiements initiés dont la date d'expiration est dépassée"""
+    balayage_id = str(uuid.uuid4())
+    maintenant = datetime.utcnow().isoformat()
     
-    # Mise à jour du statut du paiement
-    await db.paiements.update_one(
-        {"_id": paiement_id},
-        {
-            "$set": {
-                "statut": "reussi",
-                "date_completion": datetime.utcnow().isoformat(),
-                "reference_operateur": f"TXN_{uuid.uuid4().hex[:12].upper()}",
-                "date_modification": datetime.utcnow().isoformat()
-            }
-        }
+    resultat = await db.paiements.update_many(
+        {"statut": "initie", "date_expiration": {"$lt": maintenant}},
+        {"$set": {"statut": "expire", "balayage_id": balayage_id, "date_modification": maintenant}}
     )
     
-    # Mise à jour de la facture
-    facture = await db.factures.find_one({"_id": paiement["facture_id"]})
-    nouveau_montant_paye = facture["montant_paye"] + paiement["montant"]
-    nouveau_montant_restant = facture["montant_total"] - nouveau_montant_paye
+    par_operateur = []
+    if resultat.modified_count:
+        par_operateur = await db.paiements.aggregate([
+            {"$match": {"balayage_id": balayage_id}},
+            {"$group": {"_id": "$operateur", "nombre": {"$sum": 1}, "montant": {"$sum": "$montant"}}},
+            {"$project": {"_id": 0, "operateur": "$_id", "nombre": 1, "montant": 1}},
+            {"$sort": {"operateur": 1}}
+        ]).to_list(length=None)
+        
+        await db.balayages_paiements.insert_one({
+            "_id": balayage_id,
+            "date": datetime.now(timezone.utc),
+            "total_expires": resultat.modified_count,
+            "par_operateur": par_operateur,
+            "worker": identifiant_worker()
+        })
+        logger.info(
+            f"Paiements expirés: {resultat.modified_count} ("
+            + ", ".join(f"{o['operateur']}: {o['nombre']}" for o in par_operateur) + ")"
+        )
     
-    nouveau_statut = "payee_totalement" if nouveau_montant_restant <= 0 else "payee_partiellement"
+    return {"balayage_id": balayage_id, "total_expires": resultat.modified_count, "par_operateur": par_operateur}
+
+async def balayer_paiements_periodiquement():
+    """Tâche de fond : un seul worker à la fois expire les paiements (verrou distribué)"""
+    while True:
+        try:
+            if await acquerir_verrou("balayage_paiements", INTERVALLE_BALAYAGE_PAIEMENTS):
+                await expirer_paiements()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur balayage des paiements: {str(e)}")
+        await asyncio.sleep(INTERVALLE_BALAYAGE_PAIEMENTS)
+
+@api_router.post("/admin/paiements/expirer")
+async def declencher_expiration_paiements(current_user: dict = Depends(get_current_user)):
+    """Déclenche immédiatement l'expiration des paiements en attente dépassés"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
     
-    await db.factures.update_one(
-        {"_id": paiement["facture_id"]},
-        {
-            "$set": {
-                "montant_paye": nouveau_montant_paye,
-                "montant_restant": max(0, nouveau_montant_restant),
-                "statut": nouveau_statut,
-                "date_modification": datetime.utcnow().isoformat()
-            }
-        }
+    resultat = await expirer_paiements()
+    return {"message": f"{resultat['total_expires']} paiement(s) expiré(s)", **resultat}
+
+# Confirmations des opérateurs mobiles (callbacks Orange Money / MTN)
+SECRETS_CALLBACK = {
+    "orange": os.environ.get('ORANGE_CALLBACK_SECRET'),
+    "mtn": os.environ.get('MTN_CALLBACK_SECRET')
+}
+TAILLE_LOT_REGLEMENTS = int(os.environ.get('SETTLEMENT_BATCH_SIZE', '200'))
+DELAI_REPRISE_REGLEMENTS = 30  # Secondes avant qu'un événement non traité soit repris
+
+# File locale au worker ; les événements sont d'abord persistés, la file n'est qu'un accélérateur
+file_reglements: asyncio.Queue = asyncio.Queue(maxsize=10000)
+
+def verifier_signature_callback(operateur: str, corps: bytes, signature: Optional[str]) -> bool:
+    """Vérifie la signature HMAC-SHA256 (hexadécimale) du corps brut de la requête"""
+    secret = SECRETS_CALLBACK.get(operateur)
+    if not secret or not signature:
+        return False
+    attendue = hmac.new(secret.encode("utf-8"), corps, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(attendue, signature.strip().lower())
+
+async def crediter_factures(filtre: Optional[dict] = None) -> List[str]:
+    """Crédite les factures des paiements `reussi` pas encore crédités ; retourne les factures modifiées.
+    
+    Le paiement passe à `reussi` avec facture_creditee à False dans la même écriture ;
+    chaque facture garde la liste des paiements crédités, si bien qu'une reprise après
+    interruption entre les deux écritures ne crédite jamais deux fois.
+    """
+    paiements = await db.paiements.find(
+        {**(filtre or {}), "statut": "reussi", "facture_creditee": False},
+        {"facture_id": 1, "montant": 1}
+    ).to_list(length=None)
+    if not paiements:
+        return []
+    
+    maintenant = datetime.utcnow().isoformat()
+    await db.factures.bulk_write([
+        UpdateOne({"_id": paiement["facture_id"], "paiements_credites": {"$ne": paiement["_id"]}}, [
+            {"$set": {
+                "montant_paye": {"$add": ["$montant_paye", paiement["montant"]]},
+                "paiements_credites": {"$concatArrays": [{"$ifNull": ["$paiements_credites", []]}, [paiement["_id"]]]}
+            }},
+            {"$set": {
+                "montant_restant": {"$max": [0, {"$subtract": ["$montant_total", "$montant_paye"]}]},
+                "statut": {"$cond": [
+                    {"$lte": [{"$subtract": ["$montant_total", "$montant_paye"]}, 0]},
+                    "payee_totalement",
+                    "payee_partiellement"
+                ]},
+                "date_modification": maintenant
+            }}
+        ])
+        for paiement in paiements
+    ], ordered=False)
+    await db.paiements.update_many(
+        {"_id": {"$in": [p["_id"] for p in paiements]}},
+        {"$set": {"facture_creditee": True}}
     )
     
+    factures = list({p["facture_id"] for p in paiements})
+    # Les reçus PDF de ces factures ne reflètent plus leur état
+    await db.recus_pdf.delete_many({"_id": {"$in": factures}})
+    return factures
+
+async def appliquer_reglements(evenements: List[dict]) -> dict:
+    """Applique un lot de confirmations : paiements, puis factures, en écritures groupées.
+    
+    Seuls les paiements encore `initie` (ou `expire`) changent d'état, ce qui rend
+    le traitement idempotent même si un événement est rejoué par un autre worker.
+    """
+    lot_id = str(uuid.uuid4())
+    maintenant = datetime.utcnow().isoformat()
+    
+    references = [e["reference_interne"] for e in evenements]
+    paiements = {
+        p["reference_interne"]: p
+        for p in await db.paiements.find({"reference_interne": {"$in": references}}).to_list(length=None)
+    }
+    
+    operations_paiements = []
+    statuts_evenements: Dict[str, dict] = {}
+    for evenement in evenements:
+        paiement = paiements.get(evenement["reference_interne"])
+        if not paiement:
+            statuts_evenements[evenement["_id"]] = {"statut": "ignore", "raison": "Paiement inconnu"}
+            continue
+        if evenement["statut_operateur"] == "reussi" and evenement.get("montant") is not None and abs(evenement["montant"] - paiement["montant"]) > 0.01:
+            statuts_evenements[evenement["_id"]] = {"statut": "anomalie", "raison": "Montant différent du paiement initié"}
+            continue
+        if evenement.get("operateur") and evenement["operateur"].upper() != paiement.get("operateur", "").upper():
+            statuts_evenements[evenement["_id"]] = {"statut": "anomalie", "raison": "Opérateur différent du paiement initié"}
+            continue
+        reglement = {
+            "statut": evenement["statut_operateur"],
+            "reference_operateur": evenement["reference_operateur"],
+            "date_completion": evenement.get("date_transaction") or maintenant,
+            "lot_reglement": lot_id,
+            "date_modification": maintenant
+        }
+        if evenement["statut_operateur"] == "reussi":
+            reglement["facture_creditee"] = False
+        operations_paiements.append(UpdateOne(
+            {"_id": paiement["_id"], "statut": {"$in": ["initie", "expire"]}},
+            {"$set": reglement}
+        ))
+        statuts_evenements[evenement["_id"]] = {"statut": "traite"}
+    
+    paiements_regles, factures = 0, []
+    if operations_paiements:
+        await db.paiements.bulk_write(operations_paiements, ordered=False)
+        # Paiements réellement passés à `reussi` par ce lot (les autres étaient déjà réglés)
+        paiements_regles = await db.paiements.count_documents({"lot_reglement": lot_id, "statut": "reussi"})
+        factures = await crediter_factures({"lot_reglement": lot_id})
+    
+    operations_evenements = [
+        UpdateOne({"_id": evenement_id}, {"$set": {**statut, "lot_reglement": lot_id, "date_traitement": datetime.now(timezone.utc)}})
+        for evenement_id, statut in statuts_evenements.items()
+    ]
+    if operations_evenements and not all(e.get("synthetique") for e in evenements):
+        await db.evenements_paiement.bulk_write(operations_evenements, ordered=False)
+    
+    return {"lot_id": lot_id, "paiements_regles": paiements_regles, "factures_mises_a_jour": factures}
+
+async def traiter_file_reglements():
+    """Tâche de fond : vide la file par lots et applique les règlements"""
+    while True:
+        evenements = [await file_reglements.get()]
+        while len(evenements) < TAILLE_LOT_REGLEMENTS and not file_reglements.empty():
+            evenements.append(file_reglements.get_nowait())
+        try:
+            await appliquer_reglements(evenements)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Les événements restent `recu` en base et seront repris
+            logger.error(f"Erreur application des règlements: {str(e)}")
+
+async def reprendre_reglements_en_attente():
+    """Tâche de fond : reprend les événements persistés mais jamais traités (file pleine, worker arrêté)
+    et crédite les factures des paiements réglés dont le crédit a été interrompu"""
+    while True:
+        await asyncio.sleep(DELAI_REPRISE_REGLEMENTS)
+        try:
+            await crediter_factures()
+            limite = datetime.now(timezone.utc) - timedelta(seconds=DELAI_REPRISE_REGLEMENTS)
+            while True:
+                evenements = await db.evenements_paiement.find(
+                    {"statut": "recu", "date_reception": {"$lt": limite}}
+                ).limit(TAILLE_LOT_REGLEMENTS).to_list(length=None)
+                if not evenements:
+                    break
+                await appliquer_reglements(evenements)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur reprise des règlements: {str(e)}")
+
+@api_router.post("/paiements/callback/{operateur}")
+async def recevoir_callback_operateur(operateur: str, request: Request):
+    """Réception des confirmations de paiement envoyées par Orange Money / MTN"""
+    if operateur not in SECRETS_CALLBACK:
+        raise HTTPException(status_code=404, detail="Opérateur inconnu")
+    
+    corps = await request.body()
+    if not verifier_signature_callback(operateur, corps, request.headers.get("x-signature")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Signature invalide")
+    
+    try:
+        callback = CallbackOperateur.model_validate_json(corps)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Contenu de la notification invalide")
+    
+    evenement = {
+        "_id": f"{operateur}:{callback.reference_operateur}",
+        "operateur": operateur.upper(),
+        "reference_interne": callback.reference_interne,
+        "reference_operateur": callback.reference_operateur,
+        "statut_operateur": callback.statut,
+        "statut": "recu",
+        "montant": callback.montant,
+        "date_transaction": callback.date_transaction.isoformat() if callback.date_transaction else None,
+        "date_reception": datetime.now(timezone.utc)
+    }
+    
+    # Idempotence : une même transaction opérateur n'est enregistrée qu'une fois
+    try:
+        await db.evenements_paiement.insert_one(evenement)
+    except DuplicateKeyError:
+        return {"recu": True, "doublon": True}
+    
+    try:
+        file_reglements.put_nowait(evenement)
+    except asyncio.QueueFull:
+        logger.warning("File des règlements pleine : événement laissé à la reprise périodique")
+    
+    return {"recu": True, "doublon": False}
+
+@api_router.put("/paiements/{paiement_id}/simuler-succes")
+async def simulate_payment_success(paiement_id: str, current_user: dict = Depends(get_current_user)):
+    """Simule un paiement réussi (pour la démo)"""
+    if current_user["role"] not in ["administrateur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    # Récupération du paiement (un paiement archivé est déjà réglé : refusé plus bas)
+    paiement = await trouver_avec_archives("paiements", {"_id": paiement_id})
+    if not paiement:
+        raise HTTPException(status_code=404, detail="Paiement introuvable")
+    
+    if paiement["statut"] == "expire":
+        raise HTTPException(status_code=400, detail="Paiement expiré")
+    
+    # Même chemin de règlement que les confirmations des opérateurs
+    resultat = await appliquer_reglements([{
+        "_id": f"simulation:{paiement_id}",
+        "reference_interne": paiement["reference_interne"],
+        "reference_operateur": f"TXN_{uuid.uuid4().hex[:12].upper()}",
+        "statut_operateur": "reussi",
+        "montant": paiement["montant"],
+        "synthetique": True
+    }])
+    if not resultat["paiements_regles"]:
+        raise HTTPException(status_code=409, detail=f"Paiement non réglé (statut actuel : {paiement['statut']})")
+    
+    facture = await trouver_avec_archives("factures", {"_id": paiement["facture_id"]})
+    
     return {
         "success": True,
         "message": "Paiement simulé avec succès",
-        "nouveau_statut_facture": nouveau_statut,
-        "montant_restant": max(0, nouveau_montant_restant)
+        "nouveau_statut_facture": facture["statut"],
+        "montant_restant": facture["montant_restant"]
     }
 
 @api_router.post("/admin/generer-code-admin")
@@ -1937,9 +3192,11 @@ async def create_matiere(matiere_data: MatiereCreate, current_user: dict = Depen
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     # Vérification si la matière existe déjà
-    existing_matiere = await db.matieres.find_one({"code": matiere_data.code})
-    if existing_matiere:
+    existing_matiere = await db.matieres.find_one({"$or": [{"code": matiere_data.code}, {"nom": matiere_data.nom}]})
+    if existing_matiere and existing_matiere["code"] == matiere_data.code:
         raise HTTPException(status_code=400, detail="Une matière avec ce code existe déjà")
+    if existing_matiere:
+        raise HTTPException(status_code=400, detail="Une matière avec ce nom existe déjà")
     
     matiere_doc = {
         "_id": str(uuid.uuid4()),
@@ -1954,16 +3211,23 @@ async def create_matiere(matiere_data: MatiereCreate, current_user: dict = Depen
     }
     
     await db.matieres.insert_one(matiere_doc)
+    cache_referentiel.enregistrer("matieres", matiere_doc)
+    await incrementer_version("matieres")
     
     return {"message": "Matière créée avec succès", "matiere": matiere_doc}
 
 @api_router.get("/matieres")
-async def list_matieres(current_user: dict = Depends(get_current_user)):
+async def list_matieres(request: Request, current_user: dict = Depends(get_current_user)):
     """Liste des matières"""
-    matieres = await db.matieres.find().to_list(length=None)
+    etag = calculer_etag(["matieres"])
+    non_modifiee = reponse_non_modifiee(request, etag)
+    if non_modifiee:
+        return non_modifiee
+    
+    matieres = cache_referentiel.liste_matieres()
     for matiere in matieres:
         matiere['_id'] = str(matiere['_id'])
-    return {"matieres": matieres}
+    return reponse_avec_etag({"matieres": matieres}, etag)
 
 # Routes de gestion des notes
 @api_router.post("/notes")
@@ -1971,6 +3235,7 @@ async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_cu
     """Créer une nouvelle note"""
     if current_user["role"] not in ["administrateur", "enseignant"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
+    verifier_annee_ouverte(note_data.annee_scolaire)
     
     # Vérification de l'élève
     eleve = await db.eleves.find_one({"_id": note_data.eleve_id})
@@ -1978,7 +3243,7 @@ async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_cu
         raise HTTPException(status_code=404, detail="Élève introuvable")
     
     # Vérification de la matière
-    matiere = await db.matieres.find_one({"nom": note_data.matiere})
+    matiere = cache_referentiel.matieres_par_nom.get(note_data.matiere)
     if not matiere:
         raise HTTPException(status_code=404, detail="Matière introuvable")
     
@@ -1999,9 +3264,192 @@ async def create_note(note_data: NoteCreate, current_user: dict = Depends(get_cu
     }
     
     await db.notes.insert_one(note_doc)
+    await mettre_a_jour_moyennes([note_doc])
     
     return {"message": "Note enregistrée avec succès", "note": note_doc}
 
+async def mettre_a_jour_moyennes(notes: List[dict]):
+    """Met à jour les moyennes matérialisées (moyennes_eleves) en une écriture groupée"""
+    cumuls: Dict[str, dict] = {}
+    for note in notes:
+        cle = f"{note['eleve_id']}:{note['annee_scolaire']}:{note['trimestre']}:{note['matiere']}"
+        cumul = cumuls.setdefault(cle, {
+            "filtre": {
+                "eleve_id": note["eleve_id"],
+                "annee_scolaire": note["annee_scolaire"],
+                "trimestre": note["trimestre"],
+                "matiere": note["matiere"]
+            },
+            "somme_ponderee": 0.0,
+            "somme_coefficients": 0.0,
+            "nb_notes": 0
+        })
+        cumul["somme_ponderee"] += note["note"] * note["coefficient"]
+        cumul["somme_coefficients"] += note["coefficient"]
+        cumul["nb_notes"] += 1
+    
+    if not cumuls:
+        return
+    
+    operations = [
+        UpdateOne(
+            {"_id": cle},
+            {
+                "$inc": {
+                    "somme_ponderee": cumul["somme_ponderee"],
+                    "somme_coefficients": cumul["somme_coefficients"],
+                    "nb_notes": cumul["nb_notes"]
+                },
+                "$set": {"date_modification": datetime.now(timezone.utc)},
+                "$setOnInsert": cumul["filtre"]
+            },
+            upsert=True
+        )
+        for cle, cumul in cumuls.items()
+    ]
+    await db.moyennes_eleves.bulk_write(operations, ordered=False)
+
+INTERVALLE_RECONCILIATION_MOYENNES = int(os.environ.get('AVERAGES_RECONCILIATION_SECONDS', '3600'))
+
+async def reconstruire_moyennes(base=None, filtre: Optional[dict] = None) -> int:
+    """Recalcule moyennes_eleves depuis notes : remplissage initial, puis correction de la dérive
+    (note insérée sans son $inc, modification hors application). Retourne le nombre de cumuls corrigés.
+    
+    Une incrémentation concurrente peut être écrasée ; elle sera corrigée au passage suivant.
+    """
+    base = db if base is None else base
+    # Les notes d'une année archivée ne sont plus dans notes : ses cumuls sont conservés
+    filtre = {"$and": [filtre or {}, {"annee_scolaire": {"$nin": await base.archivages.distinct("_id")}}]}
+    debut = datetime.now(timezone.utc)
+    cles, operations, corriges = set(), [], 0
+    
+    async def ecrire():
+        nonlocal corriges
+        if operations:
+            resultat = await base.moyennes_eleves.bulk_write(operations, ordered=False)
+            corriges += resultat.modified_count + resultat.upserted_count
+            operations.clear()
+    
+    async for cumul in base.notes.aggregate([
+        {"$match": filtre},
+        {"$group": {
+            "_id": {"eleve_id": "$eleve_id", "annee_scolaire": "$annee_scolaire", "trimestre": "$trimestre", "matiere": "$matiere"},
+            "somme_ponderee": {"$sum": {"$multiply": ["$note", "$coefficient"]}},
+            "somme_coefficients": {"$sum": "$coefficient"},
+            "nb_notes": {"$sum": 1}
+        }}
+    ], allowDiskUse=True):
+        ident = cumul.pop("_id")
+        cle = f"{ident['eleve_id']}:{ident['annee_scolaire']}:{ident['trimestre']}:{ident['matiere']}"
+        cles.add(cle)
+        # Un cumul déjà juste n'est pas modifié (et n'est pas compté comme corrigé)
+        operations.append(UpdateOne(
+            {"_id": cle},
+            {"$set": cumul, "$setOnInsert": {**ident, "date_modification": debut}},
+            upsert=True
+        ))
+        if len(operations) >= 1000:
+            await ecrire()
+    await ecrire()
+    
+    # Cumuls sans note (notes supprimées) ; ceux créés pendant le recalcul sont laissés au passage suivant
+    orphelins = [
+        m["_id"] async for m in base.moyennes_eleves.find(
+            {**filtre, "date_modification": {"$lt": debut}}, {"_id": 1}
+        )
+        if m["_id"] not in cles
+    ]
+    for i in range(0, len(orphelins), 1000):
+        corriges += (await base.moyennes_eleves.delete_many({"_id": {"$in": orphelins[i:i + 1000]}})).deleted_count
+    return corriges
+
+async def reconcilier_moyennes_periodiquement():
+    """Tâche de fond : le premier passage remplit moyennes_eleves depuis les notes existantes,
+    les suivants corrigent la dérive ; un seul worker à la fois (verrou distribué)"""
+    while True:
+        try:
+            if await acquerir_verrou("reconciliation_moyennes", INTERVALLE_RECONCILIATION_MOYENNES):
+                corriges = await reconstruire_moyennes()
+                if corriges:
+                    logger.info(f"Réconciliation des moyennes : {corriges} cumul(s) corrigé(s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur réconciliation des moyennes: {str(e)}")
+        await asyncio.sleep(INTERVALLE_RECONCILIATION_MOYENNES)
+
+@api_router.post("/notes/evaluations")
+async def saisir_evaluation(evaluation_data: EvaluationCreate, current_user: dict = Depends(get_current_user)):
+    """Saisir les notes de toute une classe pour une évaluation"""
+    if current_user["role"] not in ["administrateur", "enseignant"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    verifier_annee_ouverte(evaluation_data.annee_scolaire)
+    
+    # Vérification de la matière (cache du référentiel)
+    if not cache_referentiel.matieres_par_nom.get(evaluation_data.matiere):
+        raise HTTPException(status_code=404, detail="Matière introuvable")
+    
+    # Vérification de tous les élèves en une seule requête
+    ids_eleves = [n.eleve_id for n in evaluation_data.notes]
+    eleves = await db.eleves.find({"_id": {"$in": ids_eleves}}, {"_id": 1, "classe": 1}).to_list(length=None)
+    classes_eleves = {str(eleve["_id"]): eleve.get("classe") for eleve in eleves}
+    
+    inconnus = [eleve_id for eleve_id in ids_eleves if eleve_id not in classes_eleves]
+    if inconnus:
+        raise HTTPException(status_code=404, detail=f"Élèves introuvables: {', '.join(inconnus)}")
+    
+    if evaluation_data.classe:
+        hors_classe = [eleve_id for eleve_id in ids_eleves if classes_eleves[eleve_id] != evaluation_data.classe]
+        if hors_classe:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Élèves hors de la classe {evaluation_data.classe}: {', '.join(hors_classe)}"
+            )
+    
+    maintenant = datetime.now(timezone.utc)
+    evaluation_doc = {
+        "_id": str(uuid.uuid4()),
+        "matiere": evaluation_data.matiere,
+        "type_evaluation": evaluation_data.type_evaluation,
+        "coefficient": evaluation_data.coefficient,
+        "date_evaluation": evaluation_data.date_evaluation.isoformat(),
+        "trimestre": evaluation_data.trimestre,
+        "annee_scolaire": evaluation_data.annee_scolaire,
+        "classe": evaluation_data.classe,
+        "nb_notes": len(evaluation_data.notes),
+        "enseignant_id": current_user["_id"],
+        "date_creation": maintenant
+    }
+    
+    notes_docs = [
+        {
+            "_id": str(uuid.uuid4()),
+            "eleve_id": saisie.eleve_id,
+            "matiere": evaluation_data.matiere,
+            "type_evaluation": evaluation_data.type_evaluation,
+            "note": saisie.note,
+            "coefficient": evaluation_data.coefficient,
+            "date_evaluation": evaluation_data.date_evaluation.isoformat(),
+            "trimestre": evaluation_data.trimestre,
+            "annee_scolaire": evaluation_data.annee_scolaire,
+            "commentaire": saisie.commentaire,
+            "enseignant_id": current_user["_id"],
+            "evaluation_id": evaluation_doc["_id"],
+            "date_creation": maintenant,
+            "date_modification": maintenant
+        }
+        for saisie in evaluation_data.notes
+    ]
+    
+    await db.evaluations.insert_one(evaluation_doc)
+    await db.notes.insert_many(notes_docs, ordered=False)
+    await mettre_a_jour_moyennes(notes_docs)
+    
+    return {
+        "message": f"{len(notes_docs)} notes enregistrées avec succès",
+        "evaluation": evaluation_doc
+    }
+
 @api_router.get("/notes")
 async def list_notes(
     eleve_id: Optional[str] = None,
@@ -2035,7 +3483,7 @@ async def list_notes(
         {"$sort": {"date_evaluation": -1}}
     ]
     
-    cursor = db.notes.aggregate(pipeline)
+    cursor = collection_pour("notes", annee_scolaire).aggregate(pipeline)
     notes = await cursor.to_list(length=None)
     
     for note in notes:
@@ -2098,7 +3546,7 @@ async def calculate_moyennes(
         {"$sort": {"trimestre": 1, "matiere": 1}}
     ]
     
-    cursor = db.notes.aggregate(pipeline)
+    cursor = collection_pour("notes", annee_scolaire).aggregate(pipeline)
     moyennes_matiere = await cursor.to_list(length=None)
     
     # Calcul de la moyenne générale
@@ -2134,20 +3582,22 @@ async def generer_bulletin(bulletin_request: BulletinRequest, current_user: dict
         current_user
     )
     
-    # Récupération des présences
-    presences_filter = {
-        "eleve_id": bulletin_request.eleve_id,
-        "date_cours": {
-            "$regex": f"^{bulletin_request.annee_scolaire.split('-')[0]}"
-        }
-    }
-    
-    cursor = db.presences.find(presences_filter)
-    presences = await cursor.to_list(length=None)
+    # Présences de l'année scolaire, comptées côté base
+    comptes = await collection_pour("presences_ts", bulletin_request.annee_scolaire).aggregate([
+        {"$match": {
+            "metadonnees.eleve_id": bulletin_request.eleve_id,
+            "date_cours": periode_presences(bulletin_request.annee_scolaire)
+        }},
+        {"$group": {
+            "_id": None,
+            "total_cours": {"$sum": 1},
+            "absences": {"$sum": {"$cond": [{"$eq": ["$present", False]}, 1, 0]}}
+        }}
+    ]).to_list(length=1)
     
     # Calcul des absences par trimestre (approximatif)
-    absences = len([p for p in presences if not p.get("present", True)])
-    total_cours = len(presences)
+    absences = comptes[0]["absences"] if comptes else 0
+    total_cours = comptes[0]["total_cours"] if comptes else 0
     taux_presence = round((total_cours - absences) / total_cours * 100, 1) if total_cours > 0 else 100
     
     bulletin_data = {
@@ -2186,6 +3636,109 @@ def generer_appreciation(moyenne_generale: float) -> str:
     else:
         return "Travail très insuffisant. Aide et soutien nécessaires."
 
+# Bulletins d'une classe entière : rendu PDF en lot
+VERSION_GABARIT_BULLETIN = 1  # À incrémenter quand la mise en page du bulletin change
+
+def moyennes_depuis_notes(notes: List[dict]) -> tuple:
+    """Même calcul que /notes/moyennes, fait en mémoire sur des notes déjà chargées"""
+    groupes: Dict[tuple, List[dict]] = {}
+    for note in notes:
+        groupes.setdefault((note["trimestre"], note["matiere"]), []).append(note)
+    
+    moyennes_matiere = [
+        {
+            "matiere": matiere,
+            "trimestre": trimestre,
+            "moyenne": round(sum(n["note"] * n["coefficient"] for n in groupe) / len(groupe), 2),
+            "coefficient_total": sum(n["coefficient"] for n in groupe),
+            "nb_notes": len(groupe)
+        }
+        for (trimestre, matiere), groupe in sorted(groupes.items())
+    ]
+    
+    total_coefficients = sum(m["coefficient_total"] for m in moyennes_matiere)
+    if total_coefficients > 0:
+        moyenne_generale = round(sum(m["moyenne"] * m["coefficient_total"] for m in moyennes_matiere) / total_coefficients, 2)
+    else:
+        moyenne_generale = 0
+    return moyennes_matiere, moyenne_generale
+
+@api_router.post("/bulletins/classe")
+async def generer_bulletins_classe(bulletins_request: BulletinsClasseRequest, current_user: dict = Depends(get_current_user)):
+    """Bulletins PDF de tous les élèves d'une classe, envoyés en une archive ZIP"""
+    if current_user["role"] not in ["administrateur", "enseignant"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    annee = bulletins_request.annee_scolaire
+    trimestre = bulletins_request.trimestre
+    
+    eleves = await db.eleves.find(
+        {"classe": bulletins_request.classe, "annee_scolaire": annee, "statut_inscription": True},
+        {"nom": 1, "prenoms": 1, "classe": 1, "matricule": 1}
+    ).sort([("nom", 1), ("prenoms", 1)]).to_list(length=None)
+    if not eleves:
+        raise HTTPException(status_code=404, detail="Aucun élève inscrit dans cette classe")
+    eleve_ids = [e["_id"] for e in eleves]
+    
+    # Toutes les données de la classe en deux requêtes
+    notes_par_eleve: Dict[str, List[dict]] = {}
+    async for note in collection_pour("notes", annee).find(
+        {"eleve_id": {"$in": eleve_ids}, "annee_scolaire": annee, "trimestre": trimestre},
+        {"eleve_id": 1, "matiere": 1, "trimestre": 1, "note": 1, "coefficient": 1}
+    ):
+        notes_par_eleve.setdefault(note["eleve_id"], []).append(note)
+    
+    presences_par_eleve = {
+        p["_id"]: p for p in await collection_pour("presences_ts", annee).aggregate([
+            {"$match": {"metadonnees.eleve_id": {"$in": eleve_ids}, "date_cours": periode_presences(annee)}},
+            {"$group": {
+                "_id": "$metadonnees.eleve_id",
+                "total_cours": {"$sum": 1},
+                "absences": {"$sum": {"$cond": [{"$eq": ["$present", False]}, 1, 0]}}
+            }}
+        ]).to_list(length=None)
+    }
+    
+    bulletins = []
+    for eleve in eleves:
+        moyennes_matiere, moyenne_generale = moyennes_depuis_notes(notes_par_eleve.get(eleve["_id"], []))
+        presences = presences_par_eleve.get(eleve["_id"], {"total_cours": 0, "absences": 0})
+        total_cours, absences = presences["total_cours"], presences["absences"]
+        bulletin_data = {
+            "eleve": {
+                "_id": eleve["_id"],
+                "nom": eleve["nom"],
+                "prenoms": eleve["prenoms"],
+                "classe": eleve["classe"],
+                "matricule": eleve.get("matricule")
+            },
+            "trimestre": trimestre,
+            "annee_scolaire": annee,
+            "moyennes_par_matiere": moyennes_matiere,
+            "moyenne_generale": moyenne_generale,
+            "presences": {
+                "total_cours": total_cours,
+                "absences": absences,
+                "taux_presence": round((total_cours - absences) / total_cours * 100, 1) if total_cours > 0 else 100
+            },
+            "appreciation": generer_appreciation(moyenne_generale)
+        }
+        bulletins.append((bulletin_data, empreinte_document(VERSION_GABARIT_BULLETIN, bulletin_data)))
+    
+    async def rendre(bulletin_data: dict, empreinte: str):
+        eleve = bulletin_data["eleve"]
+        nom = nom_fichier_sur(f"{eleve['nom']}_{eleve['prenoms']}_{eleve['matricule'] or eleve['_id']}") + ".pdf"
+        # Un bulletin dont les données n'ont pas changé est relu depuis le cache, jamais re-rendu
+        return nom, await rendre_pdf_en_cache("bulletins", rendre_bulletin, bulletin_data, empreinte)
+    
+    return StreamingResponse(
+        archive_zip_en_flux(rendus_au_fil_de_l_eau(rendre(bulletin_data, empreinte) for bulletin_data, empreinte in bulletins)),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="bulletins_{nom_fichier_sur(bulletins_request.classe)}_{trimestre}_{annee}.zip"'
+        }
+    )
+
 # Routes de gestion du calendrier académique
 @api_router.post("/calendrier/evenements")
 async def create_evenement(evenement_data: EvenementCreate, current_user: dict = Depends(get_current_user)):
@@ -2208,11 +3761,13 @@ async def create_evenement(evenement_data: EvenementCreate, current_user: dict =
     }
     
     await db.evenements_calendrier.insert_one(evenement_doc)
+    await incrementer_version("evenements_calendrier")
     
     return {"message": "Événement créé avec succès", "evenement": evenement_doc}
 
 @api_router.get("/calendrier/evenements")
 async def list_evenements(
+    request: Request,
     mois: Optional[int] = None,
     annee: int = Query(default=2025, ge=2020, le=2030),
     classe: Optional[str] = None,
@@ -2220,6 +3775,11 @@ async def list_evenements(
     current_user: dict = Depends(get_current_user)
 ):
     """Liste des événements du calendrier"""
+    etag = calculer_etag(["evenements_calendrier"], mois, annee, classe, type_evenement)
+    non_modifiee = reponse_non_modifiee(request, etag)
+    if non_modifiee:
+        return non_modifiee
+    
     filter_query = {}
     
     if mois and annee:
@@ -2250,7 +3810,7 @@ async def list_evenements(
     for evenement in evenements:
         evenement['_id'] = str(evenement['_id'])
     
-    return {"evenements": evenements}
+    return reponse_avec_etag({"evenements": evenements}, etag)
 
 # Routes de gestion des trimestres
 @api_router.post("/trimestres")
@@ -2283,19 +3843,30 @@ async def create_trimestre(trimestre_data: TrimestreCreate, current_user: dict =
     }
     
     await db.trimestres.insert_one(trimestre_doc)
+    cache_referentiel.enregistrer("trimestres", trimestre_doc)
+    await incrementer_version("trimestres")
     
     return {"message": "Trimestre créé avec succès", "trimestre": trimestre_doc}
 
 @api_router.get("/trimestres")
 async def list_trimestres(
+    request: Request,
     annee_scolaire: str = "2024-2025",
     current_user: dict = Depends(get_current_user)
 ):
     """Liste des trimestres personnalisés ou par défaut"""
+    etag = calculer_etag(["trimestres"], annee_scolaire)
+    non_modifiee = reponse_non_modifiee(request, etag)
+    if non_modifiee:
+        return non_modifiee
+    
+    return reponse_avec_etag(await trimestres_annee(annee_scolaire), etag)
+
+async def trimestres_annee(annee_scolaire: str) -> dict:
+    """Trimestres personnalisés d'une année scolaire, ou trimestres par défaut"""
     
     # Chercher les trimestres personnalisés d'abord
-    cursor = db.trimestres.find({"annee_scolaire": annee_scolaire}).sort("code", 1)
-    trimestres_custom = await cursor.to_list(length=None)
+    trimestres_custom = cache_referentiel.trimestres(annee_scolaire)
     
     if trimestres_custom:
         # Utiliser les trimestres personnalisés
@@ -2340,6 +3911,18 @@ async def list_trimestres(
     return {"trimestres": trimestres_default, "source": "défaut"}
 
 # Routes de gestion des créneaux horaires
+CRENEAUX_PAR_DEFAUT = [
+    {"nom": "1ère heure", "heure_debut": "08:00", "heure_fin": "08:55", "type_creneau": "cours", "ordre": 1},
+    {"nom": "Récréation", "heure_debut": "08:55", "heure_fin": "09:10", "type_creneau": "recreation", "ordre": 2},
+    {"nom": "2ème heure", "heure_debut": "09:10", "heure_fin": "10:05", "type_creneau": "cours", "ordre": 3},
+    {"nom": "3ème heure", "heure_debut": "10:05", "heure_fin": "11:00", "type_creneau": "cours", "ordre": 4},
+    {"nom": "Récréation", "heure_debut": "11:00", "heure_fin": "11:15", "type_creneau": "recreation", "ordre": 5},
+    {"nom": "4ème heure", "heure_debut": "11:15", "heure_fin": "12:10", "type_creneau": "cours", "ordre": 6},
+    {"nom": "Pause déjeuner", "heure_debut": "12:10", "heure_fin": "14:00", "type_creneau": "pause", "ordre": 7},
+    {"nom": "5ème heure", "heure_debut": "14:00", "heure_fin": "14:55", "type_creneau": "cours", "ordre": 8},
+    {"nom": "6ème heure", "heure_debut": "14:55", "heure_fin": "15:50", "type_creneau": "cours", "ordre": 9}
+]
+
 @api_router.post("/creneaux")
 async def create_creneau(creneau_data: CreneauHoraireCreate, current_user: dict = Depends(get_current_user)):
     """Créer un nouveau créneau horaire"""
@@ -2358,36 +3941,31 @@ async def create_creneau(creneau_data: CreneauHoraireCreate, current_user: dict
     }
     
     await db.creneaux_horaires.insert_one(creneau_doc)
+    cache_referentiel.enregistrer("creneaux_horaires", creneau_doc)
+    await incrementer_version("creneaux_horaires")
     
     return {"message": "Créneau créé avec succès", "creneau": creneau_doc}
 
 @api_router.get("/creneaux")
-async def list_creneaux(current_user: dict = Depends(get_current_user)):
+async def list_creneaux(request: Request, current_user: dict = Depends(get_current_user)):
     """Liste des créneaux horaires"""
+    etag = calculer_etag(["creneaux_horaires"])
+    non_modifiee = reponse_non_modifiee(request, etag)
+    if non_modifiee:
+        return non_modifiee
     
     # Chercher les créneaux personnalisés
-    cursor = db.creneaux_horaires.find().sort("ordre", 1)
-    creneaux_custom = await cursor.to_list(length=None)
+    creneaux_custom = cache_referentiel.liste_creneaux()
     
     if creneaux_custom:
         for creneau in creneaux_custom:
             creneau['_id'] = str(creneau['_id'])
-        return {"creneaux": creneaux_custom, "source": "personnalisé"}
+        return reponse_avec_etag({"creneaux": creneaux_custom, "source": "personnalisé"}, etag)
     
     # Créneaux par défaut si aucun n'existe
-    creneaux_default = [
-        {"nom": "1ère heure", "heure_debut": "08:00", "heure_fin": "08:55", "type_creneau": "cours", "ordre": 1},
-        {"nom": "Récréation", "heure_debut": "08:55", "heure_fin": "09:10", "type_creneau": "recreation", "ordre": 2},
-        {"nom": "2ème heure", "heure_debut": "09:10", "heure_fin": "10:05", "type_creneau": "cours", "ordre": 3},
-        {"nom": "3ème heure", "heure_debut": "10:05", "heure_fin": "11:00", "type_creneau": "cours", "ordre": 4},
-        {"nom": "Récréation", "heure_debut": "11:00", "heure_fin": "11:15", "type_creneau": "recreation", "ordre": 5},
-        {"nom": "4ème heure", "heure_debut": "11:15", "heure_fin": "12:10", "type_creneau": "cours", "ordre": 6},
-        {"nom": "Pause déjeuner", "heure_debut": "12:10", "heure_fin": "14:00", "type_creneau": "pause", "ordre": 7},
-        {"nom": "5ème heure", "heure_debut": "14:00", "heure_fin": "14:55", "type_creneau": "cours", "ordre": 8},
-        {"nom": "6ème heure", "heure_debut": "14:55", "heure_fin": "15:50", "type_creneau": "cours", "ordre": 9}
-    ]
+    creneaux_default = [dict(creneau) for creneau in CRENEAUX_PAR_DEFAUT]
     
-    return {"creneaux": creneaux_default, "source": "défaut"}
+    return reponse_avec_etag({"creneaux": creneaux_default, "source": "défaut"}, etag)
 
 # Routes de gestion des emplois du temps
 @api_router.post("/emplois-du-temps")
@@ -2423,17 +4001,23 @@ async def create_emploi_du_temps(emploi_data: EmploiDuTempsCreate, current_user:
     }
     
     await db.emplois_du_temps.insert_one(emploi_doc)
+    await incrementer_version("emplois_du_temps")
     
     return {"message": "Cours ajouté à l'emploi du temps", "cours": emploi_doc}
 
 @api_router.get("/emplois-du-temps")
 async def get_emploi_du_temps(
+    request: Request,
     classe: Optional[str] = None,
     enseignant_id: Optional[str] = None,
     jour_semaine: Optional[int] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Récupérer l'emploi du temps"""
+    etag = calculer_etag(["emplois_du_temps"], classe, enseignant_id, jour_semaine)
+    non_modifiee = reponse_non_modifiee(request, etag)
+    if non_modifiee:
+        return non_modifiee
     
     filter_query = {}
     
@@ -2470,7 +4054,7 @@ async def get_emploi_du_temps(
             # Supprimer le mot de passe de la réponse
             cours['enseignant'].pop('mot_de_passe', None)
     
-    return {"emploi_du_temps": emploi_du_temps}
+    return reponse_avec_etag({"emploi_du_temps": emploi_du_temps}, etag)
 
 @api_router.delete("/emplois-du-temps/{cours_id}")
 async def delete_cours_emploi(cours_id: str, current_user: dict = Depends(get_current_user)):
@@ -2483,8 +4067,308 @@ async def delete_cours_emploi(cours_id: str, current_user: dict = Depends(get_cu
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cours introuvable")
     
+    await incrementer_version("emplois_du_temps")
+    
     return {"message": "Cours supprimé de l'emploi du temps"}
 
+# Génération automatique des emplois du temps
+VOLUME_HORAIRE_PAR_DEFAUT = 2  # Heures/semaine quand aucun volume n'est précisé
+
+CONTRAINTES_EMPLOI_DU_TEMPS = {
+    "repartition": "Au plus une séance par matière et par jour",
+    "salle": "Disponibilité des salles",
+    "volume_horaire": "Volume horaire hebdomadaire"
+}
+
+def _nb_bits(masque: int) -> int:
+    return bin(masque).count("1")
+
+def _iterer_bits(masque: int):
+    while masque:
+        bit_bas = masque & -masque
+        yield bit_bas.bit_length() - 1
+        masque ^= bit_bas
+
+def resoudre_emploi_du_temps(
+    nb_creneaux: int,
+    nb_jours: int,
+    seances: List[dict],
+    salles: List[dict],
+    occupations_classes: Dict[str, int],
+    occupations_enseignants: Dict[str, int],
+    duree_max_secondes: float,
+    graine: Optional[int] = None
+) -> dict:
+    """Place les séances d'une heure sur la grille hebdomadaire.
+    
+    Chaque classe, enseignant et salle est représenté par un masque de bits
+    (bit = jour_index * nb_creneaux + creneau_index). La recherche est gloutonne
+    (variable la plus contrainte d'abord) avec redémarrages aléatoires jusqu'à
+    `duree_max_secondes`. Les contraintes souples sont relâchées par niveaux ;
+    les conflits classe/enseignant ne le sont jamais.
+    """
+    tout = (1 << (nb_creneaux * nb_jours)) - 1
+    masques_jours = [((1 << nb_creneaux) - 1) << (j * nb_creneaux) for j in range(nb_jours)]
+    rng = random.Random(graine)
+    
+    # Salles réservées à une classe testées avant les salles communes
+    ordre_salles = sorted(range(len(salles)), key=lambda k: 0 if salles[k]["classes"] else 1)
+    
+    # (respect de la répartition, salle obligatoire, contrainte relâchée)
+    niveaux = [(True, True, None), (False, True, "repartition")]
+    if salles:
+        niveaux.append((False, False, "salle"))
+    
+    debut = time.monotonic()
+    limite = debut + duree_max_secondes
+    meilleure = None
+    tentatives = 0
+    
+    while True:
+        tentatives += 1
+        classes_occ = dict(occupations_classes)
+        enseignants_occ = dict(occupations_enseignants)
+        salles_occ = [salle["masque"] for salle in salles]
+        jours_matieres: Dict[tuple, int] = {}
+        alea = [rng.random() for _ in seances]
+        placements = []
+        restantes = list(range(len(seances)))
+        
+        def candidats(i: int, repartition: bool, avec_salle: bool) -> int:
+            seance = seances[i]
+            libre = tout & ~classes_occ.get(seance["classe"], 0)
+            if seance["enseignant_id"]:
+                libre &= ~enseignants_occ.get(seance["enseignant_id"], 0)
+            if repartition:
+                libre &= ~jours_matieres.get((seance["classe"], seance["matiere"]), 0)
+            if avec_salle and salles:
+                libre_salles = 0
+                for k in ordre_salles:
+                    if not salles[k]["classes"] or seance["classe"] in salles[k]["classes"]:
+                        libre_salles |= tout & ~salles_occ[k]
+                libre &= libre_salles
+            return libre
+        
+        for repartition, avec_salle, contrainte in niveaux:
+            en_attente, restantes = restantes, []
+            while en_attente:
+                choix, masque_choix, cle_choix = None, 0, None
+                for i in en_attente:
+                    masque = candidats(i, repartition, avec_salle)
+                    cle = (_nb_bits(masque), alea[i])
+                    if cle_choix is None or cle < cle_choix:
+                        choix, masque_choix, cle_choix = i, masque, cle
+                en_attente.remove(choix)
+                if not masque_choix:
+                    restantes.append(choix)
+                    continue
+                
+                seance = seances[choix]
+                occupation_classe = classes_occ.get(seance["classe"], 0)
+                # Jour le moins chargé pour la classe, puis créneau le plus tôt
+                creneau = min(
+                    _iterer_bits(masque_choix),
+                    key=lambda b: (_nb_bits(occupation_classe & masques_jours[b // nb_creneaux]), b % nb_creneaux, rng.random())
+                )
+                bit = 1 << creneau
+                
+                salle_choisie = None
+                for k in ordre_salles:
+                    autorisee = not salles[k]["classes"] or seance["classe"] in salles[k]["classes"]
+                    if autorisee and not salles_occ[k] & bit:
+                        salle_choisie = k
+                        break
+                if salle_choisie is not None:
+                    salles_occ[salle_choisie] |= bit
+                
+                classes_occ[seance["classe"]] = occupation_classe | bit
+                if seance["enseignant_id"]:
+                    enseignants_occ[seance["enseignant_id"]] = enseignants_occ.get(seance["enseignant_id"], 0) | bit
+                cle_matiere = (seance["classe"], seance["matiere"])
+                jours_matieres[cle_matiere] = jours_matieres.get(cle_matiere, 0) | masques_jours[creneau // nb_creneaux]
+                
+                placements.append({
+                    "seance": choix,
+                    "creneau": creneau,
+                    "salle": salles[salle_choisie]["nom"] if salle_choisie is not None else None,
+                    "contrainte_relachee": contrainte if contrainte != "salle" or salle_choisie is None else None
+                })
+            if not restantes:
+                break
+        
+        nb_relachees = sum(1 for p in placements if p["contrainte_relachee"])
+        score = (len(placements), -nb_relachees)
+        if meilleure is None or score > meilleure["score"]:
+            meilleure = {"score": score, "placements": placements, "non_placees": restantes}
+        
+        if (not restantes and nb_relachees == 0) or time.monotonic() >= limite:
+            break
+    
+    return {
+        "placements": meilleure["placements"],
+        "non_placees": meilleure["non_placees"],
+        "tentatives": tentatives,
+        "duree_ms": round((time.monotonic() - debut) * 1000, 1)
+    }
+
+def _creneaux_chevauches(creneaux: List[dict], heure_debut: str, heure_fin: str) -> List[int]:
+    """Indices des créneaux qui recouvrent l'intervalle [heure_debut, heure_fin["""
+    return [
+        i for i, creneau in enumerate(creneaux)
+        if creneau["heure_debut"] < heure_fin and heure_debut < creneau["heure_fin"]
+    ]
+
+@api_router.post("/emplois-du-temps/generer")
+async def generer_emploi_du_temps(generation_data: GenerationEmploiDuTempsRequest, current_user: dict = Depends(get_current_user)):
+    """Générer automatiquement les emplois du temps de plusieurs classes"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    classes = list(dict.fromkeys(generation_data.classes))
+    jours = generation_data.jours
+    
+    # Créneaux de cours (hors pauses et récréations)
+    creneaux = [c for c in cache_referentiel.liste_creneaux() if c["type_creneau"] == "cours"]
+    if not creneaux:
+        creneaux = [c for c in CRENEAUX_PAR_DEFAUT if c["type_creneau"] == "cours"]
+    nb_creneaux = len(creneaux)
+    index_ordres = {creneau["ordre"]: i for i, creneau in enumerate(creneaux)}
+    index_jours = {jour: j for j, jour in enumerate(jours)}
+    
+    # Séances à placer : une par heure hebdomadaire de chaque matière de chaque classe
+    matieres = [m for m in cache_referentiel.liste_matieres() if set(m.get("classes", [])) & set(classes)]
+    seances = []
+    for classe in classes:
+        volumes_classe = generation_data.volumes_horaires_par_classe.get(classe, {})
+        for matiere in matieres:
+            if classe not in matiere.get("classes", []):
+                continue
+            volume = None
+            for volumes in (volumes_classe, generation_data.volumes_horaires):
+                volume = volumes.get(matiere["nom"], volumes.get(matiere["code"]))
+                if volume is not None:
+                    break
+            if volume is None:
+                volume = matiere.get("heures_hebdomadaires") or VOLUME_HORAIRE_PAR_DEFAUT
+            seances.extend({
+                "classe": classe,
+                "matiere": matiere["nom"],
+                "enseignant_id": matiere.get("enseignant_id"),
+                "couleur": matiere.get("couleur", "#3B82F6")
+            } for _ in range(volume))
+    
+    if not seances:
+        raise HTTPException(status_code=400, detail="Aucune matière n'est associée aux classes demandées")
+    
+    if len(seances) > len(classes) * nb_creneaux * len(jours):
+        logger.warning("Génération d'emploi du temps : volume horaire supérieur au nombre de créneaux disponibles")
+    
+    # Cours existants qui restent en place (autres classes des mêmes enseignants, ou classes non remplacées)
+    enseignants = list({s["enseignant_id"] for s in seances if s["enseignant_id"]})
+    cours_existants = await db.emplois_du_temps.find({
+        "$or": [{"classe": {"$in": classes}}, {"enseignant_id": {"$in": enseignants}}]
+    }).to_list(length=None)
+    
+    occupations_classes: Dict[str, int] = {}
+    occupations_enseignants: Dict[str, int] = {}
+    for cours in cours_existants:
+        if generation_data.remplacer_existant and cours["classe"] in classes:
+            continue
+        j = index_jours.get(cours["jour_semaine"])
+        if j is None:
+            continue
+        masque = 0
+        for i in _creneaux_chevauches(creneaux, cours["heure_debut"], cours["heure_fin"]):
+            masque |= 1 << (j * nb_creneaux + i)
+        if cours["classe"] in classes:
+            occupations_classes[cours["classe"]] = occupations_classes.get(cours["classe"], 0) | masque
+        if cours.get("enseignant_id"):
+            occupations_enseignants[cours["enseignant_id"]] = occupations_enseignants.get(cours["enseignant_id"], 0) | masque
+    
+    salles = []
+    for salle in generation_data.salles:
+        masque = 0
+        for indisponibilite in salle.indisponibilites:
+            j = index_jours.get(indisponibilite.jour_semaine)
+            i = index_ordres.get(indisponibilite.ordre)
+            if j is not None and i is not None:
+                masque |= 1 << (j * nb_creneaux + i)
+        salles.append({"nom": salle.nom, "classes": set(salle.classes), "masque": masque})
+    
+    resultat = await asyncio.to_thread(
+        resoudre_emploi_du_temps,
+        nb_creneaux,
+        len(jours),
+        seances,
+        salles,
+        occupations_classes,
+        occupations_enseignants,
+        generation_data.duree_max_secondes
+    )
+    
+    generation_id = str(uuid.uuid4())
+    cours_generes = []
+    for placement in resultat["placements"]:
+        seance = seances[placement["seance"]]
+        creneau = creneaux[placement["creneau"] % nb_creneaux]
+        cours_generes.append({
+            "_id": str(uuid.uuid4()),
+            "classe": seance["classe"],
+            "jour_semaine": jours[placement["creneau"] // nb_creneaux],
+            "heure_debut": creneau["heure_debut"],
+            "heure_fin": creneau["heure_fin"],
+            "matiere": seance["matiere"],
+            "enseignant_id": seance["enseignant_id"],
+            "salle": placement["salle"],
+            "type_cours": "cours",
+            "couleur": seance["couleur"],
+            "generation_id": generation_id,
+            "date_creation": datetime.now(timezone.utc),
+            "date_modification": datetime.now(timezone.utc)
+        })
+    cours_generes.sort(key=lambda c: (c["classe"], c["jour_semaine"], c["heure_debut"]))
+    
+    # Rapport des contraintes relâchées, regroupées par classe et matière
+    relachements: Dict[tuple, int] = {}
+    for placement in resultat["placements"]:
+        if placement["contrainte_relachee"]:
+            seance = seances[placement["seance"]]
+            cle = (placement["contrainte_relachee"], seance["classe"], seance["matiere"])
+            relachements[cle] = relachements.get(cle, 0) + 1
+    for i in resultat["non_placees"]:
+        cle = ("volume_horaire", seances[i]["classe"], seances[i]["matiere"])
+        relachements[cle] = relachements.get(cle, 0) + 1
+    
+    contraintes_relachees = [
+        {
+            "contrainte": contrainte,
+            "description": CONTRAINTES_EMPLOI_DU_TEMPS[contrainte],
+            "classe": classe,
+            "matiere": matiere,
+            "seances_concernees": nombre
+        }
+        for (contrainte, classe, matiere), nombre in sorted(relachements.items())
+    ]
+    
+    if not generation_data.apercu:
+        if generation_data.remplacer_existant:
+            await db.emplois_du_temps.delete_many({"classe": {"$in": classes}})
+        if cours_generes:
+            await db.emplois_du_temps.insert_many(cours_generes)
+        await incrementer_version("emplois_du_temps")
+    
+    return {
+        "message": f"{len(cours_generes)}/{len(seances)} séances placées" + (" (aperçu, rien n'a été enregistré)" if generation_data.apercu else ""),
+        "generation_id": generation_id,
+        "solution_parfaite": not contraintes_relachees,
+        "seances_demandees": len(seances),
+        "seances_placees": len(cours_generes),
+        "tentatives": resultat["tentatives"],
+        "duree_ms": resultat["duree_ms"],
+        "contraintes_relachees": contraintes_relachees,
+        "emploi_du_temps": cours_generes
+    }
+
 # Routes de gestion des ressources pédagogiques
 @api_router.post("/ressources")
 async def create_ressource(ressource_data: RessourceCreate, current_user: dict = Depends(get_current_user)):
@@ -2725,11 +4609,16 @@ async def get_devoir(devoir_id: str, current_user: dict = Depends(get_current_us
 
 # Routes de gestion des rendus de devoirs
 @api_router.post("/devoirs/{devoir_id}/rendre")
-async def rendre_devoir(devoir_id: str, rendu_data: RenduDevoirCreate, current_user: dict = Depends(get_current_user)):
+async def rendre_devoir(
+    devoir_id: str,
+    rendu_data: RenduDevoirCreate,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
     """Rendre un devoir (élève ou parent pour l'élève)"""
     
     # Vérifier que le devoir existe
-    devoir = await db.devoirs.find_one({"_id": devoir_id})
+    devoir = await chargeurs.devoirs.charger(devoir_id)
     if not devoir:
         raise HTTPException(status_code=404, detail="Devoir introuvable")
     
@@ -2772,32 +4661,23 @@ async def rendre_devoir(devoir_id: str, rendu_data: RenduDevoirCreate, current_u
     return {"message": "Devoir rendu avec succès", "rendu": rendu_doc}
 
 @api_router.post("/rendus/{rendu_id}/noter")
-async def noter_rendu(rendu_id: str, notation_data: NotationRenduCreate, current_user: dict = Depends(get_current_user)):
+async def noter_rendu(
+    rendu_id: str,
+    notation_data: NotationRenduCreate,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
     """Noter un rendu de devoir (enseignant)"""
     if current_user["role"] not in ["administrateur", "enseignant"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     # Récupérer le rendu avec le devoir associé
-    pipeline = [
-        {"$match": {"_id": rendu_id}},
-        {"$lookup": {
-            "from": "devoirs",
-            "localField": "devoir_id",
-            "foreignField": "_id",
-            "as": "devoir"
-        }},
-        {"$unwind": "$devoir"}
-    ]
+    rendu = await db.rendus_devoirs.find_one({"_id": rendu_id})
+    devoir = await chargeurs.devoirs.charger(rendu["devoir_id"]) if rendu else None
     
-    cursor = db.rendus_devoirs.aggregate(pipeline)
-    rendus = await cursor.to_list(length=None)
-    
-    if not rendus:
+    if not devoir:
         raise HTTPException(status_code=404, detail="Rendu introuvable")
     
-    rendu = rendus[0]
-    devoir = rendu["devoir"]
-    
     # Vérifier que la note ne dépasse pas le maximum
     if notation_data.note > devoir["note_sur"]:
         raise HTTPException(
@@ -2833,13 +4713,14 @@ async def noter_rendu(rendu_id: str, notation_data: NotationRenduCreate, current
         "annee_scolaire": "2024-2025",
         "commentaire": f"Devoir: {devoir['titre']}",
         "enseignant_id": current_user["_id"],
-        "devoir_id": devoir_id,
+        "devoir_id": rendu["devoir_id"],
         "rendu_id": rendu_id,
         "date_creation": datetime.now(timezone.utc),
         "date_modification": datetime.now(timezone.utc)
     }
     
     await db.notes.insert_one(note_generale)
+    await mettre_a_jour_moyennes([note_generale])
     
     return {"message": "Devoir noté avec succès", "note_sur_20": note_generale["note"]}
 
@@ -2856,16 +4737,32 @@ async def get_mes_devoirs(current_user: dict = Depends(get_current_user)):
 
 # Routes de système de communication
 @api_router.post("/messages")
-async def envoyer_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
+async def envoyer_message(
+    message_data: MessageCreate,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
     """Envoyer un message interne"""
+    return await enregistrer_message(message_data, current_user, chargeurs)
+
+async def enregistrer_message(
+    message_data: MessageCreate,
+    current_user: dict,
+    chargeurs: Chargeurs,
+    message_parent: Optional[dict] = None
+):
+    """Enregistre un message dans son fil (nouveau fil, ou celui du message auquel on répond)"""
     
     # Vérifier que le destinataire existe
-    destinataire = await db.users.find_one({"_id": message_data.destinataire_id})
+    destinataire = await chargeurs.users.charger(message_data.destinataire_id)
     if not destinataire:
         raise HTTPException(status_code=404, detail="Destinataire introuvable")
     
+    maintenant = datetime.now(timezone.utc)
     message_doc = {
         "_id": str(uuid.uuid4()),
+        "thread_id": None,
+        "message_parent_id": message_parent["_id"] if message_parent else None,
         "expediteur_id": current_user["_id"],
         "destinataire_id": message_data.destinataire_id,
         "sujet": message_data.sujet,
@@ -2876,12 +4773,47 @@ async def envoyer_message(message_data: MessageCreate, current_user: dict = Depe
         "matiere_concernee": message_data.matiere_concernee,
         "lu": False,
         "archive": False,
-        "date_envoi": datetime.now(timezone.utc),
+        "date_envoi": maintenant,
         "date_lecture": None,
-        "date_creation": datetime.now(timezone.utc)
+        "date_creation": maintenant
     }
     
+    nb_nouveaux = 1
+    if message_parent is None:
+        message_doc["thread_id"] = message_doc["_id"]
+    elif message_parent.get("thread_id"):
+        message_doc["thread_id"] = message_parent["thread_id"]
+    else:
+        # Message antérieur aux fils : il devient le premier message d'un fil
+        message_doc["thread_id"] = message_parent["_id"]
+        await db.messages.update_one({"_id": message_parent["_id"]}, {"$set": {"thread_id": message_parent["_id"]}})
+        nb_nouveaux = 2
+    
     await db.messages.insert_one(message_doc)
+    await asyncio.gather(
+        db.fils_messages.update_one(
+            {"_id": message_doc["thread_id"]},
+            {
+                "$setOnInsert": {
+                    "sujet": message_parent["sujet"] if message_parent else message_data.sujet,
+                    "participants": sorted({current_user["_id"], message_data.destinataire_id}),
+                    "date_creation": maintenant
+                },
+                "$set": {
+                    "derniere_activite": maintenant,
+                    "dernier_message": {
+                        "_id": message_doc["_id"],
+                        "expediteur_id": current_user["_id"],
+                        "extrait": message_data.contenu[:140],
+                        "date_envoi": maintenant
+                    }
+                },
+                "$inc": {"nb_messages": nb_nouveaux, f"non_lus.{message_data.destinataire_id}": 1}
+            },
+            upsert=True
+        ),
+        incrementer_badges(message_data.destinataire_id, messages=1)
+    )
     
     # Créer une notification automatique
     notification_data = NotificationCreate(
@@ -2890,45 +4822,48 @@ async def envoyer_message(message_data: MessageCreate, current_user: dict = Depe
         message=f"Sujet: {message_data.sujet}",
         type_notification="info",
         canaux=["app", "email"],
-        lien_action=f"/messages/{message_doc['_id']}"
+        lien_action=f"/messages/fils/{message_doc['thread_id']}"
     )
     
     await creer_notification(notification_data, current_user)
     
-    return {"message": "Message envoyé avec succès", "message_id": message_doc["_id"]}
+    return {"message": "Message envoyé avec succès", "message_id": message_doc["_id"], "thread_id": message_doc["thread_id"]}
 
 @api_router.get("/messages")
 async def lister_messages(
     type_boite: str = Query("recus", pattern="^(recus|envoyes|archives)$"),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
 ):
-    """Lister les messages de l'utilisateur"""
+    """Lister les messages de l'utilisateur (messages individuels et diffusions fusionnés)"""
     
     filter_query = {}
+    filtre_diffusions = None
     
     if type_boite == "recus":
         filter_query["destinataire_id"] = current_user["_id"]
         filter_query["archive"] = False
+        filtre_diffusions = filtre_diffusions_recues(current_user, await audiences_utilisateur(current_user))
     elif type_boite == "envoyes":
         filter_query["expediteur_id"] = current_user["_id"]
         filter_query["archive"] = False
+        filtre_diffusions = {"expediteur_id": current_user["_id"]}
     elif type_boite == "archives":
         filter_query["$or"] = [
             {"destinataire_id": current_user["_id"], "archive": True},
             {"expediteur_id": current_user["_id"], "archive": True}
         ]
     
-    # Comptage total
-    total = await db.messages.count_documents(filter_query)
-    
-    # Pagination
+    # Pagination : les deux sources sont triées par date, on en prend assez pour fusionner la page
     skip = (page - 1) * limit
     
-    # Pipeline pour inclure les infos expéditeur/destinataire
+    # Pipeline pour inclure les infos expéditeur/destinataire (sur la page seulement)
     pipeline = [
         {"$match": filter_query},
+        {"$sort": {"date_envoi": -1}},
+        {"$limit": skip + limit},
         {"$lookup": {
             "from": "users",
             "localField": "expediteur_id",
@@ -2942,14 +4877,24 @@ async def lister_messages(
             "as": "destinataire"
         }},
         {"$unwind": {"path": "$expediteur", "preserveNullAndEmptyArrays": True}},
-        {"$unwind": {"path": "$destinataire", "preserveNullAndEmptyArrays": True}},
-        {"$sort": {"date_envoi": -1}},
-        {"$skip": skip},
-        {"$limit": limit}
+        {"$unwind": {"path": "$destinataire", "preserveNullAndEmptyArrays": True}}
     ]
     
-    cursor = db.messages.aggregate(pipeline)
-    messages = await cursor.to_list(length=None)
+    requetes = [db.messages.count_documents(filter_query), db.messages.aggregate(pipeline).to_list(length=None)]
+    if filtre_diffusions is not None:
+        requetes += [
+            db.messages_diffuses.count_documents(filtre_diffusions),
+            db.messages_diffuses.find(filtre_diffusions).sort("date_envoi", -1).limit(skip + limit).to_list(length=None)
+        ]
+    resultats = await asyncio.gather(*requetes)
+    total, messages = resultats[0], resultats[1]
+    
+    if filtre_diffusions is not None:
+        total_diffusions, diffusions = resultats[2], resultats[3]
+        total += total_diffusions
+        await completer_diffusions(diffusions, current_user, chargeurs)
+        messages = sorted(messages + diffusions, key=lambda m: m["date_envoi"], reverse=True)
+    messages = messages[skip:skip + limit]
     
     # Nettoyage des données sensibles
     for message in messages:
@@ -2961,17 +4906,203 @@ async def lister_messages(
             message['destinataire']['_id'] = str(message['destinataire']['_id'])
             message['destinataire'].pop('mot_de_passe', None)
     
+    badges = await badges_utilisateur(current_user)
     return {
         "messages": messages,
         "total": total,
         "page": page,
         "limit": limit,
         "total_pages": (total + limit - 1) // limit,
-        "non_lus": await db.messages.count_documents({
-            "destinataire_id": current_user["_id"],
-            "lu": False,
-            "archive": False
-        })
+        "non_lus": badges["messages_non_lus"] + badges["diffusions_non_lues"]
+    }
+
+# Diffusions (classe, rôle, toute l'école) : un seul document, fusionné à la lecture
+async def audiences_utilisateur(user: dict) -> List[str]:
+    """Clés d'audience dont relève l'utilisateur : 'tous', 'role:<role>', 'classe:<classe>'"""
+    audiences = ["tous", f"role:{user['role']}"]
+    if user["role"] == "parent":
+        liaisons = await db.parent_child_links.find(
+            {"parent_id": user["_id"], "actif": True}, {"eleve_id": 1}
+        ).to_list(length=None)
+        classes = await db.eleves.distinct("classe", {"_id": {"$in": [l["eleve_id"] for l in liaisons]}})
+    elif user["role"] == "eleve":
+        eleve = await db.eleves.find_one({"_id": user["_id"]}, {"classe": 1})
+        classes = [eleve["classe"]] if eleve else ([user["classe"]] if user.get("classe") else [])
+    elif user["role"] == "enseignant":
+        classes = await db.emplois_du_temps.distinct("classe", {"enseignant_id": user["_id"]})
+    else:
+        classes = []
+    return audiences + [f"classe:{classe}" for classe in sorted(set(classes))]
+
+def filtre_diffusions_recues(user: dict, audiences: List[str]) -> dict:
+    filtre = {"audience_cle": {"$in": audiences}}
+    # Les diffusions antérieures à l'inscription ne comptent pas comme non lues
+    if isinstance(user.get("date_creation"), datetime):
+        filtre["date_envoi"] = {"$gte": user["date_creation"]}
+    return filtre
+
+async def completer_diffusions(diffusions: List[dict], user: dict, chargeurs: Chargeurs):
+    """Ajoute l'état de lecture de l'utilisateur et l'expéditeur à une page de diffusions"""
+    if not diffusions:
+        return
+    lectures, expediteurs = await asyncio.gather(
+        db.lectures_diffusions.find(
+            {"_id": {"$in": [f"{d['_id']}:{user['_id']}" for d in diffusions]}}, {"_id": 1}
+        ).to_list(length=None),
+        chargeurs.users.charger_plusieurs([d["expediteur_id"] for d in diffusions])
+    )
+    lues = {l["_id"] for l in lectures}
+    for diffusion, expediteur in zip(diffusions, expediteurs):
+        diffusion["diffusion"] = True
+        diffusion["lu"] = f"{diffusion['_id']}:{user['_id']}" in lues
+        diffusion["expediteur"] = {
+            cle: expediteur.get(cle) for cle in ("_id", "nom", "prenoms", "role")
+        } if expediteur else None
+
+async def badges_utilisateur(user: dict, audiences: Optional[List[str]] = None) -> dict:
+    """Compteurs maintenus, plus les diffusions non lues (deux décomptes indexés)"""
+    audiences = audiences if audiences is not None else await audiences_utilisateur(user)
+    filtre = filtre_diffusions_recues(user, audiences)
+    badges, total_diffusions, diffusions_lues = await asyncio.gather(
+        lire_badges(user["_id"]),
+        db.messages_diffuses.count_documents(filtre),
+        db.lectures_diffusions.count_documents({"utilisateur_id": user["_id"], **filtre})
+    )
+    return {**badges, "diffusions_non_lues": max(total_diffusions - diffusions_lues, 0)}
+
+@api_router.post("/messages/diffusions")
+async def envoyer_diffusion(diffusion_data: DiffusionCreate, current_user: dict = Depends(get_current_user)):
+    """Diffuser un message à une classe, un rôle ou toute l'école (une seule écriture)"""
+    if current_user["role"] not in ["administrateur", "enseignant"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    if current_user["role"] == "enseignant" and diffusion_data.audience != "classe":
+        raise HTTPException(status_code=403, detail="Les enseignants ne peuvent diffuser qu'à une classe")
+    if current_user["role"] == "enseignant" and diffusion_data.audience_cle() not in await audiences_utilisateur(current_user):
+        raise HTTPException(status_code=403, detail=f"Vous n'enseignez pas en classe {diffusion_data.classe}")
+    
+    maintenant = datetime.now(timezone.utc)
+    diffusion_doc = {
+        "_id": str(uuid.uuid4()),
+        "expediteur_id": current_user["_id"],
+        "audience_cle": diffusion_data.audience_cle(),
+        "sujet": diffusion_data.sujet,
+        "contenu": diffusion_data.contenu,
+        "type_message": "groupe" if diffusion_data.audience == "classe" else "annonce",
+        "priorite": diffusion_data.priorite,
+        "classe_destinataire": diffusion_data.classe,
+        "date_envoi": maintenant,
+        "date_creation": maintenant
+    }
+    await db.messages_diffuses.insert_one(diffusion_doc)
+    
+    return {"message": "Message diffusé avec succès", "diffusion_id": diffusion_doc["_id"], "audience": diffusion_doc["audience_cle"]}
+
+@api_router.get("/messages/diffusions/{diffusion_id}")
+async def consulter_diffusion(
+    diffusion_id: str,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
+    """Consulter une diffusion et la marquer comme lue"""
+    diffusion = await db.messages_diffuses.find_one({"_id": diffusion_id})
+    if not diffusion:
+        raise HTTPException(status_code=404, detail="Message introuvable")
+    
+    if diffusion["expediteur_id"] != current_user["_id"]:
+        if diffusion["audience_cle"] not in await audiences_utilisateur(current_user):
+            raise HTTPException(status_code=403, detail="Accès refusé")
+        await db.lectures_diffusions.update_one(
+            {"_id": f"{diffusion_id}:{current_user['_id']}"},
+            {"$setOnInsert": {
+                "utilisateur_id": current_user["_id"],
+                "diffusion_id": diffusion_id,
+                "audience_cle": diffusion["audience_cle"],
+                "date_envoi": diffusion["date_envoi"],
+                "date_lecture": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    
+    await completer_diffusions([diffusion], current_user, chargeurs)
+    diffusion["lu"] = True
+    return diffusion
+
+@api_router.get("/messages/fils")
+async def lister_fils_messages(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
+    """Boîte de réception par conversation (résumés de fils, du plus récent au plus ancien)"""
+    filtre = {"participants": current_user["_id"]}
+    total, fils = await asyncio.gather(
+        db.fils_messages.count_documents(filtre),
+        db.fils_messages.find(filtre).sort("derniere_activite", -1).skip((page - 1) * limit).limit(limit).to_list(length=None)
+    )
+    
+    # Noms des correspondants en une seule requête $in
+    correspondants = [next((p for p in f["participants"] if p != current_user["_id"]), current_user["_id"]) for f in fils]
+    utilisateurs = await chargeurs.users.charger_plusieurs(correspondants)
+    
+    for f, correspondant in zip(fils, utilisateurs):
+        f["non_lus"] = f.get("non_lus", {}).get(current_user["_id"], 0)
+        f["correspondant"] = {
+            "_id": correspondant["_id"],
+            "nom": correspondant["nom"],
+            "prenoms": correspondant["prenoms"],
+            "role": correspondant["role"]
+        } if correspondant else None
+    
+    return {
+        "fils": fils,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "total_pages": (total + limit - 1) // limit
+    }
+
+@api_router.get("/messages/fils/{thread_id}")
+async def consulter_fil_messages(
+    thread_id: str,
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    """Messages d'un fil, du plus récent au plus ancien ; les messages reçus sont marqués comme lus"""
+    fil = await db.fils_messages.find_one({"_id": thread_id})
+    if not fil:
+        raise HTTPException(status_code=404, detail="Conversation introuvable")
+    if current_user["_id"] not in fil["participants"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    messages = await db.messages.find({"thread_id": thread_id}).sort("date_envoi", -1).skip(
+        (page - 1) * limit
+    ).limit(limit).to_list(length=None)
+    
+    if fil.get("non_lus", {}).get(current_user["_id"]):
+        lecture = {"$set": {"lu": True, "date_lecture": datetime.now(timezone.utc)}}
+        filtre_non_lus = {"thread_id": thread_id, "destinataire_id": current_user["_id"], "lu": False}
+        # Le compteur ne compte pas les messages archivés (comme compter_non_lus) : marqués à part
+        lus, _ = await asyncio.gather(
+            db.messages.update_many({**filtre_non_lus, "archive": False}, lecture),
+            db.messages.update_many({**filtre_non_lus, "archive": {"$ne": False}}, lecture)
+        )
+        await db.fils_messages.update_one({"_id": thread_id}, {"$set": {f"non_lus.{current_user['_id']}": 0}})
+        if lus.modified_count:
+            await incrementer_badges(current_user["_id"], messages=-lus.modified_count)
+        for message in messages:
+            if message["destinataire_id"] == current_user["_id"]:
+                message["lu"] = True
+    
+    fil["non_lus"] = 0
+    return {
+        "fil": fil,
+        "messages": messages,
+        "total": fil.get("nb_messages", len(messages)),
+        "page": page,
+        "limit": limit,
+        "total_pages": (fil.get("nb_messages", len(messages)) + limit - 1) // limit
     }
 
 @api_router.get("/messages/{message_id}")
@@ -3011,8 +5142,8 @@ async def consulter_message(message_id: str, current_user: dict = Depends(get_cu
     
     # Marquer comme lu si c'est le destinataire
     if message["destinataire_id"] == current_user["_id"] and not message["lu"]:
-        await db.messages.update_one(
-            {"_id": message_id},
+        resultat = await db.messages.update_one(
+            {"_id": message_id, "lu": False},
             {
                 "$set": {
                     "lu": True,
@@ -3020,6 +5151,14 @@ async def consulter_message(message_id: str, current_user: dict = Depends(get_cu
                 }
             }
         )
+        # Seul l'appel qui a effectivement changé l'état décrémente le compteur
+        if resultat.modified_count and not message.get("archive"):
+            await incrementer_badges(current_user["_id"], messages=-1)
+        if resultat.modified_count and message.get("thread_id"):
+            await db.fils_messages.update_one(
+                {"_id": message["thread_id"]},
+                {"$inc": {f"non_lus.{current_user['_id']}": -1}}
+            )
         message["lu"] = True
     
     # Nettoyage
@@ -3034,14 +5173,22 @@ async def consulter_message(message_id: str, current_user: dict = Depends(get_cu
     return message
 
 @api_router.post("/messages/{message_id}/repondre")
-async def repondre_message(message_id: str, reponse_data: ReponseMessageCreate, current_user: dict = Depends(get_current_user)):
+async def repondre_message(
+    message_id: str,
+    reponse_data: ReponseMessageCreate,
+    current_user: dict = Depends(get_current_user),
+    chargeurs: Chargeurs = Depends(get_chargeurs)
+):
     """Répondre à un message"""
     
     # Récupérer le message original
-    message_parent = await db.messages.find_one({"_id": message_id})
+    message_parent = await chargeurs.messages.charger(message_id)
     if not message_parent:
         raise HTTPException(status_code=404, detail="Message introuvable")
     
+    if current_user["_id"] not in (message_parent["expediteur_id"], message_parent["destinataire_id"]):
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
     # Déterminer le destinataire (l'autre personne de la conversation)
     if message_parent["expediteur_id"] == current_user["_id"]:
         destinataire_id = message_parent["destinataire_id"]
@@ -3057,7 +5204,7 @@ async def repondre_message(message_id: str, reponse_data: ReponseMessageCreate,
         priorite=message_parent["priorite"]
     )
     
-    return await envoyer_message(reponse_message, current_user)
+    return await enregistrer_message(reponse_message, current_user, chargeurs, message_parent=message_parent)
 
 # Routes de gestion des notifications
 async def creer_notification(notification_data: NotificationCreate, current_user: dict = None):
@@ -3079,6 +5226,7 @@ async def creer_notification(notification_data: NotificationCreate, current_user
     }
     
     await db.notifications.insert_one(notification_doc)
+    await incrementer_badges(notification_data.destinataire_id, notifications=1)
     
     # Simuler l'envoi selon les canaux
     for canal in notification_data.canaux:
@@ -3135,73 +5283,348 @@ async def lister_notifications(
         "page": page,
         "limit": limit,
         "total_pages": (total + limit - 1) // limit,
-        "non_lues": await db.notifications.count_documents({
-            "destinataire_id": current_user["_id"],
-            "lue": False
-        })
+        "non_lues": (await lire_badges(current_user["_id"]))["notifications_non_lues"]
     }
 
 @api_router.put("/notifications/{notification_id}/marquer-lue")
 async def marquer_notification_lue(notification_id: str, current_user: dict = Depends(get_current_user)):
     """Marquer une notification comme lue"""
     
-    result = await db.notifications.update_one(
+    avant = await db.notifications.find_one_and_update(
         {"_id": notification_id, "destinataire_id": current_user["_id"]},
         {
             "$set": {
                 "lue": True,
                 "date_lecture": datetime.now(timezone.utc)
             }
-        }
+        },
+        projection={"lue": 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if avant is None:
         raise HTTPException(status_code=404, detail="Notification introuvable")
     
+    if not avant.get("lue"):
+        await incrementer_badges(current_user["_id"], notifications=-1)
+    
     return {"message": "Notification marquée comme lue"}
 
-# Routes améliorées pour Finance & Payments
-@api_router.post("/factures/{facture_id}/generer-recu")
-async def generer_recu_paiement(facture_id: str, current_user: dict = Depends(get_current_user)):
-    """Générer un reçu de paiement pour une facture"""
+# Compteurs de badges (messages et notifications non lus) maintenus à l'écriture
+INTERVALLE_RECONCILIATION_BADGES = int(os.environ.get('BADGES_RECONCILIATION_SECONDS', '3600'))
+
+async def incrementer_badges(utilisateur_id: str, messages: int = 0, notifications: int = 0):
+    """À appeler après l'écriture source : un compteur absent est initialisé par un décompte exact
+    (qui inclut déjà cette écriture) plutôt que créé à partir de ce seul incrément"""
+    resultat = await db.badges_utilisateurs.update_one(
+        {"_id": utilisateur_id},
+        {
+            "$inc": {"messages_non_lus": messages, "notifications_non_lues": notifications},
+            "$set": {"date_modification": datetime.now(timezone.utc)}
+        }
+    )
+    if not resultat.matched_count:
+        await initialiser_badges(utilisateur_id)
+
+async def compter_non_lus(utilisateur_ids: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Décompte exact depuis les collections sources, pour tous les utilisateurs ou certains"""
+    filtre = {"destinataire_id": {"$in": utilisateur_ids}} if utilisateur_ids is not None else {}
+    messages, notifications = await asyncio.gather(
+        db.messages.aggregate([
+            {"$match": {**filtre, "lu": False, "archive": False}},
+            {"$group": {"_id": "$destinataire_id", "total": {"$sum": 1}}}
+        ]).to_list(length=None),
+        db.notifications.aggregate([
+            {"$match": {**filtre, "lue": False}},
+            {"$group": {"_id": "$destinataire_id", "total": {"$sum": 1}}}
+        ]).to_list(length=None)
+    )
+    comptes: Dict[str, dict] = {}
+    for m in messages:
+        comptes.setdefault(m["_id"], {"messages_non_lus": 0, "notifications_non_lues": 0})["messages_non_lus"] = m["total"]
+    for n in notifications:
+        comptes.setdefault(n["_id"], {"messages_non_lus": 0, "notifications_non_lues": 0})["notifications_non_lues"] = n["total"]
+    return comptes
+
+async def reconcilier_badges() -> int:
+    """Corrige la dérive des compteurs (écriture interrompue, modification hors application).
     
-    # Récupérer la facture avec l'élève
-    pipeline = [
-        {"$match": {"_id": facture_id}},
-        {"$lookup": {
-            "from": "eleves",
-            "localField": "eleve_id",
-            "foreignField": "_id",
-            "as": "eleve"
-        }},
-        {"$lookup": {
-            "from": "paiements",
-            "localField": "_id",
-            "foreignField": "facture_id",
-            "as": "paiements"
-        }},
-        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}}
+    Une incrémentation concurrente peut être écrasée ; elle sera corrigée au passage suivant.
+    """
+    comptes = await compter_non_lus()
+    maintenant = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"_id": utilisateur_id}, {"$set": {**compte, "date_modification": maintenant}}, upsert=True)
+        for utilisateur_id, compte in comptes.items()
     ]
+    corriges = 0
+    if operations:
+        corriges += (await db.badges_utilisateurs.bulk_write(operations, ordered=False)).modified_count
+    remis_a_zero = await db.badges_utilisateurs.update_many(
+        {
+            "_id": {"$nin": list(comptes)},
+            "$or": [{"messages_non_lus": {"$ne": 0}}, {"notifications_non_lues": {"$ne": 0}}]
+        },
+        {"$set": {"messages_non_lus": 0, "notifications_non_lues": 0, "date_modification": maintenant}}
+    )
+    return corriges + remis_a_zero.modified_count
+
+async def reconcilier_badges_periodiquement():
+    """Tâche de fond : un seul worker à la fois réconcilie les compteurs (verrou distribué) ;
+    le premier passage, au démarrage, corrige les compteurs créés avant leur initialisation exacte"""
+    while True:
+        try:
+            if await acquerir_verrou("reconciliation_badges", INTERVALLE_RECONCILIATION_BADGES):
+                corriges = await reconcilier_badges()
+                if corriges:
+                    logger.info(f"Réconciliation des badges : {corriges} compteur(s) corrigé(s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur réconciliation des badges: {str(e)}")
+        await asyncio.sleep(INTERVALLE_RECONCILIATION_BADGES)
+
+async def initialiser_badges(utilisateur_id: str) -> dict:
+    """Premier accès ou premier incrément : compteurs initialisés depuis les collections sources"""
+    badges = (await compter_non_lus([utilisateur_id])).get(
+        utilisateur_id, {"messages_non_lus": 0, "notifications_non_lues": 0}
+    )
+    # $setOnInsert : une initialisation concurrente (décompte tout aussi exact) n'est pas écrasée
+    await db.badges_utilisateurs.update_one(
+        {"_id": utilisateur_id},
+        {"$setOnInsert": {**badges, "date_modification": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return badges
+
+async def lire_badges(utilisateur_id: str) -> dict:
+    badges = await db.badges_utilisateurs.find_one({"_id": utilisateur_id})
+    if badges is None:
+        badges = await initialiser_badges(utilisateur_id)
+    return {
+        "messages_non_lus": max(badges.get("messages_non_lus", 0), 0),
+        "notifications_non_lues": max(badges.get("notifications_non_lues", 0), 0)
+    }
+
+@api_router.get("/me/badges")
+async def get_mes_badges(current_user: dict = Depends(get_current_user)):
+    """Nombre de messages, diffusions et notifications non lus"""
+    return await badges_utilisateur(current_user)
+
+# Canal temps réel : notifications et messages poussés par SSE ou WebSocket
+INTERVALLE_BATTEMENT_FLUX = float(os.environ.get('REALTIME_HEARTBEAT_SECONDS', '15'))  # Secondes entre deux battements de cœur
+TAILLE_FILE_CONNEXION = 100
+
+class DiffuseurTempsReel:
+    """Répartit dans le processus les événements du flux Mongo vers les connexions ouvertes"""
+    def __init__(self):
+        self.connexions: Dict[str, set] = {}  # Utilisateur -> files de ses connexions
+        self.audiences: Dict[str, set] = {}  # Clé d'audience des diffusions -> files
+        self.audiences_par_file: Dict[asyncio.Queue, List[str]] = {}
+    
+    def abonner(self, utilisateur_id: str, audiences: List[str] = ()) -> asyncio.Queue:
+        file = asyncio.Queue(maxsize=TAILLE_FILE_CONNEXION)
+        self.audiences_par_file[file] = list(audiences)
+        self.connexions.setdefault(utilisateur_id, set()).add(file)
+        for cle in audiences:
+            self.audiences.setdefault(cle, set()).add(file)
+        return file
+    
+    def desabonner(self, utilisateur_id: str, file: asyncio.Queue):
+        audiences = self.audiences_par_file.pop(file, [])
+        for index, cle in [(self.connexions, utilisateur_id)] + [(self.audiences, c) for c in audiences]:
+            files = index.get(cle)
+            if files is not None:
+                files.discard(file)
+                if not files:
+                    del index[cle]
+    
+    def publier(self, utilisateur_id: str, evenement: dict):
+        self._envoyer(self.connexions.get(utilisateur_id, ()), evenement)
+    
+    def publier_audience(self, audience_cle: str, evenement: dict):
+        self._envoyer(self.audiences.get(audience_cle, ()), evenement)
+    
+    def _envoyer(self, files, evenement: dict):
+        for file in files:
+            try:
+                file.put_nowait(evenement)
+            except asyncio.QueueFull:
+                # Client trop lent : on vide sa file et il se resynchronise par l'API
+                while not file.empty():
+                    file.get_nowait()
+                file.put_nowait({"type": "resynchroniser"})
+
+diffuseur_temps_reel = DiffuseurTempsReel()
+
+def evenement_temps_reel(modification: dict) -> Optional[tuple]:
+    """Traduit une modification Mongo en (destinataire ou audience, événement) pour les clients"""
+    collection = modification["ns"]["coll"]
+    document = modification.get("fullDocument")
+    if not document:
+        return None
     
-    cursor = db.factures.aggregate(pipeline)
-    factures = await cursor.to_list(length=None)
-    
-    if not factures:
+    if modification["operationType"] == "insert":
+        if collection == "messages_diffuses":
+            return document["audience_cle"], {
+                "type": "diffusion",
+                "diffusion": {
+                    cle: document.get(cle)
+                    for cle in ("_id", "expediteur_id", "sujet", "type_message", "priorite", "date_envoi")
+                }
+            }
+        if collection == "notifications":
+            return document["destinataire_id"], {
+                "type": "notification",
+                "notification": {
+                    cle: document.get(cle)
+                    for cle in ("_id", "titre", "message", "type_notification", "lien_action", "date_creation")
+                }
+            }
+        if collection == "messages":
+            return document["destinataire_id"], {
+                "type": "message",
+                "message": {
+                    cle: document.get(cle)
+                    for cle in ("_id", "expediteur_id", "sujet", "type_message", "priorite", "date_envoi")
+                }
+            }
+    else:
+        champs = modification.get("updateDescription", {}).get("updatedFields", {})
+        if collection == "notifications" and "lue" in champs:
+            return document["destinataire_id"], {"type": "notification_lue", "notification_id": document["_id"]}
+        if collection == "messages" and "lu" in champs:
+            return document["destinataire_id"], {"type": "message_lu", "message_id": document["_id"]}
+    return None
+
+async def surveiller_notifications_messages():
+    """Tâche de fond : un seul flux de modifications par worker, réparti aux connexions locales"""
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": ["notifications", "messages", "messages_diffuses"]},
+        "operationType": {"$in": ["insert", "update"]}
+    }}]
+    jeton_reprise = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=jeton_reprise) as flux:
+                async for modification in flux:
+                    jeton_reprise = flux.resume_token
+                    resultat = evenement_temps_reel(modification)
+                    if resultat and modification["ns"]["coll"] == "messages_diffuses":
+                        diffuseur_temps_reel.publier_audience(*resultat)
+                    elif resultat:
+                        diffuseur_temps_reel.publier(*resultat)
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code == 40573:
+                # Mongo autonome : les flux de modifications exigent un replica set
+                logger.warning("Canal temps réel désactivé : MongoDB n'est pas en replica set")
+                return
+            logger.error(f"Flux temps réel interrompu: {str(e)}")
+            jeton_reprise = None
+            await asyncio.sleep(5)
+        except Exception as e:
+            logger.error(f"Flux temps réel interrompu: {str(e)}")
+            await asyncio.sleep(5)
+
+async def etat_initial_temps_reel(user: dict, audiences: List[str]) -> dict:
+    """Compteurs envoyés à l'ouverture de la connexion ; ensuite tout arrive par le flux"""
+    return {"type": "etat", **await badges_utilisateur(user, audiences)}
+
+def serialiser_evenement(evenement: dict) -> str:
+    return json.dumps(jsonable_encoder(evenement), ensure_ascii=False)
+
+@api_router.get("/notifications/flux")
+async def flux_notifications(request: Request, token: Optional[str] = None):
+    """Flux SSE des notifications et messages de l'utilisateur (jeton en paramètre pour EventSource)"""
+    entete = request.headers.get("authorization", "")
+    current_user = await utilisateur_depuis_jeton(token or entete.removeprefix("Bearer ").strip())
+    utilisateur_id = current_user["_id"]
+    audiences = await audiences_utilisateur(current_user)
+    
+    async def evenements():
+        file = diffuseur_temps_reel.abonner(utilisateur_id, audiences)
+        try:
+            etat = await etat_initial_temps_reel(current_user, audiences)
+            yield f"event: etat\ndata: {serialiser_evenement(etat)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    evenement = await asyncio.wait_for(file.get(), timeout=INTERVALLE_BATTEMENT_FLUX)
+                except asyncio.TimeoutError:
+                    yield ": battement\n\n"
+                    continue
+                yield f"event: {evenement['type']}\ndata: {serialiser_evenement(evenement)}\n\n"
+        finally:
+            diffuseur_temps_reel.desabonner(utilisateur_id, file)
+    
+    return StreamingResponse(
+        evenements(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.websocket("/notifications/ws")
+async def websocket_notifications(websocket: WebSocket, token: Optional[str] = None):
+    """Repli WebSocket du flux SSE, pour les clients ou proxys qui ne le supportent pas"""
+    try:
+        current_user = await utilisateur_depuis_jeton(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    utilisateur_id = current_user["_id"]
+    audiences = await audiences_utilisateur(current_user)
+    file = diffuseur_temps_reel.abonner(utilisateur_id, audiences)
+    reception = asyncio.create_task(websocket.receive_text())
+    # Lecture de la file gardée d'un tour à l'autre : l'annuler après un battement pourrait
+    # perdre un événement déjà retiré de la file
+    attente = asyncio.create_task(file.get())
+    try:
+        await websocket.send_text(serialiser_evenement(await etat_initial_temps_reel(current_user, audiences)))
+        while True:
+            termines, _ = await asyncio.wait(
+                {attente, reception}, timeout=INTERVALLE_BATTEMENT_FLUX, return_when=asyncio.FIRST_COMPLETED
+            )
+            if attente in termines:
+                await websocket.send_text(serialiser_evenement(attente.result()))
+                attente = asyncio.create_task(file.get())
+            if reception in termines:
+                reception.result()  # Lève WebSocketDisconnect à la fermeture
+                reception = asyncio.create_task(websocket.receive_text())
+            elif not termines:
+                await websocket.send_text(serialiser_evenement({"type": "battement"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reception.cancel()
+        attente.cancel()
+        diffuseur_temps_reel.desabonner(utilisateur_id, file)
+
+# Routes améliorées pour Finance & Payments
+async def charger_recu(facture_id: str) -> tuple:
+    """Données d'un reçu et leur empreinte (facture, élève et paiements réussis)"""
+    # Reçus des années passées : facture et paiements archivés ensemble
+    facture = await trouver_avec_archives("factures", {"_id": facture_id})
+    if not facture:
         raise HTTPException(status_code=404, detail="Facture introuvable")
     
-    facture = factures[0]
-    
-    # Filtrer seulement les paiements réussis
-    paiements_reussis = [p for p in facture.get('paiements', []) if p.get('statut') == 'reussi']
-    
+    eleve, paiements_reussis = await asyncio.gather(
+        db.eleves.find_one({"_id": facture["eleve_id"]}),
+        db.paiements.aggregate(
+            etapes_avec_archives("paiements", {"facture_id": facture_id, "statut": "reussi"}, annees_basculees())
+            + [{"$sort": {"date_completion": 1}}]
+        ).to_list(length=None)
+    )
     if not paiements_reussis:
         raise HTTPException(status_code=400, detail="Aucun paiement réussi pour cette facture")
     
-    # Générer le reçu
-    numero_recu = f"RECU_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6].upper()}"
-    
+    return construire_recu(facture, eleve, paiements_reussis)
+
+def construire_recu(facture: dict, eleve: Optional[dict], paiements_reussis: List[dict]) -> tuple:
+    eleve = eleve or {}
     recu_data = {
-        "numero_recu": numero_recu,
         "facture": {
             "numero": facture["numero_facture"],
             "titre": facture["titre"],
@@ -3209,10 +5632,10 @@ async def generer_recu_paiement(facture_id: str, current_user: dict = Depends(ge
             "montant_paye": facture["montant_paye"]
         },
         "eleve": {
-            "nom": facture["eleve"]["nom"],
-            "prenoms": facture["eleve"]["prenoms"],
-            "classe": facture["eleve"]["classe"],
-            "matricule": facture["eleve"]["matricule"]
+            "nom": eleve.get("nom", ""),
+            "prenoms": eleve.get("prenoms", ""),
+            "classe": eleve.get("classe", ""),
+            "matricule": eleve.get("matricule", "")
         },
         "paiements": [
             {
@@ -3224,22 +5647,241 @@ async def generer_recu_paiement(facture_id: str, current_user: dict = Depends(ge
             for p in paiements_reussis
         ],
         "total_paye": sum(p["montant"] for p in paiements_reussis),
-        "date_generation": datetime.now(timezone.utc).isoformat(),
+        "montant_restant": facture["montant_restant"],
         "statut_facture": facture["statut"]
     }
+    empreinte = empreinte_document(VERSION_GABARIT_RECU, recu_data)
+    # Numéro stable : un même état de la facture donne toujours le même reçu
+    recu_data["numero_recu"] = f"RECU_{facture['numero_facture']}_{empreinte[:6].upper()}"
+    recu_data["date_generation"] = datetime.now(timezone.utc).isoformat()
+    return facture, recu_data, empreinte
+
+@api_router.post("/factures/{facture_id}/generer-recu")
+async def generer_recu_paiement(facture_id: str, current_user: dict = Depends(get_current_user)):
+    """Générer un reçu de paiement pour une facture"""
+    _, recu_data, _ = await charger_recu(facture_id)
     
     return {
         "message": "Reçu généré avec succès",
         "recu": recu_data
     }
 
+# Rendu PDF côté serveur : pool de processus et cache disque adressé par contenu
+NOMBRE_PROCESSUS_PDF = int(os.environ.get('PDF_WORKERS', '2'))
+DOSSIER_CACHE_PDF = Path(os.environ.get('PDF_CACHE_DIR', str(ROOT_DIR / 'cache')))
+VERSION_GABARIT_RECU = 1  # À incrémenter quand la mise en page du reçu change
+
+executeur_pdf: Optional[ProcessPoolExecutor] = None
+
+def obtenir_executeur_pdf() -> ProcessPoolExecutor:
+    """Pool créé à la première utilisation, propre à chaque worker"""
+    global executeur_pdf
+    if executeur_pdf is None:
+        executeur_pdf = ProcessPoolExecutor(max_workers=NOMBRE_PROCESSUS_PDF)
+    return executeur_pdf
+
+def empreinte_document(*contenu) -> str:
+    return hashlib.sha256(json.dumps(contenu, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def ecrire_fichier_atomique(chemin: Path, contenu: bytes):
+    """Écriture via un fichier temporaire renommé : jamais de PDF tronqué dans le cache"""
+    chemin.parent.mkdir(parents=True, exist_ok=True)
+    temporaire = chemin.with_name(f".{chemin.name}.{uuid.uuid4().hex}")
+    temporaire.write_bytes(contenu)
+    os.replace(temporaire, chemin)
+
+def lire_fichier_cache(chemin: Path) -> Optional[bytes]:
+    try:
+        return chemin.read_bytes()
+    except FileNotFoundError:
+        return None
+
+async def rendre_pdf_en_cache(categorie: str, fonction_rendu, donnees: dict, empreinte: str) -> bytes:
+    """PDF depuis le cache disque, sinon rendu dans le pool de processus puis mis en cache"""
+    chemin = DOSSIER_CACHE_PDF / categorie / f"{empreinte}.pdf"
+    contenu = await asyncio.to_thread(lire_fichier_cache, chemin)
+    if contenu is None:
+        contenu = await asyncio.get_running_loop().run_in_executor(obtenir_executeur_pdf(), fonction_rendu, donnees)
+        await asyncio.to_thread(ecrire_fichier_atomique, chemin, contenu)
+    return contenu
+
+class FluxZip(io.RawIOBase):
+    """Tampon d'écriture non positionnable : zipfile y écrit des descripteurs de données,
+    ce qui permet d'envoyer l'archive au fil de l'eau"""
+    def __init__(self):
+        self.tampon = bytearray()
+    
+    def writable(self):
+        return True
+    
+    def write(self, donnees):
+        self.tampon += donnees
+        return len(donnees)
+    
+    def vider(self) -> bytes:
+        donnees = bytes(self.tampon)
+        self.tampon.clear()
+        return donnees
+
+async def archive_zip_en_flux(fichiers):
+    """Générateur asynchrone d'octets ZIP à partir de couples (nom, contenu) asynchrones"""
+    flux = FluxZip()
+    with zipfile.ZipFile(flux, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for nom, contenu in fichiers:
+            archive.writestr(nom, contenu)
+            yield flux.vider()
+    yield flux.vider()
+
+async def rendus_au_fil_de_l_eau(rendus, en_vol: Optional[int] = None):
+    """Exécute les coroutines de rendu avec au plus `en_vol` en cours et les restitue
+    dans l'ordre où elles se terminent : la mémoire reste bornée quelle que soit la taille du lot"""
+    en_vol = en_vol or 2 * NOMBRE_PROCESSUS_PDF
+    rendus = iter(rendus)
+    en_cours = set()
+    try:
+        while True:
+            while len(en_cours) < en_vol:
+                rendu = next(rendus, None)
+                if rendu is None:
+                    break
+                en_cours.add(asyncio.ensure_future(rendu))
+            if not en_cours:
+                return
+            termines, en_cours = await asyncio.wait(en_cours, return_when=asyncio.FIRST_COMPLETED)
+            for tache in termines:
+                yield tache.result()
+    finally:
+        for tache in en_cours:
+            tache.cancel()
+
+def nom_fichier_sur(texte: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", texte).strip("_")
+
+async def verifier_acces_facture(current_user: dict, eleve_id: str):
+    """Administrateurs, ou parents liés à l'élève facturé"""
+    if current_user["role"] == "administrateur":
+        return
+    if current_user["role"] == "parent" and await db.parent_child_links.find_one(
+        {"parent_id": current_user["_id"], "eleve_id": eleve_id, "actif": True}, {"_id": 1}
+    ):
+        return
+    raise HTTPException(status_code=403, detail="Accès refusé")
+
+@api_router.get("/factures/{facture_id}/recu.pdf")
+async def telecharger_recu_pdf(facture_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """Reçu de paiement au format PDF, rendu côté serveur et mis en cache"""
+    # Un reçu déjà rendu pour l'état courant de la facture est servi sans recalcul
+    recu_connu, etat_facture = await asyncio.gather(
+        db.recus_pdf.find_one({"_id": facture_id}),
+        trouver_avec_archives("factures", {"_id": facture_id}, {"date_modification": 1})
+    )
+    if not etat_facture:
+        raise HTTPException(status_code=404, detail="Facture introuvable")
+    
+    contenu = None
+    if recu_connu and recu_connu.get("version_facture") == etat_facture.get("date_modification"):
+        await verifier_acces_facture(current_user, recu_connu["eleve_id"])
+        etag = f'"{recu_connu["empreinte"]}"'
+        non_modifie = reponse_non_modifiee(request, etag)
+        if non_modifie:
+            return non_modifie
+        contenu = await asyncio.to_thread(lire_fichier_cache, DOSSIER_CACHE_PDF / "recus" / f"{recu_connu['empreinte']}.pdf")
+        numero_recu = recu_connu["numero_recu"]
+    
+    if contenu is None:
+        facture, recu_data, empreinte = await charger_recu(facture_id)
+        await verifier_acces_facture(current_user, facture["eleve_id"])
+        contenu = await rendre_pdf_en_cache("recus", rendre_recu, recu_data, empreinte)
+        numero_recu = recu_data["numero_recu"]
+        etag = f'"{empreinte}"'
+        await db.recus_pdf.replace_one(
+            {"_id": facture_id},
+            {
+                "empreinte": empreinte,
+                "eleve_id": facture["eleve_id"],
+                "numero_recu": numero_recu,
+                "version_facture": facture.get("date_modification"),
+                "date_creation": datetime.now(timezone.utc)
+            },
+            upsert=True
+        )
+    
+    return Response(
+        content=contenu,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f'inline; filename="{nom_fichier_sur(numero_recu)}.pdf"',
+            "ETag": etag,
+            "Cache-Control": "private, no-cache"
+        }
+    )
+
+@api_router.get("/finances/recus-classe")
+async def telecharger_recus_classe(
+    classe: str,
+    annee_scolaire: str = "2024-2025",
+    current_user: dict = Depends(get_current_user)
+):
+    """Archive ZIP des reçus de toutes les factures réglées (même partiellement) d'une classe"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    eleves = {
+        e["_id"]: e for e in await db.eleves.find(
+            {"classe": classe, "annee_scolaire": annee_scolaire},
+            {"nom": 1, "prenoms": 1, "classe": 1, "matricule": 1}
+        ).to_list(length=None)
+    }
+    factures = await db.factures.find(
+        {"eleve_id": {"$in": list(eleves)}, "montant_paye": {"$gt": 0}}
+    ).to_list(length=None)
+    paiements_par_facture: Dict[str, List[dict]] = {}
+    async for paiement in db.paiements.find(
+        {"facture_id": {"$in": [f["_id"] for f in factures]}, "statut": "reussi"}
+    ).sort("date_completion", 1):
+        paiements_par_facture.setdefault(paiement["facture_id"], []).append(paiement)
+    
+    recus = [
+        construire_recu(facture, eleves.get(facture["eleve_id"]), paiements_par_facture[facture["_id"]])
+        for facture in factures if facture["_id"] in paiements_par_facture
+    ]
+    if not recus:
+        raise HTTPException(status_code=404, detail="Aucun reçu à générer pour cette classe")
+    
+    await db.recus_pdf.bulk_write([
+        UpdateOne(
+            {"_id": facture["_id"]},
+            {"$set": {
+                "empreinte": empreinte,
+                "eleve_id": facture["eleve_id"],
+                "numero_recu": recu_data["numero_recu"],
+                "version_facture": facture.get("date_modification"),
+                "date_creation": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        for facture, recu_data, empreinte in recus
+    ], ordered=False)
+    
+    async def rendre(recu_data: dict, empreinte: str):
+        eleve = recu_data["eleve"]
+        nom = nom_fichier_sur(f"{eleve['nom']}_{eleve['prenoms']}_{recu_data['numero_recu']}") + ".pdf"
+        return nom, await rendre_pdf_en_cache("recus", rendre_recu, recu_data, empreinte)
+    
+    return StreamingResponse(
+        archive_zip_en_flux(rendus_au_fil_de_l_eau(rendre(recu_data, empreinte) for _, recu_data, empreinte in recus)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="recus_{nom_fichier_sur(classe)}_{annee_scolaire}.zip"'}
+    )
+
 @api_router.get("/finances/rapports")
 async def generer_rapport_financier(
     type_rapport: str = Query("mensuel", pattern="^(quotidien|hebdomadaire|mensuel|trimestriel|annuel)$"),
     mois: Optional[int] = Query(None, ge=1, le=12),
     annee: int = Query(default=2025, ge=2020, le=2030),
     classe: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    lecture: LectureAnalytique = Depends(lecture_analytique("rapport_financier"))
 ):
     """Générer des rapports financiers pour les administrateurs"""
     
@@ -3275,9 +5917,12 @@ async def generer_rapport_financier(
         }
     }
     
+    # Factures soldées et paiements des années archivées : lus aussi dans leurs archives
+    annees_archivees = annees_basculees()
+    
     # 1. Statistiques des factures
     pipeline_factures = [
-        {"$match": periode_filter},
+        *etapes_avec_archives("factures", periode_filter, annees_archivees),
         {"$group": {
             "_id": "$statut",
             "count": {"$sum": 1},
@@ -3286,12 +5931,12 @@ async def generer_rapport_financier(
         }}
     ]
     
-    cursor = db.factures.aggregate(pipeline_factures)
+    cursor = lecture.db.factures.aggregate(pipeline_factures, session=lecture.session)
     stats_factures = await cursor.to_list(length=None)
     
     # 2. Statistiques des paiements
     pipeline_paiements = [
-        {"$match": {**periode_filter, "statut": "reussi"}},
+        *etapes_avec_archives("paiements", {**periode_filter, "statut": "reussi"}, annees_archivees),
         {"$group": {
             "_id": "$operateur",
             "count": {"$sum": 1},
@@ -3299,7 +5944,7 @@ async def generer_rapport_financier(
         }}
     ]
     
-    cursor = db.paiements.aggregate(pipeline_paiements)
+    cursor = lecture.db.paiements.aggregate(pipeline_paiements, session=lecture.session)
     stats_paiements = await cursor.to_list(length=None)
     
     # 3. Créances par classe
@@ -3323,7 +5968,7 @@ async def generer_rapport_financier(
     if classe:
         pipeline_creances[0]["$match"]["eleve.classe"] = classe
     
-    cursor = db.factures.aggregate(pipeline_creances)
+    cursor = lecture.db.factures.aggregate(pipeline_creances, session=lecture.session)
     creances_par_classe = await cursor.to_list(length=None)
     
     # 4. Évolution mensuelle (si rapport annuel)
@@ -3336,16 +5981,16 @@ async def generer_rapport_financier(
             else:
                 fin_mois = datetime(annee, mois_num + 1, 1, tzinfo=timezone.utc)
             
-            montant_mois = await db.paiements.aggregate([
-                {"$match": {
+            montant_mois = await lecture.db.paiements.aggregate([
+                *etapes_avec_archives("paiements", {
                     "date_creation": {
                         "$gte": debut_mois.isoformat(),
                         "$lt": fin_mois.isoformat()
                     },
                     "statut": "reussi"
-                }},
+                }, annees_archivees),
                 {"$group": {"_id": None, "total": {"$sum": "$montant"}}}
-            ]).to_list(length=None)
+            ], session=lecture.session).to_list(length=None)
             
             evolution_mensuelle.append({
                 "mois": mois_num,
@@ -3382,7 +6027,7 @@ async def generer_rapport_financier(
         {"$limit": 10}
     ]
     
-    cursor = db.factures.aggregate(pipeline_retardataires)
+    cursor = lecture.db.factures.aggregate(pipeline_retardataires, session=lecture.session)
     retardataires = await cursor.to_list(length=None)
     
     # Calculs de totaux généraux
@@ -3409,7 +6054,8 @@ async def generer_rapport_financier(
         "creances_par_classe": creances_par_classe,
         "evolution_mensuelle": evolution_mensuelle,
         "top_retardataires": retardataires,
-        "date_generation": datetime.now(timezone.utc).isoformat()
+        "date_generation": datetime.now(timezone.utc).isoformat(),
+        "donnees_au": lecture.donnees_au()
     }
     
     return rapport
@@ -3418,7 +6064,8 @@ async def generer_rapport_financier(
 async def lister_factures_en_retard(
     jours_retard: int = Query(default=7, ge=1),
     classe: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    lecture: LectureAnalytique = Depends(lecture_analytique("factures_en_retard"))
 ):
     """Lister les factures en retard avec notifications automatiques"""
     
@@ -3456,7 +6103,7 @@ async def lister_factures_en_retard(
     if classe:
         pipeline[0]["$match"]["eleve.classe"] = classe
     
-    cursor = db.factures.aggregate(pipeline)
+    cursor = lecture.db.factures.aggregate(pipeline, session=lecture.session)
     factures_retard = await cursor.to_list(length=None)
     
     # Nettoyage et conversion
@@ -3487,57 +6134,707 @@ async def lister_factures_en_retard(
     return {
         "factures_en_retard": factures_retard,
         "total": len(factures_retard),
-        "montant_total_du": sum(f["montant_restant"] for f in factures_retard)
+        "montant_total_du": sum(f["montant_restant"] for f in factures_retard),
+        "donnees_au": lecture.donnees_au()
+    }
+
+# Grilles tarifaires et facturation trimestrielle en masse
+TAILLE_LOT_FACTURES = 500
+
+@api_router.put("/finances/grilles-tarifaires")
+async def enregistrer_grille_tarifaire(grille_data: GrilleTarifaireCreate, current_user: dict = Depends(get_current_user)):
+    """Créer ou remplacer la grille tarifaire d'une classe pour une année scolaire"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    grille_doc = {
+        "classe": grille_data.classe,
+        "annee_scolaire": grille_data.annee_scolaire,
+        "lignes": [ligne.dict() for ligne in grille_data.lignes],
+        "echeancier": [
+            {**tranche.dict(), "date_echeance": tranche.date_echeance.isoformat()}
+            for tranche in grille_data.echeancier
+        ],
+        "montant_annuel": sum(ligne.montant for ligne in grille_data.lignes),
+        "modifie_par": current_user["_id"],
+        "date_modification": datetime.now(timezone.utc)
+    }
+    
+    await db.grilles_tarifaires.update_one(
+        {"classe": grille_data.classe, "annee_scolaire": grille_data.annee_scolaire},
+        {
+            "$set": grille_doc,
+            "$setOnInsert": {"_id": str(uuid.uuid4()), "date_creation": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+    
+    return {"message": f"Grille tarifaire enregistrée pour la classe {grille_data.classe}", "grille": grille_doc}
+
+@api_router.get("/finances/grilles-tarifaires")
+async def lister_grilles_tarifaires(
+    annee_scolaire: str = "2024-2025",
+    current_user: dict = Depends(get_current_user)
+):
+    """Liste des grilles tarifaires d'une année scolaire"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    grilles = await db.grilles_tarifaires.find({"annee_scolaire": annee_scolaire}).sort("classe", 1).to_list(length=None)
+    for grille in grilles:
+        grille['_id'] = str(grille['_id'])
+    
+    return {"grilles": grilles}
+
+@api_router.post("/finances/facturation-trimestrielle")
+async def emettre_factures_trimestre(facturation_data: FacturationTrimestrielleRequest, current_user: dict = Depends(get_current_user)):
+    """Émettre en masse les factures d'un trimestre pour une ou plusieurs classes (ou toute l'école)"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    annee = facturation_data.annee_scolaire
+    verifier_annee_ouverte(annee)
+    trimestre = facturation_data.trimestre
+    cle_facturation = f"{annee}:{trimestre}"
+    
+    filtre_grilles = {"annee_scolaire": annee}
+    if facturation_data.classes:
+        filtre_grilles["classe"] = {"$in": facturation_data.classes}
+    grilles = {g["classe"]: g for g in await db.grilles_tarifaires.find(filtre_grilles).to_list(length=None)}
+    
+    classes_sans_grille = sorted(set(facturation_data.classes or []) - set(grilles))
+    classes_sans_tranche = sorted(
+        classe for classe, grille in grilles.items()
+        if not any(t["trimestre"] == trimestre for t in grille["echeancier"])
+    )
+    classes_facturables = [c for c in grilles if c not in classes_sans_tranche]
+    
+    # Tous les élèves inscrits concernés en une seule requête
+    eleves = await db.eleves.find(
+        {"classe": {"$in": classes_facturables}, "annee_scolaire": annee, "statut_inscription": True},
+        {"_id": 1, "nom": 1, "prenoms": 1, "classe": 1, "matricule": 1}
+    ).to_list(length=None)
+    
+    # Élèves déjà facturés pour ce trimestre (relance idempotente)
+    deja_factures = {
+        f["eleve_id"] for f in await db.factures.find(
+            {"cle_facturation": cle_facturation, "eleve_id": {"$in": [e["_id"] for e in eleves]}},
+            {"eleve_id": 1}
+        ).to_list(length=None)
+    }
+    a_facturer = [e for e in eleves if e["_id"] not in deja_factures]
+    
+    maintenant = datetime.utcnow().isoformat()
+    factures_docs = []
+    for eleve in a_facturer:
+        grille = grilles[eleve["classe"]]
+        tranche = next(t for t in grille["echeancier"] if t["trimestre"] == trimestre)
+        lignes = [
+            {**ligne, "montant": round(ligne["montant"] * tranche["pourcentage"] / 100)}
+            for ligne in grille["lignes"]
+        ]
+        montant_total = sum(ligne["montant"] for ligne in lignes)
+        factures_docs.append({
+            "_id": str(uuid.uuid4()),
+            "numero_facture": None,
+            "eleve_id": eleve["_id"],
+            "titre": f"Frais de scolarité {trimestre} {annee} - {eleve['classe']}",
+            "description": ", ".join(f"{ligne['libelle']}: {ligne['montant']} GNF" for ligne in lignes),
+            "lignes": lignes,
+            "montant_total": montant_total,
+            "montant_paye": 0,
+            "montant_restant": montant_total,
+            "devise": "GNF",
+            "date_emission": maintenant,
+            "date_echeance": tranche["date_echeance"],
+            "statut": "emise",
+            "type_frais": sorted({ligne["type_frais"] for ligne in lignes}),
+            "cle_facturation": cle_facturation,
+            "date_creation": maintenant,
+            "date_modification": maintenant
+        })
+    
+    classes_eleves = {eleve["_id"]: eleve["classe"] for eleve in a_facturer}
+    
+    def resumer(factures: List[dict], nombre_deja_factures: int) -> dict:
+        resume_classes: Dict[str, dict] = {}
+        for facture in factures:
+            classe = classes_eleves[facture["eleve_id"]]
+            resume = resume_classes.setdefault(classe, {"classe": classe, "nombre_factures": 0, "montant_total": 0})
+            resume["nombre_factures"] += 1
+            resume["montant_total"] += facture["montant_total"]
+        return {
+            "trimestre": trimestre,
+            "annee_scolaire": annee,
+            "nombre_factures": len(factures),
+            "montant_total": sum(f["montant_total"] for f in factures),
+            "par_classe": [resume_classes[c] for c in sorted(resume_classes)],
+            "eleves_deja_factures": nombre_deja_factures,
+            "classes_sans_grille": classes_sans_grille,
+            "classes_sans_tranche": classes_sans_tranche
+        }
+    
+    if facturation_data.apercu:
+        return {
+            "message": f"Aperçu : {len(factures_docs)} factures seraient émises",
+            "apercu": True,
+            **resumer(factures_docs, len(deja_factures)),
+            "exemples": factures_docs[:20]
+        }
+    
+    # Facture déjà insérée par une émission concurrente du même trimestre (index unique
+    # cle_facturation + eleve_id) : ignorée et comptée parmi les élèves déjà facturés
+    doublons = set()
+    if factures_docs:
+        # Bloc contigu de numéros réservé en un seul aller-retour
+        numeros = await generer_numeros_facture(len(factures_docs))
+        for facture, numero in zip(factures_docs, numeros):
+            facture["numero_facture"] = numero
+        
+        for debut in range(0, len(factures_docs), TAILLE_LOT_FACTURES):
+            lot = factures_docs[debut:debut + TAILLE_LOT_FACTURES]
+            try:
+                await db.factures.insert_many(lot, ordered=False)
+            except BulkWriteError as e:
+                erreurs = e.details["writeErrors"]
+                if any(erreur["code"] != 11000 or "cle_facturation" not in erreur.get("keyPattern", {})
+                       for erreur in erreurs):
+                    raise
+                doublons.update(lot[erreur["index"]]["_id"] for erreur in erreurs)
+        factures_docs = [f for f in factures_docs if f["_id"] not in doublons]
+    resultat = resumer(factures_docs, len(deja_factures) + len(doublons))
+    
+    return {
+        "message": f"{len(factures_docs)} factures émises pour le {trimestre} {annee}",
+        "apercu": False,
+        **resultat,
+        "premier_numero": factures_docs[0]["numero_facture"] if factures_docs else None,
+        "dernier_numero": factures_docs[-1]["numero_facture"] if factures_docs else None
+    }
+
+# Rapprochement des relevés opérateurs avec les paiements
+TAILLE_LOT_RELEVE = 5000  # Lignes du relevé lues par lot
+TAILLE_LOT_ANOMALIES = 1000
+STATUTS_RELEVE_REUSSIS = {"reussi", "succes", "success", "successful", "completed", "ok"}
+
+def lire_montant_releve(valeur: str) -> Optional[float]:
+    """Montant d'un relevé : tolère espaces (y compris insécables) et virgule décimale"""
+    nettoye = (valeur or "").replace("\u00a0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(nettoye)
+    except ValueError:
+        return None
+
+# Relevés importés : dossier partagé par les workers d'une même machine, pour qu'un autre worker
+# puisse reprendre un rapprochement dont le bail a expiré (worker arrêté en cours de traitement)
+DOSSIER_RELEVES = Path(os.environ.get('RECONCILIATION_DIR', str(ROOT_DIR / 'cache' / 'releves')))
+DUREE_BAIL_RAPPROCHEMENT = 120  # Secondes, prolongé à chaque lot
+MAX_REPRISES_RAPPROCHEMENT = 3
+
+class RapprochementRepris(Exception):
+    pass
+
+async def prolonger_bail_rapprochement(rapprochement_id: str):
+    resultat = await db.rapprochements.update_one(
+        {"_id": rapprochement_id, "statut": "en_cours", "detenteur": identifiant_worker()},
+        {"$set": {"bail_expire_le": datetime.now(timezone.utc) + timedelta(seconds=DUREE_BAIL_RAPPROCHEMENT)}}
+    )
+    if not resultat.matched_count:
+        raise RapprochementRepris(f"Rapprochement {rapprochement_id} repris par un autre worker")
+
+async def executer_rapprochement(rapprochement: dict):
+    """Tâche de fond : rapproche un relevé CSV des paiements de la période, en une passe.
+    
+    Le relevé est lu par lots depuis le disque et les anomalies écrites au fil de l'eau :
+    seul l'index des paiements de la période est gardé en mémoire. Le worker détient un
+    bail sur le rapprochement ; une reprise recommence depuis le début du relevé.
+    """
+    rapprochement_id = rapprochement["_id"]
+    operateur = rapprochement["operateur"]
+    colonnes = rapprochement["colonnes"]
+    date_debut = rapprochement["date_debut"]
+    # Les dates d'initiation sont des horodatages ISO : fin de période incluse
+    date_fin = f"{rapprochement['date_fin']}T23:59:59.999999"
+    compteurs = {
+        "lignes_lues": 0,
+        "lignes_ignorees": 0,
+        "rapprochees": 0,
+        "absent_base": 0,
+        "doublon": 0,
+        "ecart_montant": 0,
+        "statut_divergent": 0,
+        "absent_releve": 0,
+        "montant_releve": 0.0,
+        "montant_rapproche": 0.0
+    }
+    anomalies: List[dict] = []
+    
+    async def signaler(type_anomalie: str, **details):
+        compteurs[type_anomalie] += 1
+        anomalies.append({
+            "_id": str(uuid.uuid4()),
+            "rapprochement_id": rapprochement_id,
+            "type": type_anomalie,
+            **details
+        })
+        if len(anomalies) >= TAILLE_LOT_ANOMALIES:
+            await db.anomalies_rapprochement.insert_many(anomalies, ordered=False)
+            anomalies.clear()
+    
+    chemin_releve = rapprochement.get("chemin_releve")
+    termine = False
+    try:
+        if rapprochement.get("reprises", 0) > MAX_REPRISES_RAPPROCHEMENT:
+            raise RuntimeError(f"Abandonné après {MAX_REPRISES_RAPPROCHEMENT} reprises")
+        if not chemin_releve or not await asyncio.to_thread(os.path.exists, chemin_releve):
+            raise RuntimeError("Relevé introuvable sur ce serveur")
+        # Anomalies d'une exécution interrompue
+        await db.anomalies_rapprochement.delete_many({"rapprochement_id": rapprochement_id})
+        
+        # Index des paiements de la période : référence opérateur et référence interne
+        index: Dict[str, dict] = {}
+        paiements_lus = 0
+        curseur = db.paiements.find(
+            {"operateur": operateur.upper(), "date_initiation": {"$gte": date_debut, "$lte": date_fin}},
+            {"reference_interne": 1, "reference_operateur": 1, "montant": 1, "statut": 1, "facture_id": 1}
+        ).batch_size(TAILLE_LOT_RELEVE)
+        async for paiement in curseur:
+            entree = {
+                "paiement_id": paiement["_id"],
+                "reference_interne": paiement["reference_interne"],
+                "montant": paiement["montant"],
+                "statut": paiement["statut"],
+                "facture_id": paiement.get("facture_id"),
+                "vu": False
+            }
+            index[paiement["reference_interne"]] = entree
+            if paiement.get("reference_operateur"):
+                index[paiement["reference_operateur"]] = entree
+            paiements_lus += 1
+            if paiements_lus % TAILLE_LOT_RELEVE == 0:
+                await prolonger_bail_rapprochement(rapprochement_id)
+        
+        # Lectures disque dans un thread : la boucle asyncio du worker n'est jamais bloquée
+        fichier = await asyncio.to_thread(open, chemin_releve, newline="", encoding="utf-8-sig", errors="replace")
+        try:
+            echantillon = await asyncio.to_thread(fichier.read, 4096)
+            fichier.seek(0)
+            try:
+                dialecte = csv.Sniffer().sniff(echantillon, delimiters=",;\t|")
+            except csv.Error:
+                dialecte = csv.excel
+            lecteur = csv.DictReader(fichier, dialect=dialecte)
+            
+            entetes = await asyncio.to_thread(lambda: lecteur.fieldnames) or []
+            manquantes = [c for c in (colonnes["reference"], colonnes["montant"]) if c not in entetes]
+            if manquantes:
+                raise ValueError(f"Colonnes absentes du relevé: {', '.join(manquantes)}")
+            colonne_statut = colonnes["statut"] if colonnes["statut"] in entetes else None
+            
+            while True:
+                lignes = await asyncio.to_thread(list, itertools.islice(lecteur, TAILLE_LOT_RELEVE))
+                if not lignes:
+                    break
+                
+                for ligne in lignes:
+                    compteurs["lignes_lues"] += 1
+                    numero_ligne = compteurs["lignes_lues"] + 1  # Ligne d'en-tête comprise
+                    if colonne_statut and (ligne.get(colonne_statut) or "").strip().lower() not in STATUTS_RELEVE_REUSSIS:
+                        compteurs["lignes_ignorees"] += 1
+                        continue
+                    
+                    reference = (ligne.get(colonnes["reference"]) or "").strip()
+                    montant = lire_montant_releve(ligne.get(colonnes["montant"]))
+                    if montant is not None:
+                        compteurs["montant_releve"] += montant
+                    
+                    entree = index.get(reference)
+                    if entree is None:
+                        await signaler("absent_base", ligne=numero_ligne, reference=reference, montant_releve=montant)
+                        continue
+                    if entree["vu"]:
+                        await signaler("doublon", ligne=numero_ligne, reference=reference, montant_releve=montant, paiement_id=entree["paiement_id"])
+                        continue
+                    entree["vu"] = True
+                    
+                    if montant is None or abs(montant - entree["montant"]) > 0.01:
+                        await signaler(
+                            "ecart_montant", ligne=numero_ligne, reference=reference,
+                            montant_releve=montant, montant_base=entree["montant"], paiement_id=entree["paiement_id"]
+                        )
+                    elif entree["statut"] != "reussi":
+                        await signaler(
+                            "statut_divergent", ligne=numero_ligne, reference=reference,
+                            montant_releve=montant, statut_base=entree["statut"], paiement_id=entree["paiement_id"]
+                        )
+                    else:
+                        compteurs["rapprochees"] += 1
+                        compteurs["montant_rapproche"] += montant
+                
+                await prolonger_bail_rapprochement(rapprochement_id)
+                await db.rapprochements.update_one(
+                    {"_id": rapprochement_id},
+                    {"$set": {"lignes_traitees": compteurs["lignes_lues"]}}
+                )
+        finally:
+            await asyncio.to_thread(fichier.close)
+        
+        # Paiements réussis chez nous mais absents du relevé
+        for reference, entree in index.items():
+            if reference == entree["reference_interne"] and entree["statut"] == "reussi" and not entree["vu"]:
+                await signaler(
+                    "absent_releve", reference=reference,
+                    montant_base=entree["montant"], paiement_id=entree["paiement_id"], facture_id=entree["facture_id"]
+                )
+        
+        if anomalies:
+            await db.anomalies_rapprochement.insert_many(anomalies, ordered=False)
+        
+        await db.rapprochements.update_one(
+            {"_id": rapprochement_id, "detenteur": identifiant_worker()},
+            {"$set": {
+                "statut": "termine",
+                "lignes_traitees": compteurs["lignes_lues"],
+                "paiements_periode": sum(1 for r, e in index.items() if r == e["reference_interne"]),
+                "compteurs": compteurs,
+                "date_fin_traitement": datetime.now(timezone.utc)
+            }}
+        )
+        termine = True
+    except RapprochementRepris as e:
+        logger.warning(str(e))
+    except Exception as e:
+        logger.error(f"Erreur rapprochement {rapprochement_id}: {str(e)}")
+        await db.rapprochements.update_one(
+            {"_id": rapprochement_id},
+            {"$set": {"statut": "echec", "erreur": str(e), "compteurs": compteurs, "date_fin_traitement": datetime.now(timezone.utc)}}
+        )
+        termine = True
+    finally:
+        # Un rapprochement repris ailleurs garde son relevé
+        if termine and chemin_releve:
+            try:
+                await asyncio.to_thread(os.unlink, chemin_releve)
+            except FileNotFoundError:
+                pass
+
+async def reprendre_rapprochements_periodiquement():
+    """Tâche de fond : reprend les rapprochements dont le bail a expiré (worker arrêté en cours de traitement)"""
+    while True:
+        await asyncio.sleep(DUREE_BAIL_RAPPROCHEMENT)
+        try:
+            while True:
+                maintenant = datetime.now(timezone.utc)
+                rapprochement = await db.rapprochements.find_one_and_update(
+                    {"statut": "en_cours", "$or": [
+                        {"bail_expire_le": {"$lt": maintenant}},
+                        {"bail_expire_le": {"$exists": False}}
+                    ]},
+                    {
+                        "$set": {
+                            "detenteur": identifiant_worker(),
+                            "bail_expire_le": maintenant + timedelta(seconds=DUREE_BAIL_RAPPROCHEMENT),
+                            "lignes_traitees": 0
+                        },
+                        "$inc": {"reprises": 1}
+                    },
+                    return_document=ReturnDocument.AFTER
+                )
+                if not rapprochement:
+                    break
+                logger.info(f"Reprise du rapprochement {rapprochement['_id']}")
+                await executer_rapprochement(rapprochement)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur reprise des rapprochements: {str(e)}")
+
+@api_router.post("/finances/rapprochements")
+async def lancer_rapprochement(
+    background_tasks: BackgroundTasks,
+    releve: UploadFile = File(...),
+    operateur: str = Form(...),
+    date_debut: date = Form(...),
+    date_fin: date = Form(...),
+    colonne_reference: str = Form("reference"),
+    colonne_montant: str = Form("montant"),
+    colonne_statut: Optional[str] = Form("statut"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Importer un relevé Orange Money / MTN (CSV) et lancer son rapprochement avec les paiements"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    if operateur.lower() not in ("orange", "mtn"):
+        raise HTTPException(status_code=400, detail="Opérateur inconnu")
+    if date_fin < date_debut:
+        raise HTTPException(status_code=400, detail="Période invalide")
+    
+    rapprochement_id = str(uuid.uuid4())
+    chemin_releve = DOSSIER_RELEVES / f"releve_{rapprochement_id}.csv"
+    
+    # Copie sur disque par blocs, écritures dans un thread : le fichier d'envoi est fermé avant l'exécution de la tâche
+    await asyncio.to_thread(DOSSIER_RELEVES.mkdir, parents=True, exist_ok=True)
+    copie = await asyncio.to_thread(open, chemin_releve, "wb")
+    try:
+        while bloc := await releve.read(1024 * 1024):
+            await asyncio.to_thread(copie.write, bloc)
+    finally:
+        await asyncio.to_thread(copie.close)
+    
+    rapprochement = {
+        "_id": rapprochement_id,
+        "operateur": operateur.upper(),
+        "fichier": releve.filename,
+        "chemin_releve": str(chemin_releve),
+        "date_debut": date_debut.isoformat(),
+        "date_fin": date_fin.isoformat(),
+        "colonnes": {"reference": colonne_reference, "montant": colonne_montant, "statut": colonne_statut},
+        "statut": "en_cours",
+        "lignes_traitees": 0,
+        "detenteur": identifiant_worker(),
+        "bail_expire_le": datetime.now(timezone.utc) + timedelta(seconds=DUREE_BAIL_RAPPROCHEMENT),
+        "lance_par": current_user["_id"],
+        "date_creation": datetime.now(timezone.utc)
+    }
+    await db.rapprochements.insert_one(rapprochement)
+    
+    background_tasks.add_task(executer_rapprochement, rapprochement)
+    
+    return {"message": "Rapprochement lancé", "rapprochement_id": rapprochement["_id"], "statut": "en_cours"}
+
+@api_router.get("/finances/rapprochements/{rapprochement_id}")
+async def get_rapprochement(
+    rapprochement_id: str,
+    type_anomalie: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    """Rapport d'un rapprochement : synthèse et anomalies paginées"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    rapprochement = await db.rapprochements.find_one({"_id": rapprochement_id})
+    if not rapprochement:
+        raise HTTPException(status_code=404, detail="Rapprochement introuvable")
+    
+    filtre = {"rapprochement_id": rapprochement_id}
+    if type_anomalie:
+        filtre["type"] = type_anomalie
+    
+    anomalies = await db.anomalies_rapprochement.find(filtre, {"rapprochement_id": 0}).sort(
+        [("type", 1), ("ligne", 1)]
+    ).skip((page - 1) * limit).limit(limit).to_list(length=None)
+    total = await db.anomalies_rapprochement.count_documents(filtre)
+    
+    return {
+        "rapprochement": rapprochement,
+        "anomalies": anomalies,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "total_pages": (total + limit - 1) // limit
     }
 
 @api_router.get("/calendrier/trimestres")
 async def get_trimestres_info(annee_scolaire: str = "2024-2025"):
     """Information sur les trimestres (compatibilité)"""
-    response = await list_trimestres(annee_scolaire, current_user=None)
+    response = await trimestres_annee(annee_scolaire)
     return {
         "annee_scolaire": annee_scolaire,
         "trimestres": response["trimestres"]
     }
 
+# Présences : collection time-series presences_ts, une mesure par élève, matière et jour.
+# date_cours est une date BSON (minuit UTC) ; eleve_id et classe forment les métadonnées,
+# stockées une fois par bucket. L'enseignant est noté par appel (collection appels).
+# Le remplacement d'un appel supprime des mesures filtrées sur matiere et version_appel,
+# hors métadonnées : MongoDB 7.0+ exigé, le worker refuse de démarrer en dessous.
+OPTIONS_PRESENCES_TS = {"timeField": "date_cours", "metaField": "metadonnees", "granularity": "hours"}
+VERSION_MONGO_MINIMALE = (7, 0)
+DUREE_VERROU_APPEL = 30  # Secondes ; couvre l'écriture d'un appel de classe
+
+async def creer_collection_presences(base=None, nom: str = "presences_ts"):
+    """Crée presences_ts (ou une de ses archives) avant ses index, au démarrage ou avant une migration"""
+    base = db if base is None else base
+    version = (await base.command("buildInfo"))["versionArray"]
+    if tuple(version[:2]) < VERSION_MONGO_MINIMALE:
+        raise RuntimeError(
+            f"MongoDB {'.'.join(map(str, VERSION_MONGO_MINIMALE))}+ requis pour presences_ts "
+            f"(suppressions hors métadonnées), serveur en {'.'.join(map(str, version[:3]))}"
+        )
+    if await base.list_collection_names(filter={"name": nom}):
+        return
+    try:
+        await base.create_collection(nom, timeseries=OPTIONS_PRESENCES_TS)
+    except CollectionInvalid:
+        pass  # Créée entre-temps par un autre worker
+    except OperationFailure as e:
+        if e.code != 48:  # NamespaceExists
+            raise
+
+def instant_cours(jour) -> datetime:
+    """date ou 'AAAA-MM-JJ' -> minuit UTC, valeur du champ temporel de presences_ts"""
+    if isinstance(jour, str):
+        jour = date.fromisoformat(jour[:10])
+    return datetime(jour.year, jour.month, jour.day, tzinfo=timezone.utc)
+
+def periode_presences(annee_scolaire: str) -> dict:
+    debut, fin = bornes_annee_scolaire(annee_scolaire)
+    return {"$gte": instant_cours(debut), "$lt": instant_cours(fin)}
+
+def mesure_presence(eleve_id: str, classe: str, jour, matiere: str, present: bool,
+                    motif_absence: Optional[str] = None, justification: Optional[str] = None) -> dict:
+    mesure = {
+        "date_cours": instant_cours(jour),
+        "metadonnees": {"eleve_id": eleve_id, "classe": classe},
+        "matiere": matiere,
+        "present": present
+    }
+    # Champs absents plutôt que nuls : rien à stocker pour les présents
+    if motif_absence:
+        mesure["motif_absence"] = motif_absence
+    if justification:
+        mesure["justification"] = justification
+    return mesure
+
+def presence_pour_api(mesure: dict) -> dict:
+    """Forme historique d'une présence (eleve_id à plat, date ISO)"""
+    presence = {k: v for k, v in mesure.items() if k not in ("metadonnees", "version_appel")}
+    presence["_id"] = str(mesure["_id"])
+    presence["eleve_id"] = mesure["metadonnees"]["eleve_id"]
+    presence["classe"] = mesure["metadonnees"].get("classe")
+    presence["date_cours"] = mesure["date_cours"].date().isoformat()
+    presence.setdefault("motif_absence", None)
+    return presence
+
+def cle_appel(classe: str, jour: date, matiere: str) -> str:
+    return f"{classe}:{jour.isoformat()}:{matiere}"
+
+@asynccontextmanager
+async def verrou_appel(classe: str, jour: date, matiere: str):
+    """Sérialise les écritures d'un même appel, y compris entre requêtes d'un même worker"""
+    nom, detenteur = f"appel:{cle_appel(classe, jour, matiere)}", f"{identifiant_worker()}:{uuid.uuid4().hex}"
+    if not await acquerir_verrou(nom, DUREE_VERROU_APPEL, detenteur):
+        raise HTTPException(status_code=409, detail="Appel en cours d'enregistrement, réessayez dans un instant")
+    try:
+        yield
+    finally:
+        await db.verrous.delete_one({"_id": nom, "detenteur": detenteur})
+
+async def noter_appel(classe: str, jour: date, matiere: str, enseignant_id: str):
+    await db.appels.update_one(
+        {"_id": cle_appel(classe, jour, matiere)},
+        {
+            "$set": {"enseignant_id": enseignant_id, "date_modification": datetime.now(timezone.utc)},
+            "$setOnInsert": {"classe": classe, "date_cours": instant_cours(jour), "matiere": matiere}
+        },
+        upsert=True
+    )
+
 # Routes de gestion des présences
 @api_router.post("/presences")
 async def create_presence(presence_data: PresenceCreate, current_user: dict = Depends(get_current_user)):
     """Enregistrer une présence/absence"""
     if current_user["role"] not in ["administrateur", "enseignant"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
+    verifier_annee_ouverte(annee_scolaire_de(presence_data.date_cours))
     
     # Vérification de l'élève
     eleve = await db.eleves.find_one({"_id": presence_data.eleve_id})
     if not eleve:
         raise HTTPException(status_code=404, detail="Élève introuvable")
     
-    # Vérification si une présence existe déjà pour cette date/matière
-    existing_presence = await db.presences.find_one({
-        "eleve_id": presence_data.eleve_id,
-        "date_cours": presence_data.date_cours.isoformat(),
-        "matiere": presence_data.matiere
-    })
-    
-    if existing_presence:
-        raise HTTPException(status_code=400, detail="Présence déjà enregistrée pour cette date et matière")
+    # Pas d'index unique sur une time-series : vérification et insertion sous le verrou de l'appel
+    async with verrou_appel(eleve["classe"], presence_data.date_cours, presence_data.matiere):
+        # Vérification si une présence existe déjà pour cette date/matière
+        existing_presence = await db.presences_ts.find_one({
+            "metadonnees.eleve_id": presence_data.eleve_id,
+            "date_cours": instant_cours(presence_data.date_cours),
+            "matiere": presence_data.matiere
+        })
+        
+        if existing_presence:
+            raise HTTPException(status_code=400, detail="Présence déjà enregistrée pour cette date et matière")
+        
+        # Création de la présence
+        presence_doc = mesure_presence(
+            presence_data.eleve_id,
+            eleve["classe"],
+            presence_data.date_cours,
+            presence_data.matiere,
+            presence_data.present,
+            presence_data.motif_absence
+        )
+        
+        await db.presences_ts.insert_one(presence_doc)
+        await noter_appel(eleve["classe"], presence_data.date_cours, presence_data.matiere, current_user["_id"])
     
-    # Création de la présence
-    presence_doc = {
-        "_id": str(uuid.uuid4()),
-        "eleve_id": presence_data.eleve_id,
-        "date_cours": presence_data.date_cours.isoformat(),
-        "matiere": presence_data.matiere,
-        "present": presence_data.present,
-        "motif_absence": presence_data.motif_absence,
-        "enseignant_id": current_user["_id"],
-        "date_creation": datetime.utcnow().isoformat()
+    return {
+        "message": "Présence enregistrée avec succès",
+        "presence": presence_pour_api(presence_doc)
     }
+
+@api_router.post("/presences/appel")
+async def faire_appel_classe(appel_data: AppelClasseCreate, current_user: dict = Depends(get_current_user)):
+    """Enregistrer l'appel d'une classe entière en une seule écriture groupée"""
+    if current_user["role"] not in ["administrateur", "enseignant"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    verifier_annee_ouverte(annee_scolaire_de(appel_data.date_cours))
+    
+    # Effectif de la classe en une seule requête
+    eleves = await db.eleves.find(
+        {"classe": appel_data.classe, "statut_inscription": True},
+        {"_id": 1}
+    ).to_list(length=None)
+    if not eleves:
+        raise HTTPException(status_code=404, detail="Aucun élève inscrit dans cette classe")
+    
+    ids_classe = {str(eleve["_id"]) for eleve in eleves}
+    absences = {absence.eleve_id: absence.motif_absence for absence in appel_data.absences}
+    inconnus = [eleve_id for eleve_id in absences if eleve_id not in ids_classe]
+    if inconnus:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Élèves introuvables dans la classe {appel_data.classe}: {', '.join(inconnus)}"
+        )
     
-    await db.presences.insert_one(presence_doc)
+    date_cours = appel_data.date_cours.isoformat()
+    mesures = [
+        mesure_presence(
+            eleve_id, appel_data.classe, appel_data.date_cours, appel_data.matiere,
+            eleve_id not in absences, absences.get(eleve_id)
+        )
+        for eleve_id in sorted(ids_classe)
+    ]
+    
+    # Pas d'upsert sur une time-series : un nouvel appel remplace les mesures du précédent.
+    # Nouvelle version insérée avant de supprimer les anciennes : un échec en cours de route
+    # laisse l'appel précédent (ou les deux, nettoyés au prochain envoi), jamais aucun.
+    version = uuid.uuid4().hex
+    for mesure in mesures:
+        mesure["version_appel"] = version
+    async with verrou_appel(appel_data.classe, appel_data.date_cours, appel_data.matiere):
+        await db.presences_ts.insert_many(mesures, ordered=False)
+        remplacees = await db.presences_ts.delete_many({
+            "metadonnees.classe": appel_data.classe,
+            "date_cours": instant_cours(appel_data.date_cours),
+            "matiere": appel_data.matiere,
+            "version_appel": {"$ne": version}
+        })
+        await noter_appel(appel_data.classe, appel_data.date_cours, appel_data.matiere, current_user["_id"])
     
     return {
-        "message": "Présence enregistrée avec succès",
-        "presence": presence_doc
+        "message": f"Appel enregistré pour la classe {appel_data.classe}",
+        "classe": appel_data.classe,
+        "date_cours": date_cours,
+        "matiere": appel_data.matiere,
+        "effectif": len(ids_classe),
+        "presents": len(ids_classe) - len(absences),
+        "absents": len(absences),
+        "enregistrements_crees": max(0, len(mesures) - remplacees.deleted_count),
+        "enregistrements_modifies": min(len(mesures), remplacees.deleted_count)
     }
 
 @api_router.get("/presences")
@@ -3552,20 +6849,17 @@ async def list_presences(
     current_user: dict = Depends(get_current_user)
 ):
     """Liste des présences avec filtres"""
-    # Construction du filtre
+    # Construction du filtre (métadonnées et champ temporel d'abord : filtrage au niveau des buckets)
     filter_query = {}
     
     if eleve_id:
-        filter_query["eleve_id"] = eleve_id
+        filter_query["metadonnees.eleve_id"] = eleve_id
     
     if date_debut:
-        filter_query["date_cours"] = {"$gte": date_debut.isoformat()}
+        filter_query["date_cours"] = {"$gte": instant_cours(date_debut)}
     
     if date_fin:
-        if "date_cours" in filter_query:
-            filter_query["date_cours"]["$lte"] = date_fin.isoformat()
-        else:
-            filter_query["date_cours"] = {"$lte": date_fin.isoformat()}
+        filter_query.setdefault("date_cours", {})["$lte"] = instant_cours(date_fin)
     
     if matiere:
         filter_query["matiere"] = matiere
@@ -3574,7 +6868,7 @@ async def list_presences(
         filter_query["present"] = False
     
     # Comptage total
-    total = await db.presences.count_documents(filter_query)
+    total = await db.presences_ts.count_documents(filter_query)
     
     # Pagination
     skip = (page - 1) * limit
@@ -3582,26 +6876,27 @@ async def list_presences(
     # Récupération des présences avec info élève
     pipeline = [
         {"$match": filter_query},
+        {"$sort": {"date_cours": -1}},
+        {"$skip": skip},
+        {"$limit": limit},
         {"$lookup": {
             "from": "eleves",
-            "localField": "eleve_id",
+            "localField": "metadonnees.eleve_id",
             "foreignField": "_id",
             "as": "eleve"
         }},
-        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}},
-        {"$sort": {"date_cours": -1}},
-        {"$skip": skip},
-        {"$limit": limit}
+        {"$unwind": {"path": "$eleve", "preserveNullAndEmptyArrays": True}}
     ]
     
-    cursor = db.presences.aggregate(pipeline)
-    presences = await cursor.to_list(length=None)
-    
-    # Conversion des ObjectIds
-    for presence in presences:
-        presence['_id'] = str(presence['_id'])
-        if 'eleve' in presence and presence['eleve']:
-            presence['eleve']['_id'] = str(presence['eleve']['_id'])
+    cursor = db.presences_ts.aggregate(pipeline)
+    presences = []
+    async for mesure in cursor:
+        eleve = mesure.pop("eleve", None)
+        presence = presence_pour_api(mesure)
+        if eleve:
+            eleve['_id'] = str(eleve['_id'])
+            presence["eleve"] = eleve
+        presences.append(presence)
     
     return {
         "presences": presences,
@@ -3613,25 +6908,33 @@ async def list_presences(
 
 # Routes de statistiques et tableau de bord
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    """Statistiques pour le tableau de bord"""
+async def get_dashboard_stats(
+    current_user: dict = Depends(get_current_user),
+    lecture: LectureAnalytique = Depends(lecture_analytique("tableau_de_bord"))
+):
+    """Statistiques pour le tableau de bord.
+    
+    Activité des années ouvertes : les factures soldées et les paiements des années
+    archivées ne sont plus comptés (voir /finances/rapports pour l'historique).
+    """
+    base, session = lecture.db, lecture.session
     
     # Statistiques générales
-    total_eleves = await db.eleves.count_documents({"statut_inscription": True})
-    total_factures = await db.factures.count_documents({})
-    total_paiements_reussis = await db.paiements.count_documents({"statut": "reussi"})
+    total_eleves = await base.eleves.count_documents({"statut_inscription": True}, session=session)
+    total_factures = await base.factures.count_documents({}, session=session)
+    total_paiements_reussis = await base.paiements.count_documents({"statut": "reussi"}, session=session)
     
     # Factures impayées
-    factures_impayees = await db.factures.count_documents({
+    factures_impayees = await base.factures.count_documents({
         "statut": {"$in": ["emise", "payee_partiellement"]}
-    })
+    }, session=session)
     
     # Montant total des créances
     pipeline_creances = [
         {"$match": {"statut": {"$in": ["emise", "payee_partiellement"]}}},
         {"$group": {"_id": None, "total_creances": {"$sum": "$montant_restant"}}}
     ]
-    cursor_creances = db.factures.aggregate(pipeline_creances)
+    cursor_creances = base.factures.aggregate(pipeline_creances, session=session)
     creances_result = await cursor_creances.to_list(length=None)
     total_creances = creances_result[0]["total_creances"] if creances_result else 0
     
@@ -3641,17 +6944,17 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         {"$group": {"_id": "$classe", "count": {"$sum": 1}}},
         {"$sort": {"_id": 1}}
     ]
-    cursor_classes = db.eleves.aggregate(pipeline_classes)
+    cursor_classes = base.eleves.aggregate(pipeline_classes, session=session)
     repartition_classes = await cursor_classes.to_list(length=None)
     
     # Présences de la semaine
     today = date.today()
     start_week = today - timedelta(days=today.weekday())
     
-    absences_semaine = await db.presences.count_documents({
-        "date_cours": {"$gte": start_week.isoformat()},
+    absences_semaine = await base.presences_ts.count_documents({
+        "date_cours": {"$gte": instant_cours(start_week)},
         "present": False
-    })
+    }, session=session)
     
     return {
         "eleves": {
@@ -3666,14 +6969,16 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         },
         "presences": {
             "absences_cette_semaine": absences_semaine
-        }
+        },
+        "donnees_au": lecture.donnees_au()
     }
 
 # Routes Dashboard Administrateur
 @api_router.get("/admin/dashboard", response_model=DashboardAdminResponse)
 async def get_admin_dashboard(
     periode: Optional[str] = Query("mois", description="Période des données: jour, semaine, mois, trimestre"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    lecture: LectureAnalytique = Depends(lecture_analytique("statistiques_admin"))
 ):
     """Dashboard complet pour les administrateurs."""
     
@@ -3685,10 +6990,12 @@ async def get_admin_dashboard(
         )
     
     # S'assurer que les données demo existent
-    await generer_donnees_demo()
+    if await generer_donnees_demo():
+        # Tout juste écrites sur le primaire : un secondaire ne les a peut-être pas encore répliquées
+        lecture = LectureAnalytique(db, lecture.session)
     
     # Calculer les KPI
-    kpi = await calculer_kpi_admin()
+    kpi = await calculer_kpi_admin(lecture)
     
     # Récupérer les alertes critiques
     alertes_critiques = await db.alertes_admin.find(
@@ -3756,7 +7063,7 @@ async def get_admin_dashboard(
     ]
     
     # Statistiques par classe
-    stats_classes = await db.statistiques_classes.find().sort("classe", 1).to_list(length=None)
+    stats_classes = await lecture.db.statistiques_classes.find(session=lecture.session).sort("classe", 1).to_list(length=None)
     statistiques_classes = [StatistiqueClasse(**stat) for stat in stats_classes]
     
     # Tendances et métriques avancées
@@ -3789,7 +7096,8 @@ async def get_admin_dashboard(
         activite_recente=activite_recente,
         evenements_calendrier=evenements_calendrier,
         statistiques_classes=statistiques_classes,
-        tendances=tendances
+        tendances=tendances,
+        donnees_au=lecture.donnees_au()
     )
 
 @api_router.post("/admin/generer-donnees-demo")
@@ -3814,7 +7122,10 @@ async def generer_donnees_demo_endpoint(current_user: dict = Depends(get_current
         )
 
 @api_router.get("/admin/kpi")
-async def get_kpi_admin(current_user: dict = Depends(get_current_user)):
+async def get_kpi_admin(
+    current_user: dict = Depends(get_current_user),
+    lecture: LectureAnalytique = Depends(lecture_analytique("statistiques_admin"))
+):
     """Récupère uniquement les KPI administrateur pour des updates rapides."""
     
     if current_user.get("role") != "administrateur":
@@ -3823,9 +7134,324 @@ async def get_kpi_admin(current_user: dict = Depends(get_current_user)):
             detail="Accès réservé aux administrateurs"
         )
     
-    kpi = await calculer_kpi_admin()
+    kpi = await calculer_kpi_admin(lecture)
     return kpi
 
+# Archivage des années scolaires closes : collections {nom}_archive_{AAAA_AAAA}.
+# Les collections actives ne gardent que les années ouvertes (index de travail réduits) ;
+# les lectures filtrées par année passent par collection_pour (notes, présences) ou par
+# etapes_avec_archives (factures et paiements, dont les créances restent actives).
+TAILLE_LOT_ARCHIVAGE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+DUREE_VERROU_ARCHIVAGE = 300
+# Factures archivées : seulement les soldées ou annulées, les créances restent actives
+STATUTS_FACTURES_ARCHIVABLES = ["payee_totalement", "annulee"]
+
+# Phase de chaque archivage connu : "copie", puis "suppression" (lectures sur l'archive), puis "terminee"
+phases_archivage: Dict[str, str] = {}
+
+def nom_archive(nom: str, annee_scolaire: str) -> str:
+    return f"{nom}_archive_{annee_scolaire.replace('-', '_')}"
+
+def annee_basculee(annee_scolaire: Optional[str]) -> bool:
+    """Copie terminée : les lectures de l'année passent par son archive"""
+    return bool(annee_scolaire) and phases_archivage.get(annee_scolaire) in ("suppression", "terminee")
+
+def annees_basculees() -> List[str]:
+    return sorted((annee for annee in phases_archivage if annee_basculee(annee)), reverse=True)
+
+def collection_pour(nom: str, annee_scolaire: Optional[str] = None):
+    """Collection active, ou archive de l'année une fois sa copie terminée.
+    
+    Notes et présences seulement : les factures ouvertes (et leurs paiements) d'une année
+    archivée restent actives, leurs lectures passent par etapes_avec_archives.
+    """
+    if annee_basculee(annee_scolaire):
+        return db[nom_archive(nom, annee_scolaire)]
+    return db[nom]
+
+def etapes_avec_archives(nom: str, filtre: dict, annees: List[str]) -> List[dict]:
+    """Étapes d'agrégation (sur la collection active) lisant `filtre` aussi dans les archives des `annees` basculées.
+    
+    Pendant la purge, un document peut encore être dans les deux : dédoublonné par _id.
+    """
+    annees = [annee for annee in annees if annee_basculee(annee)]
+    etapes = [{"$match": filtre}]
+    for annee in annees:
+        etapes.append({"$unionWith": {"coll": nom_archive(nom, annee), "pipeline": [{"$match": filtre}]}})
+    if any(phases_archivage[annee] == "suppression" for annee in annees):
+        etapes += [
+            {"$group": {"_id": "$_id", "document": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$document"}}
+        ]
+    return etapes
+
+async def trouver_avec_archives(nom: str, filtre: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    """find_one dans la collection active, puis dans les archives (années les plus récentes d'abord)"""
+    document = await db[nom].find_one(filtre, projection)
+    for annee in annees_basculees():
+        if document:
+            break
+        document = await db[nom_archive(nom, annee)].find_one(filtre, projection)
+    return document
+
+def verifier_annee_ouverte(annee_scolaire: str):
+    """Les écritures sur une année archivée (ou en cours d'archivage) seraient perdues"""
+    if annee_scolaire in phases_archivage:
+        raise HTTPException(status_code=409, detail=f"L'année scolaire {annee_scolaire} est archivée")
+
+async def charger_archivages():
+    phases_archivage.clear()
+    async for archivage in db.archivages.find({}, {"phase": 1}):
+        phases_archivage[archivage["_id"]] = archivage["phase"]
+
+async def invalider_archivage(modification: dict):
+    doc = modification.get("fullDocument")
+    if doc:
+        phases_archivage[doc["_id"]] = doc["phase"]
+
+bus_invalidation.abonner("archivages", invalider_archivage)
+
+async def changer_phase_archivage(annee: str, phase: str):
+    await db.archivages.update_one(
+        {"_id": annee},
+        {"$set": {"phase": phase, f"date_{phase}": datetime.now(timezone.utc)}}
+    )
+    phases_archivage[annee] = phase
+
+async def copier_index(source, archive):
+    """Mêmes index secondaires sur l'archive que sur la collection active"""
+    async for index in source.list_indexes():
+        if index["name"] == "_id_":
+            continue
+        options = {k: v for k, v in index.items() if k not in ("v", "key", "ns")}
+        try:
+            await archive.create_index(list(index["key"].items()), **options)
+        except Exception as e:
+            logger.error(f"Index {index['name']} de {archive.name} impossible: {str(e)}")
+
+async def inserer_archive(archive, documents: List[dict]):
+    """Insertion idempotente : un lot repris après interruption ne crée pas de doublon"""
+    if not documents:
+        return
+    try:
+        await archive.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(erreur["code"] != 11000 for erreur in e.details["writeErrors"]):
+            raise
+
+class ArchivageInterrompu(Exception):
+    pass
+
+async def prolonger_verrou_archivage(annee: str, detenteur: str):
+    if not await acquerir_verrou(f"archivage:{annee}", DUREE_VERROU_ARCHIVAGE, detenteur):
+        raise ArchivageInterrompu(f"Verrou d'archivage {annee} repris par un autre worker")
+
+async def copier_par_lots(annee: str, nom: str, filtre: dict, progression: dict, detenteur: str):
+    """Copie par lots ordonnés par _id ; reprend après le dernier lot enregistré"""
+    source, archive = db[nom], db[nom_archive(nom, annee)]
+    etat = progression.get(nom, {})
+    if etat.get("copie_terminee"):
+        return
+    dernier_id, copies = etat.get("dernier_id"), etat.get("copies", 0)
+    while True:
+        filtre_lot = {**filtre, "_id": {"$gt": dernier_id}} if dernier_id is not None else filtre
+        lot = await source.find(filtre_lot).sort("_id", 1).limit(TAILLE_LOT_ARCHIVAGE).to_list(length=None)
+        if not lot:
+            break
+        await inserer_archive(archive, lot)
+        if nom == "factures":
+            # Les paiements suivent leur facture : reçus et rapprochements restent cohérents
+            paiements = await db.paiements.find({"facture_id": {"$in": [f["_id"] for f in lot]}}).to_list(length=None)
+            await inserer_archive(db[nom_archive("paiements", annee)], paiements)
+        dernier_id, copies = lot[-1]["_id"], copies + len(lot)
+        await db.archivages.update_one(
+            {"_id": annee},
+            {"$set": {f"progression.{nom}.dernier_id": dernier_id, f"progression.{nom}.copies": copies}}
+        )
+        await prolonger_verrou_archivage(annee, detenteur)
+    await db.archivages.update_one({"_id": annee}, {"$set": {f"progression.{nom}.copie_terminee": True}})
+
+async def purger_par_lots(annee: str, nom: str, progression: dict, detenteur: str):
+    """Supprime de la collection active les documents présents dans l'archive, par lots"""
+    etat = progression.get(nom, {})
+    if etat.get("suppression_terminee"):
+        return
+    archive = db[nom_archive(nom, annee)]
+    dernier_id, supprimes = etat.get("dernier_id_supprime"), etat.get("supprimes", 0)
+    while True:
+        filtre = {"_id": {"$gt": dernier_id}} if dernier_id is not None else {}
+        ids = [d["_id"] for d in await archive.find(filtre, {"_id": 1}).sort("_id", 1).limit(TAILLE_LOT_ARCHIVAGE).to_list(length=None)]
+        if not ids:
+            break
+        resultat = await db[nom].delete_many({"_id": {"$in": ids}})
+        dernier_id, supprimes = ids[-1], supprimes + resultat.deleted_count
+        await db.archivages.update_one(
+            {"_id": annee},
+            {"$set": {f"progression.{nom}.dernier_id_supprime": dernier_id, f"progression.{nom}.supprimes": supprimes}}
+        )
+        await prolonger_verrou_archivage(annee, detenteur)
+    await db.archivages.update_one({"_id": annee}, {"$set": {f"progression.{nom}.suppression_terminee": True}})
+
+def semaines_annee(annee: str, depuis: Optional[datetime] = None):
+    """Tranches hebdomadaires [début, fin[ de l'année scolaire, à partir de `depuis`"""
+    debut, fin = (instant_cours(borne) for borne in bornes_annee_scolaire(annee))
+    semaine = depuis.replace(tzinfo=timezone.utc) if depuis else debut
+    while semaine < fin:
+        suivante = min(semaine + timedelta(days=7), fin)
+        yield semaine, suivante
+        semaine = suivante
+
+async def copier_presences(annee: str, progression: dict, detenteur: str):
+    """Présences (time-series, sans index unique) : copie semaine par semaine, la semaine reprise est recopiée"""
+    etat = progression.get("presences_ts", {})
+    if etat.get("copie_terminee"):
+        return
+    archive = db[nom_archive("presences_ts", annee)]
+    copies = etat.get("copies", 0)
+    for debut, fin in semaines_annee(annee, etat.get("semaine_copiee")):
+        plage = {"date_cours": {"$gte": debut, "$lt": fin}}
+        await archive.delete_many(plage)
+        lot = []
+        async for mesure in db.presences_ts.find(plage):
+            lot.append(mesure)
+            if len(lot) >= TAILLE_LOT_ARCHIVAGE:
+                await archive.insert_many(lot, ordered=False)
+                copies, lot = copies + len(lot), []
+        if lot:
+            await archive.insert_many(lot, ordered=False)
+            copies += len(lot)
+        await db.archivages.update_one(
+            {"_id": annee},
+            {"$set": {"progression.presences_ts.semaine_copiee": fin, "progression.presences_ts.copies": copies}}
+        )
+        await prolonger_verrou_archivage(annee, detenteur)
+    await db.archivages.update_one({"_id": annee}, {"$set": {"progression.presences_ts.copie_terminee": True}})
+
+async def purger_presences(annee: str, progression: dict, detenteur: str):
+    etat = progression.get("presences_ts", {})
+    if etat.get("suppression_terminee"):
+        return
+    supprimes = etat.get("supprimes", 0)
+    for debut, fin in semaines_annee(annee, etat.get("semaine_supprimee")):
+        resultat = await db.presences_ts.delete_many({"date_cours": {"$gte": debut, "$lt": fin}})
+        supprimes += resultat.deleted_count
+        await db.archivages.update_one(
+            {"_id": annee},
+            {"$set": {"progression.presences_ts.semaine_supprimee": fin, "progression.presences_ts.supprimes": supprimes}}
+        )
+        await prolonger_verrou_archivage(annee, detenteur)
+    await db.archivages.update_one({"_id": annee}, {"$set": {"progression.presences_ts.suppression_terminee": True}})
+
+def filtre_factures_annee(annee: str) -> dict:
+    """Factures d'une année ; les anciennes factures sans annee_scolaire sont rattachées par date de création"""
+    debut, fin = bornes_annee_scolaire(annee)
+    return {"$or": [
+        {"annee_scolaire": annee},
+        {"annee_scolaire": {"$exists": False}, "date_creation": {"$gte": debut, "$lt": fin}}
+    ]}
+
+def filtres_archivage(annee: str) -> dict:
+    return {
+        "notes": {"annee_scolaire": annee},
+        "factures": {"statut": {"$in": STATUTS_FACTURES_ARCHIVABLES}, **filtre_factures_annee(annee)}
+    }
+
+async def archiver_annee(annee: str):
+    """Tâche de fond reprenable : copie vers les archives, bascule des lectures, puis purge des collections actives"""
+    # Détenteur propre à cette exécution : deux archivages d'un même worker (reprise au démarrage
+    # et requête, ou deux requêtes) s'excluent aussi
+    detenteur = f"{identifiant_worker()}:{uuid.uuid4().hex}"
+    if not await acquerir_verrou(f"archivage:{annee}", DUREE_VERROU_ARCHIVAGE, detenteur):
+        return  # Déjà en cours
+    try:
+        archivage = await db.archivages.find_one({"_id": annee})
+        if archivage["phase"] == "copie":
+            for nom in ["notes", "factures", "paiements"]:
+                await copier_index(db[nom], db[nom_archive(nom, annee)])
+            await creer_collection_presences(nom=nom_archive("presences_ts", annee))
+            await copier_index(db.presences_ts, db[nom_archive("presences_ts", annee)])
+            
+            for nom, filtre in filtres_archivage(annee).items():
+                await copier_par_lots(annee, nom, filtre, archivage.get("progression", {}), detenteur)
+            await copier_presences(annee, archivage.get("progression", {}), detenteur)
+            await changer_phase_archivage(annee, "suppression")
+            # Laisse aux autres workers le temps de router leurs lectures vers l'archive
+            await asyncio.sleep(2 * INTERVALLE_RAFRAICHISSEMENT_VERSIONS)
+        
+        archivage = await db.archivages.find_one({"_id": annee})
+        if archivage["phase"] == "suppression":
+            for nom in ["notes", "factures", "paiements"]:
+                await purger_par_lots(annee, nom, archivage.get("progression", {}), detenteur)
+            await purger_presences(annee, archivage.get("progression", {}), detenteur)
+            await changer_phase_archivage(annee, "terminee")
+            logger.info(f"Archivage de l'année {annee} terminé")
+    except ArchivageInterrompu as e:
+        logger.warning(str(e))
+    except Exception as e:
+        logger.error(f"Erreur archivage {annee}: {str(e)}")
+        await db.archivages.update_one({"_id": annee}, {"$set": {"derniere_erreur": str(e)}})
+    finally:
+        await db.verrous.delete_one({"_id": f"archivage:{annee}", "detenteur": detenteur})
+
+async def reprendre_archivages():
+    """Au démarrage : reprend les archivages interrompus (arrêt ou plantage d'un worker)"""
+    async for archivage in db.archivages.find({"phase": {"$ne": "terminee"}}, {"_id": 1}):
+        await archiver_annee(archivage["_id"])
+
+@api_router.post("/admin/archivages", status_code=202)
+async def lancer_archivage(
+    archivage_data: ArchivageCreate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """Archiver une année scolaire close (reprend un archivage interrompu)"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    annee = archivage_data.annee_scolaire
+    debut, fin = (int(a) for a in annee.split("-"))
+    if fin != debut + 1:
+        raise HTTPException(status_code=400, detail="Année scolaire invalide")
+    if annee >= annee_scolaire_de(date.today()):
+        raise HTTPException(status_code=400, detail="Seule une année scolaire close peut être archivée")
+    
+    archivage = await db.archivages.find_one_and_update(
+        {"_id": annee},
+        {"$setOnInsert": {
+            "phase": "copie",
+            "progression": {},
+            "lance_par": current_user["_id"],
+            "date_copie": datetime.now(timezone.utc)
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    phases_archivage[annee] = archivage["phase"]
+    if archivage["phase"] != "terminee":
+        background_tasks.add_task(archiver_annee, annee)
+    
+    return {"message": f"Archivage de l'année {annee} lancé", "archivage": archivage}
+
+@api_router.get("/admin/archivages")
+async def lister_archivages(current_user: dict = Depends(get_current_user)):
+    """État des archivages d'années scolaires"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    archivages = await db.archivages.find().sort("_id", -1).to_list(length=None)
+    return {"archivages": archivages, "annee_courante": annee_scolaire_de(date.today())}
+
+@api_router.get("/admin/archivages/{annee_scolaire}")
+async def obtenir_archivage(annee_scolaire: str, current_user: dict = Depends(get_current_user)):
+    """Progression de l'archivage d'une année"""
+    if current_user["role"] != "administrateur":
+        raise HTTPException(status_code=403, detail="Accès refusé - Administrateur seulement")
+    
+    archivage = await db.archivages.find_one({"_id": annee_scolaire})
+    if not archivage:
+        raise HTTPException(status_code=404, detail="Aucun archivage pour cette année")
+    return archivage
+
 # Inclusion du routeur dans l'app
 app.include_router(api_router)
 
@@ -3845,8 +7471,95 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+# Index nécessaires aux écritures groupées et aux requêtes fréquentes
+async def creer_index():
+    index = [
+        (db.presences_ts, [("metadonnees.eleve_id", 1), ("date_cours", 1)], {"name": "eleve_date"}),
+        (db.presences_ts, [("metadonnees.classe", 1), ("date_cours", 1)], {"name": "classe_date"}),
+        (db.grilles_tarifaires, [("annee_scolaire", 1), ("classe", 1)], {"unique": True, "name": "grille_unique"}),
+        (db.eleves, [("matricule", 1)], {"unique": True, "name": "matricule_unique"}),
+        (db.paiements, [("statut", 1), ("date_expiration", 1)], {"name": "statut_expiration"}),
+        (db.paiements, [("balayage_id", 1)], {"name": "balayage", "sparse": True}),
+        (db.verrous, [("expire_le", 1)], {"name": "verrou_ttl", "expireAfterSeconds": 3600}),
+        (db.jetons_revoques, [("expire_le", 1)], {"name": "revocation_ttl", "expireAfterSeconds": 0}),
+        (db.jetons_revoques, [("date_revocation", 1)], {"name": "date_revocation"}),
+        (db.limites_debit, [("expire_le", 1)], {"name": "limite_debit_ttl", "expireAfterSeconds": 0}),
+        (db.paiements, [("reference_interne", 1)], {"name": "reference_interne"}),
+        (db.paiements, [("lot_reglement", 1)], {"name": "lot_reglement", "sparse": True}),
+        (db.evenements_paiement, [("statut", 1), ("date_reception", 1)], {"name": "statut_reception"}),
+        (db.paiements, [("operateur", 1), ("date_initiation", 1)], {"name": "operateur_initiation"}),
+        (db.paiements, [("facture_id", 1), ("statut", 1)], {"name": "facture_statut"}),
+        (db.paiements, [("facture_creditee", 1)], {
+            "name": "credit_en_attente",
+            "partialFilterExpression": {"facture_creditee": False}
+        }),
+        (db.parent_child_links, [("parent_id", 1), ("actif", 1)], {"name": "parent_actif"}),
+        (db.moyennes_eleves, [("eleve_id", 1), ("annee_scolaire", 1)], {"name": "eleve_annee"}),
+        (db.notes, [("eleve_id", 1), ("annee_scolaire", 1), ("date_evaluation", -1)], {"name": "eleve_annee_date"}),
+        (db.factures, [("eleve_id", 1), ("statut", 1)], {"name": "eleve_statut"}),
+        (db.devoirs, [("classe", 1), ("actif", 1), ("date_echeance", 1)], {"name": "classe_echeance"}),
+        (db.rendus_devoirs, [("devoir_id", 1), ("eleve_id", 1)], {"name": "devoir_eleve"}),
+        (db.messages, [("destinataire_id", 1), ("lu", 1), ("archive", 1)], {"name": "destinataire_non_lus"}),
+        (db.messages, [("thread_id", 1), ("date_envoi", -1)], {"name": "fil_date"}),
+        (db.fils_messages, [("participants", 1), ("derniere_activite", -1)], {"name": "participant_activite"}),
+        (db.messages_diffuses, [("audience_cle", 1), ("date_envoi", -1)], {"name": "audience_date"}),
+        (db.messages_diffuses, [("expediteur_id", 1), ("date_envoi", -1)], {"name": "expediteur_date"}),
+        (db.lectures_diffusions, [("utilisateur_id", 1), ("audience_cle", 1), ("date_envoi", 1)], {"name": "utilisateur_audience"}),
+        (db.notifications, [("destinataire_id", 1), ("lue", 1)], {"name": "destinataire_non_lues"}),
+        (db.anomalies_rapprochement, [("rapprochement_id", 1), ("type", 1), ("ligne", 1)], {"name": "rapprochement_type"}),
+        (db.factures, [("numero_facture", 1)], {
+            "unique": True,
+            "name": "numero_facture_unique",
+            "partialFilterExpression": {"numero_facture": {"$type": "string"}}
+        }),
+        (db.factures, [("cle_facturation", 1), ("eleve_id", 1)], {
+            "unique": True,
+            "name": "facturation_trimestrielle_unique",
+            "partialFilterExpression": {"cle_facturation": {"$exists": True}}
+        }),
+    ]
+    # Les index uniques garantissent matricules, numéros de facture et facturation idempotente :
+    # sans eux (doublons hérités à corriger), le worker refuse de démarrer
+    echecs_uniques = []
+    for collection, cles, options in index:
+        try:
+            await collection.create_index(cles, **options)
+        except Exception as e:
+            logger.error(f"Création de l'index {options.get('name')} impossible: {str(e)}")
+            if options.get("unique"):
+                echecs_uniques.append(options.get("name"))
+    if echecs_uniques:
+        raise RuntimeError(f"Index uniques impossibles à créer: {', '.join(echecs_uniques)}")
+
+# Tâches de fond propres à chaque worker
+taches_arriere_plan: List[asyncio.Task] = []
+
+async def demarrer_taches_arriere_plan():
+    await creer_collection_presences()
+    await creer_index()
+    await charger_versions()
+    await cache_referentiel.charger()
+    await liste_revocation.synchroniser()
+    await charger_archivages()
+    taches_arriere_plan.append(asyncio.create_task(rafraichir_versions_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(bus_invalidation.ecouter()))
+    taches_arriere_plan.append(asyncio.create_task(balayer_paiements_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(traiter_file_reglements()))
+    taches_arriere_plan.append(asyncio.create_task(reprendre_reglements_en_attente()))
+    taches_arriere_plan.append(asyncio.create_task(reprendre_rapprochements_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(surveiller_notifications_messages()))
+    taches_arriere_plan.append(asyncio.create_task(reconcilier_badges_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(reconcilier_moyennes_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(synchroniser_revocations_periodiquement()))
+    taches_arriere_plan.append(asyncio.create_task(reprendre_archivages()))
+
+async def arreter_worker():
+    for tache in taches_arriere_plan:
+        tache.cancel()
+    await asyncio.gather(*taches_arriere_plan, return_exceptions=True)
+    taches_arriere_plan.clear()
+    if executeur_pdf is not None:
+        executeur_pdf.shutdown(wait=False, cancel_futures=True)
     client.close()
 
 # Route de test
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Simulateur local d'opérateur mobile (Orange Money / MTN) pour École Smart
+
+Rejoue des confirmations de paiement signées vers /api/paiements/callback/{operateur}
+à haut débit, pour tester la charge et l'idempotence de l'ingestion.
+
+Exemples :
+    python simulateur_operateur.py --nombre 5000 --concurrence 200
+    python simulateur_operateur.py --depuis-base --operateur mtn --doublons 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv()
+
+# Configuration
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'test_database')
+BACKEND_URL = os.environ.get('BACKEND_URL', 'http://localhost:8001')
+
+class SimulateurOperateur:
+    def __init__(self, operateur: str, secret: str, url: str, concurrence: int):
+        self.operateur = operateur
+        self.secret = secret.encode("utf-8")
+        self.url = f"{url}/api/paiements/callback/{operateur}"
+        self.concurrence = concurrence
+        self.semaphore = asyncio.Semaphore(concurrence)
+        self.latences = []
+        self.codes = {}
+        self.doublons = 0
+
+    async def charger_paiements(self, nombre: int):
+        """Paiements initiés réels de la base, pour que les règlements aboutissent"""
+        client = AsyncIOMotorClient(MONGO_URL)
+        paiements = await client[DB_NAME].paiements.find(
+            {"statut": "initie", "operateur": self.operateur.upper()},
+            {"reference_interne": 1, "montant": 1}
+        ).limit(nombre).to_list(length=None)
+        client.close()
+        return [(p["reference_interne"], p["montant"]) for p in paiements]
+
+    def paiements_synthetiques(self, nombre: int):
+        """Références inventées : mesure l'ingestion seule (les événements seront ignorés)"""
+        return [
+            (f"PAY_SIM_{uuid.uuid4().hex[:12].upper()}", float(random.randint(1, 50) * 10000))
+            for _ in range(nombre)
+        ]
+
+    def corps_callback(self, reference_interne: str, montant: float, reference_operateur: str) -> bytes:
+        return json.dumps({
+            "reference_interne": reference_interne,
+            "reference_operateur": reference_operateur,
+            "statut": "reussi",
+            "montant": montant,
+            "date_transaction": datetime.now(timezone.utc).isoformat()
+        }).encode("utf-8")
+
+    async def envoyer(self, client: httpx.AsyncClient, corps: bytes):
+        signature = hmac.new(self.secret, corps, hashlib.sha256).hexdigest()
+        async with self.semaphore:
+            debut = time.perf_counter()
+            try:
+                reponse = await client.post(
+                    self.url,
+                    content=corps,
+                    headers={"Content-Type": "application/json", "X-Signature": signature}
+                )
+                code = reponse.status_code
+                if code == 200 and reponse.json().get("doublon"):
+                    self.doublons += 1
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            self.latences.append(time.perf_counter() - debut)
+            self.codes[code] = self.codes.get(code, 0) + 1
+
+    async def rejouer(self, paiements, taux_doublons: float, debit: float):
+        corps = []
+        for reference_interne, montant in paiements:
+            reference_operateur = f"TXN_{uuid.uuid4().hex[:12].upper()}"
+            corps.append(self.corps_callback(reference_interne, montant, reference_operateur))
+            # Les opérateurs renvoient parfois la même notification
+            if random.random() < taux_doublons:
+                corps.append(corps[-1])
+        random.shuffle(corps)
+
+        limites = httpx.Limits(max_connections=self.concurrence, max_keepalive_connections=self.concurrence)
+        async with httpx.AsyncClient(timeout=30.0, limits=limites) as client:
+            debut = time.perf_counter()
+            taches = []
+            for i, contenu in enumerate(corps):
+                if debit:
+                    attente = debut + i / debit - time.perf_counter()
+                    if attente > 0:
+                        await asyncio.sleep(attente)
+                taches.append(asyncio.create_task(self.envoyer(client, contenu)))
+            await asyncio.gather(*taches)
+            duree = time.perf_counter() - debut
+
+        self.afficher_rapport(len(corps), duree)
+
+    def afficher_rapport(self, total: int, duree: float):
+        latences = sorted(self.latences)
+
+        def centile(p):
+            return latences[min(len(latences) - 1, int(len(latences) * p))] * 1000 if latences else 0
+
+        print(f"📨 Callbacks envoyés : {total} en {duree:.2f} s ({total / duree:.0f}/s)")
+        print(f"⏱️  Latence p50={centile(0.50):.1f} ms  p95={centile(0.95):.1f} ms  p99={centile(0.99):.1f} ms")
+        print(f"🔁 Doublons détectés par le serveur : {self.doublons}")
+        print(f"📊 Codes de réponse : {self.codes}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Simulateur local de callbacks Orange Money / MTN")
+    parser.add_argument("--operateur", choices=["orange", "mtn"], default="orange")
+    parser.add_argument("--url", default=BACKEND_URL)
+    parser.add_argument("--secret", default=None, help="Secret HMAC (par défaut ORANGE_CALLBACK_SECRET / MTN_CALLBACK_SECRET)")
+    parser.add_argument("--nombre", type=int, default=1000, help="Nombre de transactions à confirmer")
+    parser.add_argument("--concurrence", type=int, default=100, help="Requêtes simultanées")
+    parser.add_argument("--debit", type=float, default=0, help="Requêtes par seconde (0 = sans limite)")
+    parser.add_argument("--doublons", type=float, default=0.0, help="Proportion de notifications renvoyées deux fois")
+    parser.add_argument("--depuis-base", action="store_true", help="Confirmer les paiements initiés présents en base")
+    args = parser.parse_args()
+
+    secret = args.secret or os.environ.get(f"{args.operateur.upper()}_CALLBACK_SECRET")
+    if not secret:
+        print("❌ Aucun secret de signature configuré")
+        return
+
+    simulateur = SimulateurOperateur(args.operateur, secret, args.url, args.concurrence)
+    if args.depuis_base:
+        paiements = await simulateur.charger_paiements(args.nombre)
+        print(f"ℹ️  {len(paiements)} paiements initiés chargés depuis la base")
+    else:
+        paiements = simulateur.paiements_synthetiques(args.nombre)
+
+    if not paiements:
+        print("ℹ️  Aucun paiement à confirmer")
+        return
+
+    await simulateur.rejouer(paiements, args.doublons, args.debit)
+
+if __name__ == "__main__":
+    asyncio.run(main())
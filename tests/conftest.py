@@ -0,0 +1,128 @@
+"""
+Fixtures communes des tests du backend École Smart
+
+Les tests unitaires importent server directement (aucune connexion Mongo à l'import).
+Les tests d'intégration lancent un vrai serveur uvicorn sur une base jetable et
+exigent un replica set Mongo (flux de modifications) :
+
+    MONGO_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs_ecole" python -m pytest tests
+    (voir backend/replica_set_local.py pour démarrer un replica set local)
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import jwt
+import pytest
+from pymongo import MongoClient
+
+DOSSIER_BACKEND = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(DOSSIER_BACKEND))
+
+# server lit ces variables à l'import ; les tests unitaires ne se connectent jamais
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_unitaires")
+
+SECRET_TESTS = "secret-des-tests"
+BATTEMENT_TESTS = 1.0  # Secondes entre deux battements du canal temps réel
+
+def port_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture(scope="session")
+def url_replica_set() -> str:
+    url = os.environ.get("MONGO_URL", "")
+    if "replicaSet" not in url:
+        pytest.skip("MONGO_URL doit désigner un replica set (paramètre replicaSet)")
+    try:
+        MongoClient(url, serverSelectionTimeoutMS=2000).admin.command("ping")
+    except Exception as e:
+        pytest.skip(f"Replica set injoignable: {e}")
+    return url
+
+@pytest.fixture(scope="session")
+def serveur(url_replica_set):
+    """Serveur uvicorn sur une base jetable ; retourne (URL de l'API, base pymongo)"""
+    nom_base = f"test_{uuid.uuid4().hex[:12]}"
+    port = port_libre()
+    environnement = {
+        **os.environ,
+        "MONGO_URL": url_replica_set,
+        "DB_NAME": nom_base,
+        "SECRET_KEY": SECRET_TESTS,
+        "REALTIME_HEARTBEAT_SECONDS": str(BATTEMENT_TESTS),
+    }
+    processus = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=DOSSIER_BACKEND, env=environnement
+    )
+    url = f"http://127.0.0.1:{port}"
+    client_mongo = MongoClient(url_replica_set)
+    try:
+        debut = time.monotonic()
+        while True:
+            if processus.poll() is not None:
+                pytest.fail("Le serveur s'est arrêté au démarrage")
+            try:
+                if httpx.get(f"{url}/api/", timeout=1.0).status_code < 500:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() - debut > 30:
+                pytest.fail("Pas de réponse du serveur après 30 s")
+            time.sleep(0.2)
+        yield url, client_mongo[nom_base]
+    finally:
+        processus.terminate()
+        try:
+            processus.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            processus.kill()
+        client_mongo.drop_database(nom_base)
+        client_mongo.close()
+
+def creer_utilisateur(base, role: str) -> dict:
+    """Utilisateur inséré directement en base, avec un jeton d'accès signé comme par l'API"""
+    utilisateur_id = str(uuid.uuid4())
+    email = f"{role}.{utilisateur_id[:8]}@ecole-smart.gn"
+    base.users.insert_one({
+        "_id": utilisateur_id,
+        "email": email,
+        "nom": "TEST",
+        "prenoms": role.capitalize(),
+        "role": role,
+        "actif": True,
+        "date_creation": datetime.now(timezone.utc)
+    })
+    jeton = jwt.encode(
+        {
+            "sub": email,
+            "exp": datetime.now(timezone.utc) + timedelta(hours=1),
+            "iat": time.time(),
+            "jti": uuid.uuid4().hex
+        },
+        SECRET_TESTS,
+        algorithm="HS256"
+    )
+    return {"_id": utilisateur_id, "email": email, "jeton": jeton}
+
+@pytest.fixture
+def utilisateur(serveur):
+    """Parent avec un jeton d'accès valide"""
+    _, base = serveur
+    return creer_utilisateur(base, "parent")
+
+@pytest.fixture
+def enseignant(serveur):
+    """Enseignant avec un jeton d'accès valide, sans classe à l'emploi du temps"""
+    _, base = serveur
+    return creer_utilisateur(base, "enseignant")
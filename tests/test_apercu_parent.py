@@ -0,0 +1,50 @@
+"""
+Vue d'ensemble parent (/api/parents/apercu) contre un vrai replica set Mongo
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+def test_apercu_compte_absences_justifiees_par_motif(serveur, utilisateur):
+    url, base = serveur
+    eleve_id = str(uuid.uuid4())
+    base.eleves.insert_one({
+        "_id": eleve_id,
+        "nom": "TEST",
+        "prenoms": "Élève",
+        "classe": "6ème A",
+        "matricule": f"MAT-{eleve_id[:8]}",
+        "statut_inscription": True
+    })
+    base.parent_child_links.insert_one({
+        "_id": str(uuid.uuid4()),
+        "parent_id": utilisateur["_id"],
+        "eleve_id": eleve_id,
+        "relation": "pere",
+        "actif": True
+    })
+    metadonnees = {"eleve_id": eleve_id, "classe": "6ème A"}
+    base.presences_ts.insert_many([
+        {"date_cours": datetime(2024, 10, 1, tzinfo=timezone.utc), "metadonnees": metadonnees,
+         "matiere": "Mathématiques", "present": True},
+        {"date_cours": datetime(2024, 10, 2, tzinfo=timezone.utc), "metadonnees": metadonnees,
+         "matiere": "Mathématiques", "present": False},
+        {"date_cours": datetime(2024, 10, 3, tzinfo=timezone.utc), "metadonnees": metadonnees,
+         "matiere": "Mathématiques", "present": False, "motif_absence": "Maladie"},
+    ])
+
+    reponse = httpx.get(
+        f"{url}/api/parents/apercu",
+        params={"annee_scolaire": "2024-2025"},
+        headers={"Authorization": f"Bearer {utilisateur['jeton']}"},
+        timeout=10.0
+    )
+    assert reponse.status_code == 200
+    presences = reponse.json()["enfants"][0]["presences"]
+    assert presences["total_cours"] == 3
+    assert presences["absences"] == 2
+    # L'absence avec motif est justifiée
+    assert presences["absences_non_justifiees"] == 1
+    assert presences["derniere_absence"] == "2024-10-03"
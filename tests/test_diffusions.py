@@ -0,0 +1,32 @@
+"""
+Diffusions (/api/messages/diffusions) contre un vrai replica set Mongo
+"""
+
+import uuid
+
+import httpx
+
+def diffuser(url: str, jeton: str, classe: str) -> httpx.Response:
+    return httpx.post(
+        f"{url}/api/messages/diffusions",
+        json={"sujet": "Sortie scolaire", "contenu": "Autorisation à signer", "audience": "classe", "classe": classe},
+        headers={"Authorization": f"Bearer {jeton}"},
+        timeout=10.0
+    )
+
+def test_enseignant_diffuse_seulement_a_ses_classes(serveur, enseignant):
+    url, base = serveur
+    base.emplois_du_temps.insert_one({
+        "_id": str(uuid.uuid4()),
+        "classe": "6ème A",
+        "enseignant_id": enseignant["_id"],
+        "matiere": "Mathématiques"
+    })
+
+    reponse = diffuser(url, enseignant["jeton"], "6ème A")
+    assert reponse.status_code == 200
+    assert reponse.json()["audience"] == "classe:6ème A"
+
+    refus = diffuser(url, enseignant["jeton"], "Terminale C")
+    assert refus.status_code == 403
+    assert base.messages_diffuses.count_documents({"audience_cle": "classe:Terminale C"}) == 0
@@ -0,0 +1,121 @@
+"""
+Canal temps réel (SSE et WebSocket) contre un vrai replica set Mongo
+
+Connexion et état initial, réception d'une notification insérée en base (flux de
+modifications), battement de cœur, refus d'un jeton invalide.
+"""
+
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+from websockets.sync.client import connect
+
+from tests.conftest import BATTEMENT_TESTS
+
+DELAI_MAX = 10.0  # Secondes d'attente d'un événement
+
+def inserer_notification(base, destinataire_id: str) -> str:
+    notification_id = str(uuid.uuid4())
+    base.notifications.insert_one({
+        "_id": notification_id,
+        "destinataire_id": destinataire_id,
+        "titre": "Test temps réel",
+        "message": "Notification insérée par le test",
+        "type_notification": "info",
+        "lue": False,
+        "date_creation": datetime.now(timezone.utc)
+    })
+    return notification_id
+
+def url_websocket(url: str, jeton: str) -> str:
+    return f"{url.replace('http://', 'ws://')}/api/notifications/ws?token={jeton}"
+
+def attendre_ws(ws, type_attendu: str) -> dict:
+    fin = time.monotonic() + DELAI_MAX
+    while time.monotonic() < fin:
+        evenement = json.loads(ws.recv(timeout=fin - time.monotonic()))
+        if evenement["type"] == type_attendu:
+            return evenement
+    pytest.fail(f"Aucun événement {type_attendu} reçu")
+
+def evenements_sse(reponse):
+    """(type, données) de chaque événement SSE ; les commentaires sont des battements"""
+    type_evenement, donnees = None, None
+    for ligne in reponse.iter_lines():
+        if ligne.startswith(":"):
+            yield "battement", None
+        elif ligne.startswith("event: "):
+            type_evenement = ligne[len("event: "):]
+        elif ligne.startswith("data: "):
+            donnees = json.loads(ligne[len("data: "):])
+        elif ligne == "" and type_evenement:
+            yield type_evenement, donnees
+            type_evenement, donnees = None, None
+
+def attendre_sse(evenements, type_attendu: str):
+    fin = time.monotonic() + DELAI_MAX
+    for type_evenement, donnees in evenements:
+        if type_evenement == type_attendu:
+            return donnees
+        if time.monotonic() > fin:
+            break
+    pytest.fail(f"Aucun événement {type_attendu} reçu")
+
+def test_websocket_etat_initial(serveur, utilisateur):
+    url, _ = serveur
+    with connect(url_websocket(url, utilisateur["jeton"])) as ws:
+        etat = attendre_ws(ws, "etat")
+    assert etat["notifications_non_lues"] == 0
+    assert etat["messages_non_lus"] == 0
+
+def test_websocket_recoit_insertion(serveur, utilisateur):
+    url, base = serveur
+    with connect(url_websocket(url, utilisateur["jeton"])) as ws:
+        attendre_ws(ws, "etat")  # Abonné au diffuseur avant l'insertion
+        notification_id = inserer_notification(base, utilisateur["_id"])
+        evenement = attendre_ws(ws, "notification")
+    assert evenement["notification"]["_id"] == notification_id
+    assert evenement["notification"]["titre"] == "Test temps réel"
+
+def test_websocket_battement(serveur, utilisateur):
+    url, _ = serveur
+    with connect(url_websocket(url, utilisateur["jeton"])) as ws:
+        attendre_ws(ws, "etat")
+        debut = time.monotonic()
+        attendre_ws(ws, "battement")
+    assert time.monotonic() - debut < BATTEMENT_TESTS + 2
+
+def test_websocket_jeton_invalide(serveur):
+    url, _ = serveur
+    # Fermeture 1008 avant l'acceptation : refus dès la poignée de main
+    with pytest.raises((InvalidStatus, ConnectionClosed)):
+        with connect(url_websocket(url, "jeton-invalide")) as ws:
+            ws.recv(timeout=DELAI_MAX)
+
+def test_sse_etat_insertion_et_battement(serveur, utilisateur):
+    url, base = serveur
+    with httpx.stream(
+        "GET", f"{url}/api/notifications/flux", params={"token": utilisateur["jeton"]}, timeout=DELAI_MAX
+    ) as reponse:
+        assert reponse.status_code == 200
+        assert reponse.headers["content-type"].startswith("text/event-stream")
+        evenements = evenements_sse(reponse)
+
+        etat = attendre_sse(evenements, "etat")
+        assert etat["notifications_non_lues"] == 0
+
+        notification_id = inserer_notification(base, utilisateur["_id"])
+        evenement = attendre_sse(evenements, "notification")
+        assert evenement["notification"]["_id"] == notification_id
+
+        attendre_sse(evenements, "battement")
+
+def test_sse_jeton_invalide(serveur):
+    url, _ = serveur
+    reponse = httpx.get(f"{url}/api/notifications/flux", params={"token": "jeton-invalide"}, timeout=DELAI_MAX)
+    assert reponse.status_code == 401
@@ -0,0 +1,194 @@
+"""
+Tests unitaires des fonctions pures du serveur (sans base de données)
+"""
+
+import asyncio
+import hashlib
+import hmac
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+def test_evenement_temps_reel():
+    insertion = {
+        "operationType": "insert",
+        "ns": {"coll": "notifications"},
+        "fullDocument": {"_id": "n1", "destinataire_id": "u1", "titre": "Titre", "lue": False}
+    }
+    destinataire, evenement = server.evenement_temps_reel(insertion)
+    assert destinataire == "u1"
+    assert evenement["type"] == "notification"
+    assert evenement["notification"]["_id"] == "n1"
+
+    lecture = {
+        "operationType": "update",
+        "ns": {"coll": "messages"},
+        "fullDocument": {"_id": "m1", "destinataire_id": "u2"},
+        "updateDescription": {"updatedFields": {"lu": True}}
+    }
+    assert server.evenement_temps_reel(lecture) == ("u2", {"type": "message_lu", "message_id": "m1"})
+    assert server.evenement_temps_reel({**lecture, "updateDescription": {"updatedFields": {"archive": True}}}) is None
+
+def test_diffuseur_temps_reel_client_lent():
+    async def scenario():
+        diffuseur = server.DiffuseurTempsReel()
+        file = diffuseur.abonner("u1", ["tous"])
+        for i in range(server.TAILLE_FILE_CONNEXION + 1):
+            diffuseur.publier("u1", {"type": "notification", "i": i})
+        # File pleine : vidée et remplacée par une demande de resynchronisation
+        assert file.qsize() == 1
+        assert file.get_nowait() == {"type": "resynchroniser"}
+
+        diffuseur.publier_audience("tous", {"type": "diffusion"})
+        assert file.get_nowait() == {"type": "diffusion"}
+        diffuseur.desabonner("u1", file)
+        assert not diffuseur.connexions and not diffuseur.audiences
+
+    asyncio.run(scenario())
+
+def test_cache_referentiel_matieres_homonymes():
+    cache = server.CacheReferentiel()
+    cache.enregistrer("matieres", {"_id": "m1", "nom": "Sciences", "code": "SVT"})
+    cache.enregistrer("matieres", {"_id": "m2", "nom": "Sciences", "code": "PC"})
+    # Aucune matière perdue, le code reste la clé
+    assert sorted(m["code"] for m in cache.liste_matieres()) == ["PC", "SVT"]
+    assert cache.matiere("PC")["_id"] == "m2"
+    assert cache.matiere("Sciences")["_id"] == "m1"
+    # Réécriture d'une matière : remplacée, pas dupliquée
+    cache.enregistrer("matieres", {"_id": "m1", "nom": "Sciences", "code": "SVT", "coefficient": 2})
+    assert len(cache.matieres_par_nom["Sciences"]) == 2
+
+class CollectionEnMemoire:
+    """Collection minimale pour Chargeur : find({"_id": {"$in": ...}}).to_list()"""
+    def __init__(self, documents):
+        self.documents = {d["_id"]: d for d in documents}
+        self.requetes = 0
+
+    def find(self, filtre):
+        self.requetes += 1
+        trouves = [self.documents[i] for i in filtre["_id"]["$in"] if i in self.documents]
+
+        class Curseur:
+            async def to_list(self, length=None):
+                await asyncio.sleep(0)
+                return trouves
+        return Curseur()
+
+def test_chargeur_oublier_pendant_un_lot():
+    async def scenario():
+        collection = CollectionEnMemoire([{"_id": "e1", "nom": "A"}, {"_id": "e2", "nom": "B"}])
+        chargeur = server.Chargeur(collection)
+        premier, second = chargeur.charger("e1"), chargeur.charger("e2")
+        await asyncio.sleep(0)  # Lot lancé
+        chargeur.oublier("e1")  # Écriture pendant la lecture
+        documents = await asyncio.wait_for(asyncio.gather(premier, second), timeout=1)
+        assert [d["nom"] for d in documents] == ["A", "B"]
+        assert collection.requetes == 1
+        assert not chargeur.taches
+
+    asyncio.run(scenario())
+
+def test_verifier_signature_callback(monkeypatch):
+    monkeypatch.setitem(server.SECRETS_CALLBACK, "orange", "secret-orange")
+    corps = b'{"reference_interne": "PAY_1"}'
+    signature = hmac.new(b"secret-orange", corps, hashlib.sha256).hexdigest()
+    assert server.verifier_signature_callback("orange", corps, signature)
+    assert server.verifier_signature_callback("orange", corps, f" {signature.upper()} ")
+    assert not server.verifier_signature_callback("orange", corps + b" ", signature)
+    assert not server.verifier_signature_callback("orange", corps, None)
+    monkeypatch.setitem(server.SECRETS_CALLBACK, "mtn", None)
+    assert not server.verifier_signature_callback("mtn", corps, signature)
+
+def test_lire_montant_releve():
+    assert server.lire_montant_releve("1 500,50") == 1500.5
+    assert server.lire_montant_releve(" 25 000") == 25000
+    assert server.lire_montant_releve("abc") is None
+    assert server.lire_montant_releve(None) is None
+
+def test_moyennes_depuis_notes_meme_calcul_que_l_api():
+    notes = [
+        {"trimestre": "T1", "matiere": "Mathématiques", "note": 12, "coefficient": 2},
+        {"trimestre": "T1", "matiere": "Mathématiques", "note": 14, "coefficient": 2},
+        {"trimestre": "T1", "matiere": "Français", "note": 10, "coefficient": 1},
+    ]
+    moyennes, generale = server.moyennes_depuis_notes(notes)
+    par_matiere = {m["matiere"]: m for m in moyennes}
+    # $avg de note x coefficient, comme le pipeline de /notes/moyennes
+    assert par_matiere["Mathématiques"]["moyenne"] == 26.0
+    assert par_matiere["Mathématiques"]["coefficient_total"] == 4
+    assert par_matiere["Français"]["moyenne"] == 10.0
+    assert generale == round((26.0 * 4 + 10.0 * 1) / 5, 2)
+    assert server.moyennes_depuis_notes([]) == ([], 0)
+
+def test_bornes_annee_scolaire():
+    assert server.bornes_annee_scolaire("2024-2025") == ("2024-09-01", "2025-09-01")
+
+def test_liste_revocation():
+    liste = server.ListeRevocation()
+    liste.ajouter("actif", datetime.now(timezone.utc) + timedelta(hours=1))
+    liste.ajouter("expire", datetime.now(timezone.utc) - timedelta(seconds=1))
+    assert liste.est_revoque("actif")
+    assert not liste.est_revoque(None)
+    liste.purger()
+    assert "expire" not in liste.expirations
+    assert liste.est_revoque("actif")
+
+def test_limiteur_debit_memoire(monkeypatch):
+    monkeypatch.setitem(server.LIMITES_DEBIT, ("connexion", "compte"), (2, 60.0))
+    limiteur = server.LimiteurDebit("memoire")
+
+    async def tentatives():
+        await limiteur.verifier("connexion", compte="Parent@Ecole.gn")
+        await limiteur.verifier("connexion", compte="parent@ecole.gn")
+        with pytest.raises(HTTPException) as refus:
+            await limiteur.verifier("connexion", compte="parent@ecole.gn")
+        # Une autre clé garde son propre compteur
+        await limiteur.verifier("connexion", compte="autre@ecole.gn")
+        return refus.value
+
+    refus = asyncio.run(tentatives())
+    assert refus.status_code == 429
+    assert 1 <= int(refus.headers["Retry-After"]) <= 60
+
+def test_instant_cours_et_mesure_presence():
+    assert server.instant_cours("2024-09-02") == datetime(2024, 9, 2, tzinfo=timezone.utc)
+    assert server.instant_cours(date(2024, 9, 2)) == server.instant_cours("2024-09-02T10:00:00")
+
+    mesure = server.mesure_presence("e1", "6ème A", "2024-09-02", "Mathématiques", True)
+    assert mesure["metadonnees"] == {"eleve_id": "e1", "classe": "6ème A"}
+    assert "motif_absence" not in mesure
+    presence = server.presence_pour_api({**mesure, "_id": "m1"})
+    assert presence["eleve_id"] == "e1"
+    assert presence["date_cours"] == "2024-09-02"
+    assert presence["motif_absence"] is None
+
+def test_annee_scolaire_de():
+    assert server.annee_scolaire_de(date(2024, 9, 1)) == "2024-2025"
+    assert server.annee_scolaire_de(date(2025, 8, 31)) == "2024-2025"
+    assert server.annee_scolaire_de(date(2025, 1, 15)) == "2024-2025"
+
+def test_archives_et_routage(monkeypatch):
+    assert server.nom_archive("notes", "2023-2024") == "notes_archive_2023_2024"
+    monkeypatch.setattr(server, "phases_archivage", {"2022-2023": "copie", "2021-2022": "terminee"})
+    # Écritures refusées dès le début de l'archivage
+    with pytest.raises(HTTPException) as refus:
+        server.verifier_annee_ouverte("2022-2023")
+    assert refus.value.status_code == 409
+    server.verifier_annee_ouverte("2024-2025")
+    assert server.annees_basculees() == ["2021-2022"]
+
+    # Factures et paiements : collection active complétée par l'archive, dédoublonnée pendant la purge
+    filtre = {"statut": "reussi"}
+    assert server.etapes_avec_archives("paiements", filtre, ["2024-2025", "2022-2023"]) == [{"$match": filtre}]
+    assert server.etapes_avec_archives("paiements", filtre, ["2021-2022"]) == [
+        {"$match": filtre},
+        {"$unionWith": {"coll": "paiements_archive_2021_2022", "pipeline": [{"$match": filtre}]}}
+    ]
+    monkeypatch.setitem(server.phases_archivage, "2021-2022", "suppression")
+    assert server.etapes_avec_archives("paiements", filtre, ["2021-2022"])[-1] == {"$replaceRoot": {"newRoot": "$document"}}
+
+    legacy = server.filtre_factures_annee("2023-2024")["$or"][1]
+    assert legacy["date_creation"] == {"$gte": "2023-09-01", "$lt": "2024-09-01"}